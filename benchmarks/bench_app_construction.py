@@ -0,0 +1,56 @@
+"""
+Benchmarks loading a Doc with many readings per variation unit and dense relations.
+
+It compares the time to find the relation types for every pair of readings with the index built by App
+against scanning every relation element for every pair (as App did previously).
+
+Run from the root of the repository with:
+
+    python -m benchmarks.bench_app_construction
+"""
+import time
+import tempfile
+from pathlib import Path
+
+from rdgai.apparatus import Doc
+from tests.util import make_synthetic_tei
+
+
+def scan_pair_types(app) -> dict:
+    """ Finds the relation types for every pair by scanning all the relation elements for each pair. """
+    relation_elements = [relation for relations in app.relation_index.values() for relation in relations]
+    result = {}
+    for active in app.readings:
+        for passive in app.readings:
+            if active is passive:
+                continue
+            types = set()
+            for relation_element in relation_elements:
+                if relation_element.attrib.get("active") == active.n and relation_element.attrib.get("passive") == passive.n:
+                    types.update(relation_element.attrib.get("ana", "").split())
+            result[(active.n, passive.n)] = types
+    return result
+
+
+def main():
+    print(f"{'readings':>8} {'pairs':>8} {'load (s)':>10} {'scan (s)':>10}")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for readings in [25, 50, 75]:
+            path = Path(tmpdir) / f"synthetic-{readings}.xml"
+            path.write_text(make_synthetic_tei(apps=2, readings=readings))
+
+            start = time.perf_counter()
+            doc = Doc(path)
+            load_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for app in doc.apps:
+                scan_pair_types(app)
+            scan_time = time.perf_counter() - start
+
+            pairs = sum(len(app.pairs) for app in doc.apps)
+            print(f"{readings:>8} {pairs:>8} {load_time:>10.3f} {scan_time:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""
+Benchmarks loading a Doc where the app elements have no xml:id or n attribute.
+
+It compares loading the document (which names all the apps in a single pass) against naming each app
+by enumerating all the apps in its `ab` (as App did previously), which is quadratic in the number of apps.
+
+Run from the root of the repository with:
+
+    python -m benchmarks.bench_app_naming
+"""
+import time
+import tempfile
+from pathlib import Path
+
+from rdgai.apparatus import Doc
+from rdgai.tei import find_elements, find_parent
+from tests.util import make_synthetic_tei
+
+
+def enumerate_names(doc:Doc) -> list[str]:
+    """ Names each app by finding its position among all the apps in its ab. """
+    names = []
+    for app in doc.apps:
+        ab = find_parent(app.element, "ab")
+        for index, element in enumerate(find_elements(ab, ".//app")):
+            if element == app.element:
+                names.append(f"{ab.attrib.get('n', '')}-{index+1}")
+                break
+    return names
+
+
+def main():
+    print(f"{'apps':>8} {'load (s)':>10} {'enumerate (s)':>14}")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for apps in [500, 1000, 2000]:
+            path = Path(tmpdir) / f"synthetic-{apps}.xml"
+            path.write_text(make_synthetic_tei(apps=apps, readings=3, classified=False, named=False))
+
+            start = time.perf_counter()
+            doc = Doc(path)
+            names = [str(app) for app in doc.apps]
+            load_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            assert enumerate_names(doc) == names
+            enumerate_time = time.perf_counter() - start
+
+            print(f"{apps:>8} {load_time:>10.3f} {enumerate_time:>14.3f}")
+
+
+if __name__ == "__main__":
+    main()
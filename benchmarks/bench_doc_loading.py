@@ -0,0 +1,43 @@
+"""
+Benchmarks loading a large Doc eagerly and lazily.
+
+In lazy mode only the XML is parsed and the app elements are named. The apps are built when they are accessed.
+
+Run from the root of the repository with:
+
+    python -m benchmarks.bench_doc_loading
+"""
+import time
+import tempfile
+from pathlib import Path
+
+from lxml import etree as ET
+
+from rdgai.apparatus import Doc
+from tests.util import make_synthetic_tei
+
+
+def main():
+    print(f"{'apps':>8} {'parse (s)':>10} {'lazy (s)':>10} {'eager (s)':>10}")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for apps in [1000, 5000, 10000]:
+            path = Path(tmpdir) / f"synthetic-{apps}.xml"
+            path.write_text(make_synthetic_tei(apps=apps, readings=4))
+
+            start = time.perf_counter()
+            ET.parse(str(path))
+            parse_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            Doc(path, lazy=True)
+            lazy_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            Doc(path)
+            eager_time = time.perf_counter() - start
+
+            print(f"{apps:>8} {parse_time:>10.3f} {lazy_time:>10.3f} {eager_time:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
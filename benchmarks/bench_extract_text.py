@@ -0,0 +1,90 @@
+"""
+Benchmarks extracting text from a TEI file the size of the `arb.xml` test data.
+
+It compares the recursive implementation of `extract_text` (as it was previously, resolving each `ref` with an XPath query)
+against the non-recursive implementation with and without a cache shared across calls.
+Each pass extracts the text of every app and of every child of every `ab` once for each app in it,
+which is what finding the context of every app requires.
+
+Run from the root of the repository with:
+
+    python -m benchmarks.bench_extract_text
+"""
+import re
+import time
+from pathlib import Path
+
+from rdgai.tei import read_tei, find_element, find_elements, extract_text, TextCache
+
+TEST_DATA = Path(__file__).parent.parent / "tests" / "test-data"
+
+
+def recursive_extract_text(node, include_tail:bool=True, sep:str=" ") -> str:
+    """ The previous implementation of `extract_text`. """
+    if node is None:
+        return ""
+    if isinstance(node.tag, str):
+        tag = re.sub(r"{.*}", "", node.tag)
+    else:
+        return ""
+
+    if tag in ["pc", "witDetail", "note"]:
+        return ""
+    if tag == "app":
+        lemma = find_element(node, ".//lem")
+        if lemma is None:
+            lemma = find_element(node, ".//rdg")
+        return recursive_extract_text(lemma) or ""
+    if tag == "ref":
+        root = node.getroottree().getroot()
+        target_id = node.attrib['target'].lstrip("#")
+        target = root.xpath(f"//*[@xml:id='{target_id}']")
+        if target:
+            return recursive_extract_text(target[0])
+
+    if tag == "w":
+        sep = ""
+
+    text = node.text or ""
+    for child in node:
+        text += sep + recursive_extract_text(child, sep=sep)
+
+    if include_tail and node.tail:
+        text += sep + node.tail
+
+    return text.strip()
+
+
+def extract_all(tree, function) -> int:
+    total = 0
+    for ab in find_elements(tree, ".//ab"):
+        for app in find_elements(ab, ".//app"):
+            total += len(function(app))
+            for child in ab:
+                total += len(function(child))
+    return total
+
+
+def timed(function, *args) -> tuple[float,int]:
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    path = TEST_DATA / "arb.xml"
+    tree = read_tei(path)
+
+    recursive_time, expected = timed(extract_all, tree, recursive_extract_text)
+    uncached_time, result = timed(extract_all, tree, extract_text)
+    assert result == expected
+    cache = TextCache()
+    cached_time, result = timed(extract_all, tree, lambda node: extract_text(node, cache=cache))
+    assert result == expected
+
+    print(f"{'file':>10} {'recursive (s)':>14} {'uncached (s)':>13} {'cached (s)':>11}")
+    print(f"{path.name:>10} {recursive_time:>14.3f} {uncached_time:>13.3f} {cached_time:>11.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Benchmarks building the distance matrix used to select representative examples of a relation type.
+
+It compares filling the matrix with a Python loop of Levenshtein distances (as RelationType did previously)
+against computing it in bulk with rapidfuzz. It also times selecting medoids again after adding one pair
+by rebuilding the matrix and by updating a MedoidSelector.
+
+Run from the root of the repository with:
+
+    python -m benchmarks.bench_representative_examples
+"""
+import time
+import random
+from types import SimpleNamespace
+
+import numpy as np
+from rapidfuzz.distance import Levenshtein
+
+from rdgai.examples import distance_matrix, select_medoids, MedoidSelector
+
+
+def loop_distance_matrix(pairs:list) -> np.ndarray:
+    matrix = np.zeros((len(pairs), len(pairs)))
+    for index1, pair in enumerate(pairs):
+        for index2 in range(index1+1, len(pairs)):
+            other_pair = pairs[index2]
+            distance = Levenshtein.distance(pair.active.text, other_pair.active.text) + Levenshtein.distance(pair.passive.text, other_pair.passive.text)
+            matrix[index1, index2] = distance
+            matrix[index2, index1] = distance
+    return matrix
+
+
+def random_text(rng:random.Random) -> str:
+    return " ".join("".join(rng.choices("abcdefgh", k=rng.randint(2, 8))) for _ in range(rng.randint(1, 4)))
+
+
+class RandomPair():
+    """ A stand-in for a Pair with random active and passive texts. """
+    def __init__(self, rng:random.Random):
+        self.active = SimpleNamespace(text=random_text(rng))
+        self.passive = SimpleNamespace(text=random_text(rng))
+
+
+def main():
+    rng = random.Random(42)
+    print(f"{'pairs':>8} {'loop (s)':>10} {'bulk (s)':>10} {'rebuild (s)':>12} {'update (s)':>11}")
+    for size in [500, 1000, 2000]:
+        pairs = [RandomPair(rng) for _ in range(size)]
+        start = time.perf_counter()
+        expected = loop_distance_matrix(pairs)
+        loop_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        result = distance_matrix(pairs)
+        bulk_time = time.perf_counter() - start
+        assert np.array_equal(expected, result)
+
+        new_pair = RandomPair(rng)
+        selector = MedoidSelector(pairs)
+        selector.select(10)
+
+        start = time.perf_counter()
+        select_medoids(pairs + [new_pair], 10)
+        rebuild_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        selector.add(new_pair)
+        selector.select(10)
+        update_time = time.perf_counter() - start
+
+        print(f"{size:>8} {loop_time:>10.3f} {bulk_time:>10.3f} {rebuild_time:>12.3f} {update_time:>11.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+import os
 import math
 from typing import Optional
 from pathlib import Path
@@ -7,12 +8,13 @@ from lxml.etree import _ElementTree as ElementTree
 from lxml import etree as ET
 from rich.console import Console
 import functools
-import Levenshtein
-import numpy as np
+from collections.abc import Sequence, Mapping
 
 # from .relations import Relation, get_reading_identifier
-from .tei import read_tei, find_elements, extract_text, find_parent, find_element, write_tei, make_nc_name, get_language, get_reading_identifier, extract_text_siblings
+from .tei import read_tei, find_elements, extract_text, find_parent, find_element, write_tei, make_nc_name, get_language, get_reading_identifier, extract_text_siblings, ContextWindows, TextCache, first_words, last_words
+from .tei import is_namespaced, tei_tag, APPS, READINGS, RELATIONS, DESCRIPTIONS, TRANSCRIPTIONAL_LIST_RELATIONS
 from .mapper import Mapper
+from .examples import select_medoids, ExampleCache, ExampleSelector, DEFAULT_MAX_CANDIDATES
 
 @dataclass
 class Reading():
@@ -24,7 +26,7 @@ class Reading():
 
     def __post_init__(self):
         self.n = get_reading_identifier(self.element)
-        self.text = extract_text(self.element).strip()
+        self.text = extract_text(self.element, cache=self.app.text_cache).strip()
         self.witnesses = self.element.attrib.get("wit", "").split()
 
     def __str__(self):
@@ -47,9 +49,26 @@ class RelationType():
     description: str
     inverse: Optional['RelationType'] = None
     pairs: set['Pair'] = field(default_factory=set)
+    revision: int = field(default=0, repr=False)
+    _representative_examples: dict = field(default_factory=dict, init=False, repr=False)
+    example_cache: ExampleCache|None = field(default=None, repr=False)
+    example_selector: ExampleSelector|None = field(default=None, init=False, repr=False)
 
     def __str__(self):
         return self.name
+
+    def touch(self, pair:Optional['Pair']=None) -> None:
+        """
+        Records that the pairs of this relation type (or their descriptions) have changed so that cached results are recomputed.
+
+        If the pair which changed is given then the example selector is updated with it, otherwise the selector is rebuilt when it is next needed.
+        """
+        self.revision += 1
+        self._representative_examples.clear()
+        if pair is None:
+            self.example_selector = None
+        elif self.example_selector is not None:
+            self.example_selector.update(pair, candidate=pair in self.pairs and pair.is_example())
     
     def __repr__(self) -> str:
         return str(self)
@@ -77,41 +96,81 @@ class RelationType():
     def get_inverse(self) -> 'RelationType':
         return self.inverse if self.inverse else self
     
-    @functools.lru_cache(maxsize=None)
-    def representative_examples(self, k:int, random_state:int=42) -> list['Pair']:
-        
-        def find_representative_examples(pairs_list:list[Pair], k:int, random_state:int=42):
-            import kmedoids
-            if len(pairs_list) <= k:
-                return pairs_list
-            distance_matrix = np.zeros((len(pairs_list), len(pairs_list)))
-            for index1, pair in enumerate(pairs_list):
-                for index2 in range(index1+1, len(pairs_list)):
-                    other_pair = pairs_list[index2]
-                    active_text_distance = Levenshtein.distance(pair.active.text, other_pair.active.text)
-                    passive_text_distance = Levenshtein.distance(pair.passive.text, other_pair.passive.text)
-                    distance = active_text_distance + passive_text_distance
-                    distance_matrix[index1, index2] = distance
-                    distance_matrix[index2, index1] = distance
-
-            result = kmedoids.fasterpam(distance_matrix, k, random_state=random_state, init="build")
-
-            return [pairs_list[index] for index in result.medoids]
-    
+    def representative_examples(self, k:int, random_state:int=42, max_candidates:int|None=DEFAULT_MAX_CANDIDATES) -> list['Pair']:
+        key = (k, random_state, max_candidates)
+        if key in self._representative_examples:
+            return self._representative_examples[key]
+
+        # Use the examples selected in a previous run if the candidate pairs are the same
+        examples = None
+        pairs_list = self.pairs_sorted(exclude_rdgai=True)
+        if self.example_cache:
+            cache_key = self.example_cache.key(self.name, pairs_list, k, random_state, max_candidates)
+            examples = self.example_cache.get(cache_key, pairs_list)
+
+        if examples is None:
+            examples = self.select_representative_examples(pairs_list, k, random_state=random_state, max_candidates=max_candidates)
+            # Examples from a selector which has been updated depend on the order of the changes, not just the pairs in the key
+            if self.example_cache and not (self.example_selector and self.example_selector.changed):
+                self.example_cache.set(cache_key, examples)
+
+        self._representative_examples[key] = examples
+        return examples
+
+    def select_representative_examples(self, pairs_list:list['Pair'], k:int, random_state:int=42, max_candidates:int|None=DEFAULT_MAX_CANDIDATES) -> list['Pair']:
+        """
+        Selects the examples with the example selector which is kept up to date as pairs are classified.
+
+        The selector is built the first time (or if the pairs were changed without it being updated so that it no longer has the same pairs).
+        Relation types with more than `max_candidates` pairs are selected from a sample with `find_representative_examples` instead.
+        """
+        if max_candidates and len(pairs_list) > max_candidates:
+            self.example_selector = None
+            return self.find_representative_examples(k, random_state=random_state, max_candidates=max_candidates)
+
+        if self.example_selector is None or not self.example_selector.matches(pairs_list):
+            self.example_selector = ExampleSelector(pairs_list)
+        return self.example_selector.select(k, random_state=random_state)
+
+    def find_representative_examples(self, k:int, random_state:int=42, workers:int=-1, max_candidates:int|None=DEFAULT_MAX_CANDIDATES) -> list['Pair']:
+        """
+        Selects `k` pairs which represent this relation type, preferring pairs with descriptions.
+
+        See `select_medoids` for the meaning of `workers` and `max_candidates`.
+        """
         pairs_list = self.pairs_sorted(exclude_rdgai=True)
         pairs_with_descriptions = [pair for pair in pairs_list if pair.has_description()]
         representative_pairs = []
         if pairs_with_descriptions:
-            representative_pairs = find_representative_examples(pairs_with_descriptions, k, random_state=random_state)
+            representative_pairs = select_medoids(pairs_with_descriptions, k, random_state=random_state, workers=workers, max_candidates=max_candidates)
         
         if len(representative_pairs) < k:
             pairs_without_descriptions = [pair for pair in pairs_list if not pair.has_description()]
-            additional_pairs = find_representative_examples(pairs_without_descriptions, k-len(representative_pairs), random_state=random_state)
+            additional_pairs = select_medoids(pairs_without_descriptions, k-len(representative_pairs), random_state=random_state, workers=workers, max_candidates=max_candidates)
             representative_pairs.extend(additional_pairs)
         
         return representative_pairs
 
 
+def invalidates_examples(method):
+    """
+    Decorates methods which change a Pair so that the cached examples of the affected relation types are recomputed.
+
+    Pairs classified by Rdgai are not used as examples so changing them does not invalidate anything.
+    """
+    @functools.wraps(method)
+    def wrapper(self:"Pair", *args, **kwargs):
+        was_example = self.is_example()
+        types_before = set(self.types)
+        result = method(self, *args, **kwargs)
+        if was_example or self.is_example():
+            for relation_type in types_before | self.types:
+                relation_type.touch(self)
+        return result
+
+    return wrapper
+
+
 @dataclass
 class Pair():
     active: Reading
@@ -143,27 +202,22 @@ class Pair():
         return hash((self.active, self.passive))
     
     def app_element(self) -> Element:
-        return find_parent(self.active.element, "app")
+        return self.app.element
+
+    def key(self) -> tuple[str, str]:
+        return (self.active.n, self.passive.n)
     
     def relation_elements(self) -> list[Element]:
-        list_relation = find_element(self.app_element(), ".//listRelation[@type='transcriptional']")
-        if list_relation is None:
-            return []
-
-        return find_elements(list_relation, f".//relation[@active='{self.active.n}'][@passive='{self.passive.n}']")
+        return list(self.app.relation_elements_for(self.active.n, self.passive.n))
     
     def element_for_type(self, type:RelationType) -> Element|None:        
-        for relation in self.relation_elements():
-            if f"#{type.name}" in relation.attrib.get("ana").split():
+        for relation in self.app.relation_elements_for(self.active.n, self.passive.n):
+            if f"#{type.name}" in relation.attrib.get("ana", "").split():
                 return relation
         return None
     
     def get_inverse(self) -> "Pair":
-        found_pair = None
-        for pair in self.app.pairs:
-            if pair.active == self.passive and pair.passive == self.active:
-                found_pair = pair
-                break
+        found_pair = self.app.get_pair(self.passive.n, self.active.n)
         assert found_pair is not None, f"No inverse pair found for {self}"
         return found_pair
     
@@ -173,6 +227,7 @@ class Pair():
         inverse.add_type(type.get_inverse(), responsible=responsible, description=inverse_description)
         return relation
 
+    @invalidates_examples
     def add_type(self, type:RelationType, responsible:str|None=None, description:str="") -> Element:
         self.types.add(type)
         type.pairs.add(self)
@@ -182,16 +237,12 @@ class Pair():
         if relation is not None:
             return relation
 
-        list_relation = find_element(self.app_element(), ".//listRelation[@type='transcriptional']")
-        if list_relation is None:
-            list_relation = ET.SubElement(self.app_element(), "listRelation", attrib={"type":"transcriptional"})
-        
-        relation = find_element(list_relation, f".//relation[@active='{self.active.n}'][@passive='{self.passive.n}']")
-        if relation is not None:
-            if type.name not in relation.attrib.get("ana").split():
-                relation.attrib["ana"] += f" #{type.name}"
+        relations = self.app.relation_elements_for(self.active.n, self.passive.n)
+        if relations:
+            relation = relations[0]
+            relation.attrib["ana"] = f"{relation.attrib.get('ana', '')} #{type.name}".strip()
         else:
-            relation = ET.SubElement(list_relation, "relation", attrib={"active":self.active.n, "passive":self.passive.n, "ana":f"#{type.name}"})
+            relation = self.app.add_relation_element(self.active.n, self.passive.n, ana=f"#{type.name}")
 
         if responsible is not None:
             relation.set("resp", responsible)
@@ -200,31 +251,36 @@ class Pair():
 
         return relation
     
+    @invalidates_examples
     def remove_description(self):
-        for relation in self.relation_elements():
-            for desc in find_elements(relation, ".//desc"):
-                relation.remove(desc)
+        for desc in list(self.app.desc_elements_for(self.active.n, self.passive.n)):
+            self.app.remove_desc_element(self.active.n, self.passive.n, desc)
                 
+    @invalidates_examples
     def add_description(self, description:str, relation:Element|None=None):
         if relation is None:
-            relation_elements = self.relation_elements()
+            relation_elements = self.app.relation_elements_for(self.active.n, self.passive.n)
 
             if len(relation_elements) == 0:
-                list_relation = find_element(self.app_element(), ".//listRelation[@type='transcriptional']")
-                if list_relation is None:
-                    list_relation = ET.SubElement(self.app_element(), "listRelation", attrib={"type":"transcriptional"})
-                relation = ET.SubElement(list_relation, "relation", attrib={"active":self.active.n, "passive":self.passive.n})
+                relation = self.app.add_relation_element(self.active.n, self.passive.n)
             else:        
                 relation = relation_elements[0]
 
         description = description.strip()
         if description:
-            description_element = find_element(relation, ".//desc")
+            description_element = None
+            for desc in self.app.desc_elements_for(self.active.n, self.passive.n):
+                if desc.getparent() is relation:
+                    description_element = desc
+                    break
+
             if description_element is None:
-                description_element = ET.SubElement(relation, "desc")
+                description_element = self.app.add_desc_element(self.active.n, self.passive.n, relation)
                 
             description_element.text = description
+            self.app.invalidate_text(description_element)
 
+    @invalidates_examples
     def remove_type(self, relation_type:RelationType):
         if relation_type in self.types:
             self.types.remove(relation_type)
@@ -232,12 +288,11 @@ class Pair():
         if self in relation_type.pairs:    
             relation_type.pairs.remove(self)
 
-        list_relation = find_element(self.app_element(), ".//listRelation[@type='transcriptional']")
-        for relation in find_elements(list_relation, f".//relation[@active='{self.active.n}'][@passive='{self.passive.n}']"):
-            if f"#{relation_type.name}" in relation.attrib.get("ana").split():
+        for relation in list(self.app.relation_elements_for(self.active.n, self.passive.n)):
+            if f"#{relation_type.name}" in relation.attrib.get("ana", "").split():
                 relation.attrib['ana'] = " ".join([ana for ana in relation.attrib.get("ana").split() if ana != f"#{relation_type.name}"])
             if not relation.attrib.get("ana"):
-                relation.getparent().remove(relation)
+                self.app.remove_relation_element(relation)
 
     def remove_type_with_inverse(self, relation_type:RelationType):
         self.remove_type(relation_type)
@@ -248,8 +303,12 @@ class Pair():
         for relation_type in set(self.types):
             self.remove_type_with_inverse(relation_type)
 
+    def is_example(self) -> bool:
+        """ Whether this pair can be used as an example of its relation types (i.e. it is classified, but not by Rdgai). """
+        return len(self.types) > 0 and not self.rdgai_responsible()
+
     def rdgai_responsible(self) -> bool:
-        for element in self.relation_elements():
+        for element in self.app.relation_elements_for(self.active.n, self.passive.n):
             if element.attrib.get('resp', '') == '#rdgai':
                 return True
         return False
@@ -258,16 +317,12 @@ class Pair():
         return set(type.name for type in self.types)
     
     def has_description(self) -> bool:
-        for relation in self.relation_elements():
-            if find_element(relation, ".//desc") is not None:
-                return True
-        return False
+        return len(self.app.desc_elements_for(self.active.n, self.passive.n)) > 0
 
     def get_description(self) -> str:
         description = ""
-        for relation_element in self.relation_elements():
-            for desc in find_elements(relation_element, ".//desc"):
-                description += "\n" + extract_text(desc)
+        for desc in self.app.desc_elements_for(self.active.n, self.passive.n):
+            description += "\n" + extract_text(desc, cache=self.app.text_cache)
         return description.strip()
 
 
@@ -278,49 +333,131 @@ class App():
     readings: list[Reading] = field(default_factory=list)
     pairs: list[Pair] = field(default_factory=list)
     non_redundant_pairs: list[Pair] = field(default_factory=list)
+    list_relation: Element|None = field(default=None, init=False, repr=False)
+    relation_index: dict[tuple[str,str],list[Element]] = field(default_factory=dict, init=False, repr=False)
+    desc_index: dict[tuple[str,str],list[Element]] = field(default_factory=dict, init=False, repr=False)
+    pair_index: dict[tuple[str,str],Pair] = field(default_factory=dict, init=False, repr=False)
+    name: str = field(default="", init=False, repr=False)
+    context_before: str|None = field(default=None, init=False, repr=False)
+    context_after: str|None = field(default=None, init=False, repr=False)
+    context_windows: ContextWindows|None = field(default=None, init=False, repr=False)
+    ab_position: int|None = field(default=None, init=False, repr=False)
 
     def __post_init__(self):
-        for reading in find_elements(self.element, ".//rdg"):
+        for reading in READINGS(self.element, self.namespaced):
             self.readings.append(Reading(reading, app=self))
 
-        # Build list of relation elements
-        relation_elements = []
-        for list_relation in find_elements(self.element, ".//listRelation[@type='transcriptional']"):
-            for relation_element in find_elements(list_relation, ".//relation"):
-                relation_elements.append(relation_element)
-        
+        # Build index of relation elements
+        self.build_relation_index()
+
+        # Find the names of the relation types for each pair of reading identifiers
+        type_names = {}
+        for key, relation_elements in self.relation_index.items():
+            for relation_element in relation_elements:
+                for ana in relation_element.attrib.get("ana", "").split():
+                    if ana.startswith("#"):
+                        ana = ana[1:]
+                    if ana:
+                        type_names.setdefault(key, set()).add(ana)
+
         # Build list of relation pairs
-        active_visited = set()
-        for active in self.readings:
-            active_visited.add(active)
-            for passive in self.readings:
-                if active == passive:
+        for active_index, active in enumerate(self.readings):
+            for passive_index, passive in enumerate(self.readings):
+                if active_index == passive_index:
                     continue
 
-                types = set()
-                for relation_element in relation_elements:
-                    if relation_element.attrib.get("active") == active.n and relation_element.attrib.get("passive") == passive.n:
-                        for ana in relation_element.attrib.get("ana", "").split():
-                            if ana.startswith("#"):
-                                ana = ana[1:]
-                            if ana:
-                                types.add(ana)
-
                 pair_relation_types = set()
-                for type_name in types:
+                for type_name in type_names.get((active.n, passive.n), set()):
                     relation_type = self.doc.relation_types[type_name] if type_name in self.doc.relation_types else self.doc.add_relation_type(type_name)                    
                     pair_relation_types.add(relation_type)
 
+                # Pair adds itself to the relation types
                 pair = Pair(active=active, passive=passive, types=pair_relation_types)
                 self.pairs.append(pair)
-                if passive not in active_visited:
+                self.pair_index[(active.n, passive.n)] = pair
+                if passive_index > active_index:
                     self.non_redundant_pairs.append(pair)
 
-                for relation_type in pair_relation_types:
-                    relation_type.pairs.add(pair)
-
         assert len(self.pairs) == len(self.non_redundant_pairs) * 2
 
+    def build_relation_index(self) -> None:
+        """
+        Indexes the relation elements and their descriptions in this variation unit by the active and passive reading identifiers.
+
+        The index is kept in sync by the methods of Pair which add and remove relations and descriptions.
+        Call this again if the relation elements are changed directly in the XML tree.
+        """
+        self.list_relation = None
+        self.relation_index = {}
+        self.desc_index = {}
+        namespaced = self.namespaced
+        for list_relation in TRANSCRIPTIONAL_LIST_RELATIONS(self.element, namespaced):
+            if self.list_relation is None:
+                self.list_relation = list_relation
+            for relation in RELATIONS(list_relation, namespaced):
+                key = (relation.attrib.get("active"), relation.attrib.get("passive"))
+                self.relation_index.setdefault(key, []).append(relation)
+                for desc in DESCRIPTIONS(relation, namespaced):
+                    self.desc_index.setdefault(key, []).append(desc)
+
+    def get_pair(self, active:str, passive:str) -> Pair|None:
+        """ Returns the pair with the given active and passive reading identifiers. """
+        return self.pair_index.get((active, passive), None)
+
+    def relation_elements_for(self, active:str, passive:str) -> list[Element]:
+        return self.relation_index.get((active, passive), [])
+
+    def desc_elements_for(self, active:str, passive:str) -> list[Element]:
+        return self.desc_index.get((active, passive), [])
+
+    @property
+    def namespaced(self) -> bool:
+        """ Whether the document uses the TEI namespace. """
+        return self.doc.namespaced if self.doc is not None else is_namespaced(self.element)
+
+    @property
+    def text_cache(self) -> TextCache|None:
+        return self.doc.text_cache if self.doc is not None else None
+
+    def invalidate_text(self, element:Element) -> None:
+        """ Removes the cached text of an element which has been changed. """
+        if self.doc is not None:
+            self.doc.text_cache.invalidate(element)
+
+    def get_list_relation(self) -> Element:
+        """ Returns the transcriptional listRelation element of this variation unit, creating it if necessary. """
+        if self.list_relation is None:
+            self.list_relation = ET.SubElement(self.element, tei_tag("listRelation", self.namespaced), attrib={"type":"transcriptional"})
+            self.invalidate_text(self.element)
+        return self.list_relation
+
+    def add_relation_element(self, active:str, passive:str, ana:str="") -> Element:
+        attrib = {"active":active, "passive":passive}
+        if ana:
+            attrib["ana"] = ana
+        relation = ET.SubElement(self.get_list_relation(), tei_tag("relation", self.namespaced), attrib=attrib)
+        self.invalidate_text(relation)
+        self.relation_index.setdefault((active, passive), []).append(relation)
+        return relation
+
+    def remove_relation_element(self, relation:Element) -> None:
+        key = (relation.attrib.get("active"), relation.attrib.get("passive"))
+        self.invalidate_text(relation)
+        relation.getparent().remove(relation)
+        self.relation_index[key] = [element for element in self.relation_index.get(key, []) if element is not relation]
+        self.desc_index[key] = [desc for desc in self.desc_index.get(key, []) if desc.getparent() is not relation]
+
+    def add_desc_element(self, active:str, passive:str, relation:Element) -> Element:
+        desc = ET.SubElement(relation, tei_tag("desc", self.namespaced))
+        self.invalidate_text(desc)
+        self.desc_index.setdefault((active, passive), []).append(desc)
+        return desc
+
+    def remove_desc_element(self, active:str, passive:str, desc:Element) -> None:
+        self.invalidate_text(desc)
+        desc.getparent().remove(desc)
+        self.desc_index[(active, passive)] = [element for element in self.desc_index.get((active, passive), []) if element is not desc]
+
     def get_classified_pairs(self, redundant:bool=True) -> list[Pair]:
         pairs = self.pairs if redundant else self.non_redundant_pairs
         return [pair for pair in pairs if len(pair.types) > 0]
@@ -333,26 +470,10 @@ class App():
         return hash(self.element)
 
     def __str__(self):
-        name = self.element.attrib.get('{http://www.w3.org/XML/1998/namespace}id', '')
-        if not name:
-            name = self.element.attrib.get('n', '')
-
-        if not name:
-            ab = self.ab()
-            if ab is not None:
-                for index, app in enumerate(find_elements(ab, ".//app")):
-                    if app == self.element:
-                        name = make_nc_name(f"{self.ab_name()}-{index+1}")
-                        self.element.attrib['{http://www.w3.org/XML/1998/namespace}id'] = name
-                        break
-            if not name:
-                root = self.element.getroottree().getroot()
-                for index, app in enumerate(find_elements(root, ".//app")):
-                    if app == self.element:
-                        name = make_nc_name(f"app-{index+1}")
-                        self.element.attrib['{http://www.w3.org/XML/1998/namespace}id'] = name
-                        break
-        return str(name).replace(" ", "_").replace(":", "_")
+        # The names are usually assigned by Doc when it is loaded. Otherwise the name is found from the position of the app.
+        if not self.name:
+            self.name = app_element_names([self.element])[0]
+        return self.name
 
     def ab(self) -> Element|None:
         return find_parent(self.element, "ab")
@@ -363,27 +484,36 @@ class App():
             return ""
         return ab.attrib.get("n", "")
     
-    def text_before(self) -> str:
-        ab = self.ab()
-        if ab is None:
-            return extract_text_siblings(self.element, "milestone", truncate=100, preceding=True)
-        
-        items = []
-        for child in ab:
-            if child == self.element:
-                break
-            child_text = extract_text(child)
-            if child_text:
-                items.append(child_text)
-
-        text = " ".join(items)
-        return text.strip()
+    def ab_context_windows(self) -> ContextWindows|None:
+        """ The context windows of the `ab` containing this app (shared with the other apps in it) or None if it is not in an `ab`. """
+        if self.context_windows is None:
+            ab = self.ab()
+            if ab is None:
+                return None
+            self.context_windows = self.doc.get_context_windows(ab) if self.doc is not None else ContextWindows.from_element(ab, cache=self.text_cache)
+            self.ab_position = self.context_windows.position(self.element)
+        return self.context_windows
+
+    def text_before(self, width:int|None=None) -> str:
+        """
+        The text before the app in its `ab`.
+
+        If `width` is given then only that number of words is given.
+        Apps outside of an `ab` use the text of the preceding siblings up to a milestone (at most 100 words).
+        """
+        if self.context_before is not None:
+            return last_words(self.context_before, width)
+
+        windows = self.ab_context_windows()
+        if windows is None:
+            return last_words(extract_text_siblings(self.element, "milestone", truncate=100, preceding=True, cache=self.text_cache), width)
+        return windows.before(self.ab_position, width)
     
-    def text_in_context(self, text="") -> str:
-        return f"{self.text_before()} {self.text_with_signs(text)} {self.text_after()}".strip()
+    def text_in_context(self, text="", width:int|None=None) -> str:
+        return f"{self.text_before(width)} {self.text_with_signs(text)} {self.text_after(width)}".strip()
 
     def text(self) -> str:
-        return extract_text(self.element)
+        return extract_text(self.element, cache=self.text_cache)
 
     def text_with_signs(self, text="") -> str:
         text = text or self.text()
@@ -391,23 +521,20 @@ class App():
             return "⸆"
         return f"⸂{text}⸃"
 
-    def text_after(self) -> str:
-        ab = self.ab()
-        if ab is None:
-            return extract_text_siblings(self.element, "milestone", truncate=100)
-        
-        items = []
-        reached_element = False
-        for child in ab:
-            if reached_element:
-                child_text = extract_text(child)
-                if child_text:
-                    items.append(child_text)
-            if child == self.element:
-                reached_element = True
-
-        text = " ".join(items)
-        return text.strip()
+    def text_after(self, width:int|None=None) -> str:
+        """
+        The text after the app in its `ab`.
+
+        If `width` is given then only that number of words is given.
+        Apps outside of an `ab` use the text of the following siblings up to a milestone (at most 100 words).
+        """
+        if self.context_after is not None:
+            return first_words(self.context_after, width)
+
+        windows = self.ab_context_windows()
+        if windows is None:
+            return first_words(extract_text_siblings(self.element, "milestone", truncate=100, cache=self.text_cache), width)
+        return windows.after(self.ab_position, width)
 
     def entropy(self) -> float:
         counts = [len(reading.witnesses) for reading in self.readings if len(reading.witnesses) > 0]
@@ -418,6 +545,101 @@ class App():
         return entropy
         
 
+def read_relation_types(interp_group:Element, categories_to_ignore:list[str]|None=None) -> dict[str,RelationType]:
+    """ Reads the relation types from the interp elements of a transcriptional interpGrp and links their inverses. """
+    categories_to_ignore = categories_to_ignore or []
+    
+    relation_types = dict()
+    assert interp_group is not None, "No interpGrp of type='transcriptional' found in TEI file."
+    
+    for interp in find_elements(interp_group, "./interp"):
+        name = interp.attrib.get("{http://www.w3.org/XML/1998/namespace}id", "")
+        if name in categories_to_ignore: continue
+
+        description = extract_text(interp).strip()
+        relation_types[name] = RelationType(name=name, element=interp, description=description)
+
+    # get corresponding relations
+    for category in relation_types.values():
+        inverse_name = category.element.attrib.get("corresp", "")
+        if inverse_name.startswith("#"):
+            inverse_name = inverse_name[1:]
+
+        if inverse_name in relation_types:
+            inverse = relation_types[inverse_name]
+            category.inverse = inverse
+            if inverse.inverse is None:
+                inverse.inverse = category
+            else:
+                assert inverse.inverse == category, f"Inverse category {inverse} already has an inverse {inverse.inverse}."
+
+    return relation_types
+
+
+def app_element_names(app_elements:list[Element]) -> list[str]:
+    """
+    Finds the names of the app elements from their attributes without building App objects.
+
+    Apps without an xml:id or n are named from their position in their `ab` (or in the document if they are not in an `ab`)
+    and this is assigned as their xml:id. The positions are found with a single pass over each `ab` so this is linear in the number of apps.
+    """
+    positions = {}
+    names = []
+    for element in app_elements:
+        name = element.attrib.get('{http://www.w3.org/XML/1998/namespace}id', '') or element.attrib.get('n', '')
+        if not name:
+            ab = find_parent(element, "ab")
+            if ab not in positions:
+                parent = ab if ab is not None else element.getroottree().getroot()
+                positions[ab] = {}
+                for app in find_elements(parent, ".//app"):
+                    positions[ab].setdefault(app, len(positions[ab]) + 1)
+            if ab is not None:
+                name = make_nc_name(f"{ab.attrib.get('n', '')}-{positions[ab][element]}")
+            else:
+                name = make_nc_name(f"app-{positions[ab][element]}")
+            element.attrib['{http://www.w3.org/XML/1998/namespace}id'] = name
+        names.append(str(name).replace(" ", "_").replace(":", "_"))
+    return names
+
+
+class LazyApps(Sequence):
+    """ The apps of a lazily loaded document. Each App is built the first time it is accessed. """
+    def __init__(self, doc:"Doc"):
+        self.doc = doc
+
+    def __len__(self):
+        return len(self.doc.app_elements)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.doc.get_app(element) for element in self.doc.app_elements[index]]
+        return self.doc.get_app(self.doc.app_elements[index])
+
+    def __iter__(self):
+        for element in self.doc.app_elements:
+            yield self.doc.get_app(element)
+
+
+class LazyAppIndex(Mapping):
+    """ Maps the app IDs of a lazily loaded document to App objects, building each App the first time it is accessed. """
+    def __init__(self, doc:"Doc", names:list[str]):
+        self.doc = doc
+        self.elements = dict(zip(names, doc.app_elements))
+
+    def __getitem__(self, key):
+        return self.doc.get_app(self.elements[key])
+
+    def __contains__(self, key):
+        return key in self.elements
+
+    def __iter__(self):
+        return iter(self.elements)
+
+    def __len__(self):
+        return len(self.elements)
+
+
 @dataclass
 class Doc():
     path: Path
@@ -425,13 +647,40 @@ class Doc():
     apps: list[App] = field(default_factory=list)
     relation_types: dict[str,RelationType] = field(default_factory=dict)
     id_to_app: dict[str,App] = field(default_factory=dict)
-    
+    lazy: bool = False
+    example_cache_dir: Path|None = None
+    compiled_prompts: dict = field(default_factory=dict, init=False, repr=False)
+    app_elements: list[Element] = field(default_factory=list, init=False, repr=False)
+    loaded_apps: dict[Element,App] = field(default_factory=dict, init=False, repr=False)
+    classified_apps_loaded: bool = field(default=False, init=False, repr=False)
+    app_names: dict[Element,str] = field(default_factory=dict, init=False, repr=False)
+    ab_context_windows: dict[Element,ContextWindows] = field(default_factory=dict, init=False, repr=False)
+    text_cache: TextCache = field(default_factory=TextCache, init=False, repr=False)
+    example_cache: ExampleCache|None = field(default=None, init=False, repr=False)
+    namespaced: bool = field(default=True, init=False, repr=False)
+
     def __post_init__(self):
         self.tree = read_tei(self.path)
+        self.namespaced = is_namespaced(self.tree)
         self.relation_types = self.get_relation_types()
-
-        for app_element in find_elements(self.tree, ".//app"):
+        self.use_example_cache()
+
+        if self.lazy:
+            # Only scan the attributes of the app elements. The App objects are built when they are accessed.
+            self.app_elements = APPS(self.tree, self.namespaced)
+            names = app_element_names(self.app_elements)
+            self.app_names = dict(zip(self.app_elements, names))
+            self.apps = LazyApps(self)
+            self.id_to_app = LazyAppIndex(self, names)
+            return
+
+        app_elements = APPS(self.tree, self.namespaced)
+
+        # The names are assigned in a single pass rather than searching the document for duplicates for each app
+        names = app_element_names(app_elements)
+        for app_element, name in zip(app_elements, names):
             app = App(app_element, doc=self)
+            app.name = name
             self.apps.append(app)
 
         self.id_to_app = {app.__str__(): app for app in self.apps}        
@@ -442,11 +691,42 @@ class Doc():
     def __len__(self):
         return len(self.apps)
 
+    def get_context_windows(self, ab:Element) -> ContextWindows:
+        """ The context windows for the children of an `ab`, which are extracted the first time they are needed. """
+        windows = self.ab_context_windows.get(ab, None)
+        if windows is None:
+            windows = self.ab_context_windows[ab] = ContextWindows.from_element(ab, cache=self.text_cache)
+        return windows
+
+    def get_app(self, element:Element) -> App:
+        """ Returns the App for an app element, building it if the document is lazily loaded and it hasn't been accessed yet. """
+        app = self.loaded_apps.get(element, None)
+        if app is None:
+            app = App(element, doc=self)
+            app.name = app.name or self.app_names.get(element, "")
+            self.loaded_apps[element] = app
+        return app
+
+    def load_classified_apps(self) -> None:
+        """
+        Builds the apps with relations in a lazily loaded document so that the relation types know all of their pairs.
+
+        The app elements are only scanned the first time. Relations are added through the apps, which are then loaded,
+        so no unloaded app can gain relations afterwards.
+        This does nothing if the document is not lazily loaded.
+        """
+        if not self.lazy or self.classified_apps_loaded:
+            return
+        self.classified_apps_loaded = True
+        for element in self.app_elements:
+            if element not in self.loaded_apps and RELATIONS(element, self.namespaced):
+                self.get_app(element)
+
     def get_interpgrp(self) -> Element:
         text = find_element(self.tree, ".//text") 
         interp_group = find_element(text, ".//interpGrp[@type='transcriptional']") 
         if interp_group is None: 
-            interp_group = ET.Element("interpGrp", attrib={"type":"transcriptional"}) 
+            interp_group = ET.Element(tei_tag("interpGrp", self.namespaced), attrib={"type":"transcriptional"})
             text.insert(0, interp_group) 
 
         return interp_group
@@ -459,55 +739,35 @@ class Doc():
         interp_group = self.get_interpgrp()
         interp = find_element(interp_group, f".//interp[@xml:id='{name}']")
         if interp is None:
-            interp = ET.Element("interp", attrib={"{http://www.w3.org/XML/1998/namespace}id":name})
+            interp = ET.Element(tei_tag("interp", self.namespaced), attrib={"{http://www.w3.org/XML/1998/namespace}id":name})
             interp_group.append(interp)
+            self.text_cache.invalidate(interp)
 
-        relation_type = RelationType(name=name, element=interp, description="")
+        relation_type = RelationType(name=name, element=interp, description="", example_cache=self.example_cache)
         self.relation_types[name] = relation_type
         return relation_type
 
+    def use_example_cache(self) -> None:
+        """ Stores the representative examples of the relation types in the example cache directory if there is one. """
+        self.example_cache = ExampleCache(self.example_cache_dir) if self.example_cache_dir else None
+        for relation_type in self.relation_types.values():
+            relation_type.example_cache = self.example_cache
+
     def __str__(self):
         return str(self.path)
 
     def __repr__(self) -> str:
         return str(self)
 
-    def write(self, output:str|Path):
-        write_tei(self.tree, output)
+    def write(self, output:str|Path) -> os.stat_result:
+        return write_tei(self.tree, output)
 
     @property
     def language(self):
         return get_language(self.tree)
     
     def get_relation_types(self, categories_to_ignore:list[str]|None=None) -> list[RelationType]:
-        interp_group = self.get_interpgrp()
-        categories_to_ignore = categories_to_ignore or []
-        
-        relation_types = dict()
-        assert interp_group is not None, "No interpGrp of type='transcriptional' found in TEI file."
-        
-        for interp in find_elements(interp_group, "./interp"):
-            name = interp.attrib.get("{http://www.w3.org/XML/1998/namespace}id", "")
-            if name in categories_to_ignore: continue
-
-            description = extract_text(interp).strip()
-            relation_types[name] = RelationType(name=name, element=interp, description=description)
-
-        # get corresponding relations
-        for category in relation_types.values():
-            inverse_name = category.element.attrib.get("corresp", "")
-            if inverse_name.startswith("#"):
-                inverse_name = inverse_name[1:]
-
-            if inverse_name in relation_types:
-                inverse = relation_types[inverse_name]
-                category.inverse = inverse
-                if inverse.inverse is None:
-                    inverse.inverse = category
-                else:
-                    assert inverse.inverse == category, f"Inverse category {inverse} already has an inverse {inverse.inverse}."
-
-        return relation_types
+        return read_relation_types(self.get_interpgrp(), categories_to_ignore=categories_to_ignore)
 
     def get_classified_pairs(self, redundant:bool=True) -> list[Pair]:
         pairs = []
@@ -525,6 +785,7 @@ class Doc():
 
     def print_classified_pairs(self, console:Console|None=None) -> None:
         console = console or Console()
+        self.load_classified_apps()
         for relation_type in self.relation_types.values():
             console.rule(str(relation_type))
             console.print(relation_type.description, style="grey46")
@@ -536,7 +797,7 @@ class Doc():
     def render_html(self, output:Path|None=None, all_apps:bool=False) -> str:
         from flask import Flask, request, render_template
         
-        mapper = Mapper()
+        mapper = Mapper(self)
         app = Flask(__name__)
 
         with app.app_context():
@@ -548,73 +809,11 @@ class Doc():
         
         return html
 
-    def flask_app(self, output:Path, all_apps:bool=False):
-        from flask import Flask, request, render_template
+    def flask_app(self, output:Path, all_apps:bool=False, flush_delay:float|None=None, **kwargs):
+        """ Creates a Flask app to view and classify the document (see `rdgai.gui.create_flask_app`). """
+        from .gui import create_flask_app
 
-        self.write(output)
-        mapper = Mapper()
-        
-        app = Flask(__name__)
-
-        @app.route("/")
-        def root():
-            return render_template('server.html', doc=self, mapper=mapper, all_apps=all_apps)
-
-        @app.route("/api/relation-type", methods=['POST'])
-        def api_relation_type():
-            data = request.get_json()
-            
-            relation_type = mapper.obj(data['relation_type'])
-            assert isinstance(relation_type, RelationType), f"Expected RelationType, got {type(relation_type)}"
-            
-            pair = mapper.obj(data['pair'])
-            assert isinstance(pair, Pair), f"Expected Pair, got {type(pair)}"
-
-            try:
-                if data['operation'] == 'remove':
-                    print('remove', relation_type)
-                    pair.remove_type_with_inverse(relation_type)
-                elif data['operation'] == 'add':
-                    print('add', relation_type)
-                    pair.add_type_with_inverse(relation_type)
-                else:
-                    raise ValueError(f"Unknown operation {data['operation']}")
-                
-                print('write', output)
-                self.write(output)
-                return "Success", 200           
-            except Exception as e:  
-                print(str(e))
-                return str(e), 400
-
-            return "Failed", 400
-        
-        @app.route("/api/desc", methods=['POST'])
-        def desc():
-            data = request.get_json()
-                        
-            pair = mapper.obj(data['pair'])
-            assert isinstance(pair, Pair), f"Expected Pair, got {type(pair)}"
-
-            try:
-                if data['operation'] == 'remove':
-                    pair.remove_description()
-                elif data['operation'] == 'add':
-                    pair.add_description(data['description'])   
-                else:
-                    raise ValueError(f"Unknown operation {data['operation']}")
-
-                print('write', output)
-                self.write(output)
-                return "Success", 200           
-            except Exception as e:  
-                print(str(e))
-                return str(e), 400
-
-            return "Failed", 400
-
-        return app
-        # app.run(debug=True, use_reloader=True)
+        return create_flask_app(self, output, all_apps=all_apps, flush_delay=flush_delay, **kwargs)
 
     def clean(self, output:Path|None=None):
         """ Cleans a TEI XML file for common errors. """
@@ -642,6 +841,10 @@ class Doc():
                         list_relation.remove(relation)
 
                     relations[0].attrib['ana'] = " ".join(sorted(analytic_set))
+
+        self.text_cache.invalidate()
+        for app in self.apps:
+            app.build_relation_index()
         
         if output:
             output = Path(output)
@@ -0,0 +1,168 @@
+import json
+from pathlib import Path
+from langchain_core.messages import convert_to_openai_messages
+from rich.console import Console
+
+from .apparatus import Doc, Pair
+from .prompts import build_template
+from .parsers import CategoryParser
+from .journal import pair_key
+from .cache import hash_key
+from .classification import add_classification, DEFAULT_MODEL_ID
+
+
+BATCH_FORMATS = ("openai", "anthropic")
+ANTHROPIC_MAX_TOKENS = 1024
+
+
+def batch_custom_id(pair:Pair) -> str:
+    """
+    An identifier for the request for a pair in a batch file.
+
+    It is derived from the app ID and reading identifiers so that results can be matched to pairs in a newly loaded document.
+    It only uses characters and a length accepted by the batch APIs of the providers.
+    """
+    return f"rdgai-{hash_key(*pair_key(pair))[:48]}"
+
+
+def export_batch_requests(
+    doc:Doc,
+    output:Path,
+    pairs:list[Pair]|None=None,
+    llm:str=DEFAULT_MODEL_ID,
+    temperature:float=0.1,
+    examples:int=10,
+    examples_doc:Doc|None=None,
+    batch_format:str="openai",
+) -> int:
+    """
+    Writes the prompts for the pairs (by default the unclassified non-redundant pairs) to a JSON Lines file
+    which can be submitted to the batch API of OpenAI or Anthropic, depending on `batch_format`.
+
+    Returns the number of requests written.
+    """
+    if batch_format not in BATCH_FORMATS:
+        raise ValueError(f"Unknown batch format '{batch_format}'. It must be one of: {', '.join(BATCH_FORMATS)}")
+
+    pairs = pairs or doc.get_unclassified_pairs(redundant=False)
+    output = Path(output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+
+    with open(output, "w", encoding="utf-8") as f:
+        for pair in pairs:
+            template = build_template(pair, examples=examples, examples_doc=examples_doc)
+            messages = convert_to_openai_messages(template.invoke({}).to_messages())
+            if batch_format == "anthropic":
+                request = anthropic_batch_request(batch_custom_id(pair), messages, llm=llm, temperature=temperature)
+            else:
+                request = {
+                    "custom_id": batch_custom_id(pair),
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": {
+                        "model": llm,
+                        "temperature": temperature,
+                        "messages": messages,
+                    },
+                }
+            f.write(json.dumps(request, ensure_ascii=False) + "\n")
+
+    return len(pairs)
+
+
+def anthropic_batch_request(custom_id:str, messages:list[dict], llm:str, temperature:float) -> dict:
+    """ A request for the Anthropic Message Batches API. The system message is given separately from the other messages. """
+    system = "".join(message["content"] for message in messages if message["role"] == "system")
+    return {
+        "custom_id": custom_id,
+        "params": {
+            "model": llm,
+            "max_tokens": ANTHROPIC_MAX_TOKENS,
+            "temperature": temperature,
+            "system": system,
+            "messages": [message for message in messages if message["role"] != "system"],
+        },
+    }
+
+
+def get_batch_result_text(result:dict) -> str|None:
+    """
+    Gets the text of the response from a line of a batch results file.
+
+    It accepts the formats of the OpenAI and Anthropic batch APIs, or a simple 'content' field.
+    Returns None if the request failed.
+    """
+    if "content" in result and isinstance(result["content"], str):
+        return result["content"]
+
+    # OpenAI
+    response = result.get("response", None)
+    if response:
+        if response.get("status_code", 200) != 200:
+            return None
+        choices = response.get("body", {}).get("choices", [])
+        if choices:
+            return choices[0].get("message", {}).get("content", None)
+        return None
+
+    # Anthropic
+    anthropic_result = result.get("result", None)
+    if anthropic_result:
+        if anthropic_result.get("type", "") != "succeeded":
+            return None
+        content = anthropic_result.get("message", {}).get("content", [])
+        return "".join(block.get("text", "") for block in content if block.get("type", "") == "text")
+
+    return None
+
+
+def import_batch_results(
+    doc:Doc,
+    results:Path,
+    output:Path|None=None,
+    console:Console|None=None,
+) -> int:
+    """
+    Applies the responses in a batch results file to the document and writes it to the output.
+
+    Lines which are not valid JSON (e.g. a truncated last line) are reported and skipped.
+    Returns the number of pairs classified.
+    """
+    console = console or Console()
+    pairs = {batch_custom_id(pair): pair for app in doc.apps for pair in app.non_redundant_pairs}
+    parser = CategoryParser(doc.relation_types.keys())
+
+    count = 0
+    with open(results, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError as err:
+                console.print(f"Cannot read line {line_number} of {results}: {err}", style="red")
+                continue
+            if not isinstance(result, dict):
+                console.print(f"Cannot read line {line_number} of {results}: it is not a JSON object", style="red")
+                continue
+
+            pair = pairs.get(result.get("custom_id", ""), None)
+            if pair is None:
+                console.print(f"Cannot find pair for request {result.get('custom_id', '')}", style="red")
+                continue
+
+            text = get_batch_result_text(result)
+            if text is None:
+                console.print(f"Request failed for {pair.app}: {pair}", style="red")
+                continue
+
+            category, description = parser.invoke(text)
+            if category in doc.relation_types:
+                add_classification(doc, pair, category, description)
+                count += 1
+
+    if output:
+        doc.write(output)
+
+    return count
@@ -0,0 +1,160 @@
+import os
+import json
+import hashlib
+import tempfile
+import threading
+from pathlib import Path
+from dataclasses import dataclass, field
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.runnables import Runnable
+from langchain_core.output_parsers import StrOutputParser
+
+
+DEFAULT_CACHE_SIZE = 512 * 1024 * 1024
+EVICTION_TARGET = 0.9
+
+
+def default_cache_dir() -> Path:
+    """
+    The directory for Rdgai's caches.
+
+    It is set by the RDGAI_CACHE_DIR environment variable, otherwise it is 'rdgai' in XDG_CACHE_HOME (or ~/.cache).
+    """
+    if os.environ.get("RDGAI_CACHE_DIR"):
+        return Path(os.environ["RDGAI_CACHE_DIR"])
+    return Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache") / "rdgai"
+
+
+def hash_key(*parts) -> str:
+    """ Makes a key for a cache by hashing the JSON representation of the parts. """
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+
+
+class DiskCache():
+    """
+    A persistent cache storing one file per key in a directory.
+
+    When the total size of the files exceeds `max_size` bytes, the least recently used entries are removed
+    until it is no more than `EVICTION_TARGET` of `max_size` so that the directory is not scanned again on the next write.
+    """
+    def __init__(self, directory:Path|str, max_size:int=DEFAULT_CACHE_SIZE, suffix:str=".bin"):
+        self.directory = Path(directory)
+        self.max_size = max_size
+        self.suffix = suffix
+        self.lock = threading.Lock()
+        self.total_size = None
+
+    def path(self, key:str) -> Path:
+        return self.directory / key[:2] / f"{key}{self.suffix}"
+
+    def get(self, key:str) -> bytes|None:
+        path = self.path(key)
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return None
+
+        # Update the modification time so that eviction is least recently used
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return data
+
+    def set(self, key:str, data:bytes) -> None:
+        path = self.path(key)
+        previous_size = path.stat().st_size if path.exists() else 0
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=path.parent, prefix=".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except BaseException:
+            Path(temp_path).unlink(missing_ok=True)
+            raise
+
+        with self.lock:
+            # Only scan the directory the first time, then keep a running total
+            if self.total_size is None:
+                self.total_size = self.size()
+            else:
+                self.total_size += len(data) - previous_size
+            over_limit = self.max_size and self.total_size > self.max_size
+
+        if over_limit:
+            self.evict()
+
+    def __contains__(self, key:str) -> bool:
+        return self.path(key).exists()
+
+    def entries(self) -> list[Path]:
+        if not self.directory.exists():
+            return []
+        return list(self.directory.glob(f"*/*{self.suffix}"))
+
+    def size(self) -> int:
+        return sum(path.stat().st_size for path in self.entries())
+
+    def evict(self) -> None:
+        """ Removes the least recently used entries until the cache is no larger than `EVICTION_TARGET` of the maximum size. """
+        if not self.max_size:
+            return
+
+        with self.lock:
+            stats = []
+            for path in self.entries():
+                try:
+                    stats.append((path.stat(), path))
+                except FileNotFoundError:
+                    continue
+
+            total = sum(stat.st_size for stat, _ in stats)
+            target = self.max_size * EVICTION_TARGET
+            for stat, path in sorted(stats, key=lambda item: item[0].st_mtime_ns):
+                if total <= target:
+                    break
+                path.unlink(missing_ok=True)
+                total -= stat.st_size
+
+            self.total_size = total
+
+    def clear(self) -> None:
+        with self.lock:
+            for path in self.entries():
+                path.unlink(missing_ok=True)
+            self.total_size = 0
+
+
+@dataclass
+class CachedLLM(Runnable):
+    """
+    Sits in front of a language model in a chain and returns the stored response if the same prompt
+    has been sent before to the same model at the same temperature.
+
+    The response is always a message: stored responses are returned as an AIMessage with the stored text,
+    as are responses from models which give strings. The number of responses which came from the cache is counted in `hits`.
+    """
+    llm: Runnable
+    cache: DiskCache
+    model_id: str
+    temperature: float|None = None
+    hits: int = field(default=0, init=False)
+    lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+
+    def key(self, prompt) -> str:
+        prompt_string = prompt.to_string() if hasattr(prompt, "to_string") else str(prompt)
+        return hash_key(self.model_id, self.temperature, prompt_string)
+
+    def invoke(self, prompt, *args, **kwargs) -> BaseMessage:
+        key = self.key(prompt)
+        cached = self.cache.get(key)
+        if cached is not None:
+            with self.lock:
+                self.hits += 1
+            return AIMessage(content=cached.decode("utf-8"))
+
+        response = self.llm.invoke(prompt, *args, **kwargs)
+        text = StrOutputParser().invoke(response)
+        self.cache.set(key, text.encode("utf-8"))
+        return response if isinstance(response, BaseMessage) else AIMessage(content=text)
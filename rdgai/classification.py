@@ -1,18 +1,281 @@
+import time
+import itertools
+import functools
+import threading
+import contextlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from dataclasses import dataclass
 from pathlib import Path
+from typing import Iterator
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.language_models.llms import LLM
+from langchain_core.prompts.chat import ChatPromptTemplate
+from langchain_core.messages import BaseMessage
+from langchain_core.runnables import Runnable, RunnableLambda
 import llmloader
 from rich.console import Console
 from rich.progress import track
 
-from .prompts import build_template
-from .parsers import CategoryParser
-from .apparatus import Doc, Pair
+from .prompts import build_template, build_app_template, compile_prompt
+from .parsers import CategoryParser, BatchCategoryParser
+from .apparatus import Doc, App, Pair
+from .streaming import StreamingDoc
+from .journal import Journal, pair_key
+from .cache import DiskCache, CachedLLM, DEFAULT_CACHE_SIZE
 
 
 DEFAULT_MODEL_ID = "gpt-4o"
 
 
+def estimate_tokens(text:str) -> int:
+    """ Roughly estimates the number of tokens in a piece of text (about four characters per token). """
+    return len(text) // 4 + 1
+
+
+class RateLimiter():
+    """
+    Limits the number of requests and tokens sent to a language model in any sliding window of one minute.
+
+    A limit of zero means that there is no limit.
+    """
+    def __init__(self, requests_per_minute:int=0, tokens_per_minute:int=0, period:float=60.0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.period = period
+        self.history = deque()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens:int=0) -> None:
+        """ Blocks until a request with this many tokens can be sent without exceeding the limits. """
+        if not self.requests_per_minute and not self.tokens_per_minute:
+            return
+
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                while self.history and now - self.history[0][0] >= self.period:
+                    self.history.popleft()
+
+                requests_ok = not self.requests_per_minute or len(self.history) < self.requests_per_minute
+                tokens_used = sum(item[1] for item in self.history)
+                # Always allow a request through on an empty window so that oversized prompts cannot block forever
+                tokens_ok = not self.tokens_per_minute or not self.history or tokens_used + tokens <= self.tokens_per_minute
+                if requests_ok and tokens_ok:
+                    self.history.append((now, tokens))
+                    return
+
+                wait = self.period - (now - self.history[0][0])
+
+            time.sleep(max(wait, 0.01))
+
+
+@dataclass
+class RateLimitedLLM(Runnable):
+    """
+    Sits in front of a language model in a chain and waits until the rate limiter allows each prompt to be sent.
+
+    It goes behind the response cache so that prompts which are answered from the cache do not use up the limits.
+    """
+    llm: Runnable
+    rate_limiter: RateLimiter
+
+    def invoke(self, prompt, *args, **kwargs):
+        prompt_string = prompt.to_string() if hasattr(prompt, "to_string") else str(prompt)
+        self.rate_limiter.acquire(estimate_tokens(prompt_string))
+        return self.llm.invoke(prompt, *args, **kwargs)
+
+
+class Checkpoint():
+    """
+    Decides when to write the document to the output file while classifying.
+
+    The document is written after every `every` pairs or when `interval` seconds have passed since the last write,
+    whichever comes first. A value of zero disables that condition. Call `flush` at the end for the final write.
+    """
+    def __init__(self, doc:Doc, output:Path, every:int=10, interval:float=60.0):
+        assert isinstance(output, Path), f"Expected Path, got {type(output)}"
+        self.doc = doc
+        self.output = output
+        self.every = every
+        self.interval = interval
+        self.pending = 0
+        self.last_write = time.monotonic()
+
+    def step(self) -> bool:
+        """ Records that a pair has been classified and writes the document if it is due. Returns True if it was written. """
+        self.pending += 1
+        due = self.every and self.pending >= self.every
+        due = due or (self.interval and time.monotonic() - self.last_write >= self.interval)
+        if due:
+            self.flush()
+        return bool(due)
+
+    def flush(self) -> None:
+        """ Writes the document to the output file. """
+        self.doc.write(self.output)
+        self.pending = 0
+        self.last_write = time.monotonic()
+
+
+def get_model_id(llm) -> str:
+    """ Returns a string to identify a language model. """
+    if isinstance(llm, str):
+        return llm
+    for attribute in ["model_name", "model", "model_id"]:
+        value = getattr(llm, attribute, None)
+        if isinstance(value, str) and value:
+            return value
+    return type(llm).__name__
+
+
+def prompt_cache_control(llm) -> dict|None:
+    """
+    Returns the marker to add to the preamble to cache it on the provider's side if the language model supports it.
+
+    Anthropic models need the prefix to be marked explicitly. Other providers (e.g. OpenAI) cache long stable prefixes
+    automatically or do not support caching so None is returned.
+    """
+    if type(llm).__module__.startswith("langchain_anthropic"):
+        return {"type": "ephemeral"}
+    return None
+
+
+class UsageReport():
+    """
+    Accumulates the token usage reported by the language model, including prompt cache hits and misses.
+
+    `cached_responses` is the number of responses which were reused from Rdgai's cache of responses rather than sent to the model.
+    """
+    def __init__(self):
+        self.cached_responses = 0
+        self.requests = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cache_read_tokens = 0
+        self.cache_creation_tokens = 0
+        self.lock = threading.Lock()
+
+    def record(self, message):
+        """ Records the usage metadata of a response and passes the response through unchanged. """
+        usage = getattr(message, "usage_metadata", None) if isinstance(message, BaseMessage) else None
+        if usage:
+            details = usage.get("input_token_details", None) or {}
+            with self.lock:
+                self.requests += 1
+                self.input_tokens += usage.get("input_tokens", 0)
+                self.output_tokens += usage.get("output_tokens", 0)
+                self.cache_read_tokens += details.get("cache_read", 0) or 0
+                self.cache_creation_tokens += details.get("cache_creation", 0) or 0
+        return message
+
+    @property
+    def uncached_input_tokens(self) -> int:
+        return self.input_tokens - self.cache_read_tokens - self.cache_creation_tokens
+
+    def print(self, console:Console) -> None:
+        if self.cached_responses:
+            console.print(f"Reused {self.cached_responses} responses from the cache of earlier responses")
+        if not self.requests:
+            return
+        console.print(
+            f"Token usage for {self.requests} requests: {self.input_tokens} input ({self.cache_read_tokens} cache hits, "
+            f"{self.cache_creation_tokens} cache writes, {self.uncached_input_tokens} uncached), {self.output_tokens} output"
+        )
+
+
+def build_chain(doc:Doc, template:ChatPromptTemplate, llm:LLM, usage:UsageReport|None=None):
+    if usage:
+        return template | llm | RunnableLambda(usage.record) | StrOutputParser() | CategoryParser(doc.relation_types.keys())
+    return template | llm | StrOutputParser() | CategoryParser(doc.relation_types.keys())
+
+
+def build_batch_chain(doc:Doc, template:ChatPromptTemplate, llm:LLM, usage:UsageReport|None=None):
+    parser = BatchCategoryParser(list(doc.relation_types.keys()))
+    if usage:
+        return template | llm | RunnableLambda(usage.record) | StrOutputParser() | parser
+    return template | llm | StrOutputParser() | parser
+
+
+def invoke_chain(chain) -> tuple[str, str]:
+    return chain.invoke({})
+
+
+def in_window(executor:ThreadPoolExecutor, items:list, submit, window:int) -> Iterator[tuple[object, Future]]:
+    """
+    Submits the work for the items to the executor with at most `window` of them in flight at once
+    and yields each item with its future in the order of the items.
+
+    The futures which have not started are cancelled if the generator is closed before the end (e.g. because of an error).
+    """
+    items = iter(items)
+    pending = deque()
+    try:
+        for item in itertools.islice(items, window):
+            pending.append((item, submit(item)))
+        while pending:
+            item, future = pending.popleft()
+            yield item, future
+            for item in itertools.islice(items, 1):
+                pending.append((item, submit(item)))
+    finally:
+        for _, future in pending:
+            future.cancel()
+
+
+def apply_classification(
+    doc:Doc,
+    pair:Pair,
+    category:str,
+    description:str,
+    console:Console|None=None,
+):
+    """
+    Adds the category returned by the language model to a pair of readings (and its inverse).
+    """
+    console = console or Console()
+
+    console.print()
+    pair.print(console)
+    console.print(category, style="green bold")
+    console.print(description, style="grey46")
+
+    add_classification(doc, pair, category, description)
+
+
+def add_classification(doc:Doc, pair:Pair, category:str, description:str):
+    """ Adds a category to a pair of readings and its inverse with Rdgai as the responsible party. """
+    relation_type = doc.relation_types.get(category, None)
+    if relation_type is None:
+        return
+
+    inverse_description = f"c.f. {pair.active} ➞ {pair.passive}"
+    pair.add_type_with_inverse(
+        relation_type,
+        responsible="#rdgai",
+        description=description,
+        inverse_description=inverse_description,
+    )
+
+
+def replay_journal(doc:Doc, journal:Journal) -> set[tuple[str, str, str]]:
+    """
+    Applies the responses recorded in a journal to the document without sending anything to the language model.
+
+    Returns the keys of the pairs in the journal so that they can be skipped.
+    """
+    entries = journal.entries()
+    for entry in entries:
+        app = doc.id_to_app.get(entry.app_id, None)
+        if app is None:
+            continue
+        pair = app.get_pair(entry.active, entry.passive)
+        if pair is not None:
+            add_classification(doc, pair, entry.category, entry.justification)
+
+    return set(entry.key() for entry in entries)
+
+
 def classify_pair(
     doc:Doc,
     pair:Pair,
@@ -23,47 +286,262 @@ def classify_pair(
     examples:int=10,
     console:Console|None=None,
     examples_doc:Doc|None=None,
+    checkpoint:Checkpoint|None=None,
+    journal:Journal|None=None,
+    model_id:str="",
+    usage:UsageReport|None=None,
+    cache_control:dict|None=None,
 ):
     """
     Classifies relations for a pair of readings.
+
+    If a checkpoint is given then it decides when the document is written to the output,
+    otherwise the document is written after the pair is classified.
     """
     assert isinstance(doc, Doc), f"Expected Doc, got {type(doc)}"
 
     console = console or Console()
 
-    template = build_template(pair, examples=examples, examples_doc=examples_doc)
+    template = build_template(pair, examples=examples, examples_doc=examples_doc, cache_control=cache_control)
     if verbose or prompt_only:
         template.pretty_print()
         if prompt_only:
             return
 
-    chain = template | llm | StrOutputParser() | CategoryParser(doc.relation_types.keys())
+    chain = build_chain(doc, template, llm, usage=usage)
 
     assert isinstance(output, Path), f"Expected Path, got {type(output)}"
-    doc.write(output)
 
-    category, description = chain.invoke({})
+    category, description = invoke_chain(chain)
+    if journal:
+        journal.record(pair, category, description, model=model_id or get_model_id(llm))
 
-    console.print()
-    pair.print(console)
-    console.print(category, style="green bold")
-    console.print(description, style="grey46")
+    apply_classification(doc, pair, category, description, console=console)
+
+    if checkpoint:
+        checkpoint.step()
+    else:
+        doc.write(output)
+
+
+def classify_pairs_concurrently(
+    doc:Doc,
+    pairs:list[Pair],
+    llm:LLM,
+    output:Path,
+    workers:int,
+    verbose:bool=False,
+    examples:int=10,
+    console:Console|None=None,
+    examples_doc:Doc|None=None,
+    checkpoint:Checkpoint|None=None,
+    journal:Journal|None=None,
+    model_id:str="",
+    usage:UsageReport|None=None,
+    cache_control:dict|None=None,
+):
+    """
+    Sends the prompts for the pairs to the language model from a pool of worker threads.
+
+    The prompts are built in the main thread and the results are applied to the document in the order of the pairs
+    so that the output is the same as when classifying serially.
+    Only twice as many prompts as there are workers are built and sent ahead of the results being applied.
+    """
+    assert isinstance(doc, Doc), f"Expected Doc, got {type(doc)}"
+    assert isinstance(output, Path), f"Expected Path, got {type(output)}"
+
+    console = console or Console()
+    checkpoint = checkpoint or Checkpoint(doc, output, every=1, interval=0)
+    model_id = model_id or get_model_id(llm)
+
+    def record(pair:Pair, future) -> None:
+        if journal and not future.cancelled() and future.exception() is None:
+            category, description = future.result()
+            journal.record(pair, category, description, model=model_id)
+
+    def submit(pair:Pair) -> Future:
+        template = build_template(pair, examples=examples, examples_doc=examples_doc, cache_control=cache_control)
+        if verbose:
+            template.pretty_print()
+
+        chain = build_chain(doc, template, llm, usage=usage)
+        future = executor.submit(invoke_chain, chain)
+        # Record responses in the journal as soon as they arrive rather than in pair order
+        future.add_done_callback(functools.partial(record, pair))
+        return future
+
+    with ThreadPoolExecutor(max_workers=workers) as executor, \
+            contextlib.closing(in_window(executor, pairs, submit, window=2 * workers)) as results:
+        for pair, future in track(results, total=len(pairs)):
+            category, description = future.result()
+            apply_classification(doc, pair, category, description, console=console)
+            checkpoint.step()
+
+
+def group_pairs_by_app(pairs:list[Pair]) -> list[tuple[App, list[Pair]]]:
+    """ Groups pairs by their variation unit, keeping the order of the pairs. """
+    groups = {}
+    for pair in pairs:
+        groups.setdefault(pair.app.element, (pair.app, []))[1].append(pair)
+    return list(groups.values())
+
+
+def classify_apps(
+    doc:Doc,
+    pairs:list[Pair],
+    llm:LLM,
+    output:Path,
+    workers:int=1,
+    verbose:bool=False,
+    examples:int=10,
+    console:Console|None=None,
+    examples_doc:Doc|None=None,
+    checkpoint:Checkpoint|None=None,
+    journal:Journal|None=None,
+    model_id:str="",
+    usage:UsageReport|None=None,
+    cache_control:dict|None=None,
+):
+    """
+    Classifies all the pairs in each variation unit with a single request to the language model.
+
+    Pairs which are missing from the response or cannot be parsed are classified individually.
+    The results are applied to the document in the order of the pairs.
+    """
+    assert isinstance(doc, Doc), f"Expected Doc, got {type(doc)}"
+    assert isinstance(output, Path), f"Expected Path, got {type(output)}"
+
+    console = console or Console()
+    checkpoint = checkpoint or Checkpoint(doc, output, every=1, interval=0)
+    model_id = model_id or get_model_id(llm)
+    groups = group_pairs_by_app(pairs)
+
+    def record(app_pairs:list[Pair], future) -> None:
+        if journal and not future.cancelled() and future.exception() is None:
+            answers = {(active, passive): (category, justification) for active, passive, category, justification in reversed(future.result())}
+            for pair in app_pairs:
+                answer = answers.get((pair.active.n, pair.passive.n), None)
+                if answer:
+                    journal.record(pair, *answer, model=model_id)
+
+    def submit(group:tuple[App, list[Pair]]) -> Future:
+        app, app_pairs = group
+        template = build_app_template(app, app_pairs, examples=examples, examples_doc=examples_doc, cache_control=cache_control)
+        if verbose:
+            template.pretty_print()
+
+        chain = build_batch_chain(doc, template, llm, usage=usage)
+        future = executor.submit(invoke_chain, chain)
+        future.add_done_callback(functools.partial(record, app_pairs))
+        return future
+
+    with ThreadPoolExecutor(max_workers=workers) as executor, \
+            contextlib.closing(in_window(executor, groups, submit, window=2 * workers)) as results:
+        for (app, app_pairs), future in track(results, total=len(groups)):
+            # If a pair is given more than once, the first answer is used
+            answers = {(active, passive): (category, justification) for active, passive, category, justification in reversed(future.result())}
+            for pair in app_pairs:
+                answer = answers.get((pair.active.n, pair.passive.n), None)
+                if answer is None:
+                    classify_pair(
+                        doc,
+                        pair,
+                        llm,
+                        output,
+                        verbose=verbose,
+                        examples=examples,
+                        console=console,
+                        examples_doc=examples_doc,
+                        checkpoint=checkpoint,
+                        journal=journal,
+                        model_id=model_id,
+                        usage=usage,
+                        cache_control=cache_control,
+                    )
+                    continue
+
+                category, description = answer
+                apply_classification(doc, pair, category, description, console=console)
+                checkpoint.step()
+
+
+def classify_pair_list(
+    doc:Doc,
+    pairs:list[Pair],
+    llm:LLM,
+    output:Path,
+    workers:int=1,
+    verbose:bool=False,
+    prompt_only:bool=False,
+    examples:int=10,
+    console:Console|None=None,
+    examples_doc:Doc|None=None,
+    checkpoint:Checkpoint|None=None,
+    journal:Journal|None=None,
+    model_id:str="",
+    usage:UsageReport|None=None,
+    cache_control:dict|None=None,
+    batch:bool=False,
+    progress:bool=True,
+):
+    """
+    Classifies the pairs with a request for each variation unit if `batch` is True,
+    with concurrent requests if `workers` is greater than one, or otherwise one at a time.
+    """
+    if batch and not prompt_only:
+        classify_apps(
+            doc,
+            pairs,
+            llm,
+            output,
+            workers=workers,
+            verbose=verbose,
+            examples=examples,
+            console=console,
+            examples_doc=examples_doc,
+            checkpoint=checkpoint,
+            journal=journal,
+            model_id=model_id,
+            usage=usage,
+            cache_control=cache_control,
+        )
+    elif workers > 1 and not prompt_only:
+        classify_pairs_concurrently(
+            doc,
+            pairs,
+            llm,
+            output,
+            workers=workers,
+            verbose=verbose,
+            examples=examples,
+            console=console,
+            examples_doc=examples_doc,
+            checkpoint=checkpoint,
+            journal=journal,
+            model_id=model_id,
+            usage=usage,
+            cache_control=cache_control,
+        )
+    else:
+        for pair in track(pairs) if progress else pairs:
+            classify_pair(
+                doc,
+                pair,
+                llm,
+                output,
+                verbose=verbose,
+                prompt_only=prompt_only,
+                examples=examples,
+                console=console,
+                examples_doc=examples_doc,
+                checkpoint=checkpoint,
+                journal=journal,
+                model_id=model_id,
+                usage=usage,
+                cache_control=cache_control,
+            )
 
-    relation_type = doc.relation_types.get(category, None)
-    if relation_type is None:
-        return
-    
-    inverse_description = f"c.f. {pair.active} ➞ {pair.passive}"
-    pair.add_type_with_inverse(
-        relation_type, 
-        responsible="#rdgai", 
-        description=description, 
-        inverse_description=inverse_description,
-    )
 
-    doc.write(output)
-    
-    
 def classify(
     doc:Doc,
     output:Path,
@@ -76,27 +554,132 @@ def classify(
     examples:int=10,
     console:Console|None=None,
     examples_doc:Doc|None=None,
+    workers:int=1,
+    requests_per_minute:int=0,
+    tokens_per_minute:int=0,
+    checkpoint_every:int=10,
+    checkpoint_interval:float=60.0,
+    journal:Path|None=None,
+    resume:bool=False,
+    prompt_caching:bool=False,
+    cache_dir:Path|None=None,
+    cache_size:int=DEFAULT_CACHE_SIZE,
+    model_id:str="",
+    batch:bool=False,
 ):
     """
     Classifies relations in TEI documents.
+
+    If `workers` is greater than one then requests are sent to the language model concurrently.
+    The number of requests and (estimated) tokens per minute can be limited with `requests_per_minute` and `tokens_per_minute`.
+    The output is written every `checkpoint_every` pairs or `checkpoint_interval` seconds and once more at the end.
+    Each response is recorded in the `journal` file if given. If `resume` is True then the responses in the journal
+    are applied to the document and those pairs are not sent to the language model again.
+    Otherwise the journal is cleared first so that it only has the responses from this run.
+    If `prompt_caching` is True then the preamble is marked for caching by the provider if the model supports it.
+    The token usage (including prompt cache hits and misses) is printed at the end if the model reports it.
+    If `cache_dir` is given then responses are stored there (up to `cache_size` bytes) and identical prompts
+    sent to the same model at the same temperature are not sent again. The number of responses reused from the cache is printed at the end.
+    The model is identified by `model_id` which is taken from `llm` if not given.
+    If `batch` is True then all the pairs of a variation unit are classified with a single request.
+    If `doc` is a StreamingDoc then the unclassified pairs of each variation unit are classified as the document is read
+    and the output is written as it goes so that the whole document is never held in memory.
     """
     assert isinstance(doc, Doc), f"Expected Doc, got {type(doc)}"
 
     console = console or Console()
+    model_id = model_id or get_model_id(llm)
     llm = llmloader.load(model=llm, api_key=api_key, temperature=temperature)
-    
+
+    usage = UsageReport()
+    cache_control = prompt_cache_control(llm) if prompt_caching else None
+    if prompt_caching and not cache_control:
+        console.print(f"Prompt caching cannot be requested explicitly for {model_id}. The provider may cache the preamble automatically.")
+
+    # The rate limiter goes behind the response cache so that only the requests which reach the model count towards the limits
+    if requests_per_minute or tokens_per_minute:
+        rate_limiter = RateLimiter(requests_per_minute=requests_per_minute, tokens_per_minute=tokens_per_minute)
+        llm = RateLimitedLLM(llm, rate_limiter=rate_limiter)
+
+    cached_llm = None
+    if cache_dir:
+        cache = DiskCache(Path(cache_dir)/"responses", max_size=cache_size, suffix=".txt")
+        llm = cached_llm = CachedLLM(llm, cache=cache, model_id=model_id, temperature=temperature)
+
+    journal = Journal(journal) if journal and not prompt_only else None
+    if journal and not resume:
+        journal.clear()
+
+    if isinstance(doc, StreamingDoc):
+        # The output is written as the document is streamed so the checkpoint never needs to write it
+        checkpoint = Checkpoint(doc, output, every=0, interval=0) if not prompt_only else None
+        answered = {entry.key(): entry for entry in journal.entries()} if journal and resume else {}
+        # Read the examples and compile the prompt before streaming starts so that it is the same as for the whole document
+        compile_prompt(examples_doc or doc, examples)
+        for app in doc.iter_apps(output=None if prompt_only else output):
+            app_pairs = []
+            for pair in app.get_unclassified_pairs(redundant=False):
+                entry = answered.get(pair_key(pair), None)
+                if entry:
+                    add_classification(doc, pair, entry.category, entry.justification)
+                else:
+                    app_pairs.append(pair)
+
+            classify_pair_list(
+                doc,
+                app_pairs,
+                llm,
+                output,
+                workers=workers,
+                verbose=verbose,
+                prompt_only=prompt_only,
+                examples=examples,
+                console=console,
+                examples_doc=examples_doc,
+                checkpoint=checkpoint,
+                journal=journal,
+                model_id=model_id,
+                usage=usage,
+                cache_control=cache_control,
+                batch=batch,
+                progress=False,
+            )
+        usage.cached_responses = cached_llm.hits if cached_llm else 0
+        usage.print(console)
+        return usage
+
     pairs = pairs or doc.get_unclassified_pairs(redundant=False)
-    for pair in track(pairs):
-        classify_pair(
-            doc, 
-            pair, 
-            llm, 
-            output, 
-            verbose=verbose, 
-            prompt_only=prompt_only, 
-            examples=examples, 
+    if journal and resume:
+        answered = replay_journal(doc, journal)
+        pairs = [pair for pair in pairs if pair_key(pair) not in answered]
+        console.print(f"Resuming with {len(answered)} responses from {journal.path}")
+
+    checkpoint = Checkpoint(doc, output, every=checkpoint_every, interval=checkpoint_interval) if not prompt_only else None
+    try:
+        classify_pair_list(
+            doc,
+            pairs,
+            llm,
+            output,
+            workers=workers,
+            verbose=verbose,
+            prompt_only=prompt_only,
+            examples=examples,
             console=console,
             examples_doc=examples_doc,
+            checkpoint=checkpoint,
+            journal=journal,
+            model_id=model_id,
+            usage=usage,
+            cache_control=cache_control,
+            batch=batch,
         )
-        
-        
+    finally:
+        # Make sure that the pairs classified so far are saved even if there is an error
+        if checkpoint:
+            checkpoint.flush()
+
+    usage.cached_responses = cached_llm.hits if cached_llm else 0
+    usage.print(console)
+    return usage
+
@@ -1,11 +1,12 @@
 import numpy as np
 from pathlib import Path
+from typing import Iterator
 from dataclasses import dataclass
 from langchain_core.language_models.llms import LLM
 from langchain_core.output_parsers import StrOutputParser
 
-from .tei import find_elements
 from .apparatus import App, Doc, Pair
+from .streaming import StreamingDoc
 from .prompts import build_preamble, build_review_prompt
 
 @dataclass
@@ -38,6 +39,71 @@ def llm_review_results(
     return template, result
 
 
+def evaluation_item(pair:Pair, ground_truth_app:App|None) -> EvalItem|None:
+    """
+    Compares the relation types of a pair with those of the same pair in the ground truth.
+
+    Returns None if the pair is not classified manually in the ground truth.
+    """
+    if ground_truth_app is None:
+        return None
+
+    app = pair.app
+    ground_truth_pair = ground_truth_app.get_pair(pair.active.n, pair.passive.n)
+    if ground_truth_pair is None or not ground_truth_pair.relation_elements() or not ground_truth_pair.types:
+        return None
+    
+    # exclude any classified with rdgai
+    if ground_truth_pair.rdgai_responsible():
+        return None
+
+    return EvalItem(
+        app_id=str(app),
+        app=app,
+        text_in_context=app.text_in_context(),
+        active=ground_truth_pair.active,
+        passive=ground_truth_pair.passive,
+        reading_transition_str=ground_truth_pair.reading_transition_str(),
+        ground_truth=ground_truth_pair.relation_type_names(),
+        predicted=pair.relation_type_names(),
+        description=pair.get_description(),
+        ground_truth_description=ground_truth_pair.get_description(),
+    )
+
+
+def stream_evaluation_items(doc:Doc, ground_truth:Doc) -> Iterator[EvalItem]:
+    """
+    Compares the pairs classified by Rdgai with the ground truth while reading the documents one app at a time.
+
+    The apps of the ground truth are read alongside the apps of the document. 
+    Apps of the ground truth which are read before they are needed are kept until they are.
+    """
+    apps = doc.iter_apps() if isinstance(doc, StreamingDoc) else doc.apps
+    ground_truth_apps = ground_truth.iter_apps() if isinstance(ground_truth, StreamingDoc) else iter(ground_truth.apps)
+    pending = {}
+
+    for app in apps:
+        pairs = [pair for pair in app.get_classified_pairs() if pair.rdgai_responsible()]
+        if not pairs:
+            continue
+
+        app_id = str(app)
+        ground_truth_app = pending.pop(app_id, None)
+        while ground_truth_app is None:
+            candidate = next(ground_truth_apps, None)
+            if candidate is None:
+                break
+            if str(candidate) == app_id:
+                ground_truth_app = candidate
+            else:
+                pending[str(candidate)] = candidate
+
+        for pair in pairs:
+            item = evaluation_item(pair, ground_truth_app)
+            if item:
+                yield item
+
+
 def evaluate_docs(
     doc:Doc, 
     ground_truth:Doc,
@@ -48,75 +114,45 @@ def evaluate_docs(
     llm:LLM|None=None,
     examples:int=10,
 ):
-    # get dictionary of ground truth apps
-    ground_truth_apps = {str(app):app for app in ground_truth.apps}
+    """
+    Evaluates the pairs classified by Rdgai in a document against the ground truth.
+
+    If either document is a StreamingDoc then they are read one app at a time.
+    """
+    if isinstance(doc, StreamingDoc) or isinstance(ground_truth, StreamingDoc):
+        assert not pairs, "Pairs cannot be given when evaluating streamed documents."
+        assert not report, "A report cannot be written when evaluating streamed documents."
+        items = list(stream_evaluation_items(doc, ground_truth))
+        if len(items) == 0:
+            print("No rdgai relations found in predicted document.")
+            return
+    else:
+        # get dictionary of ground truth apps
+        ground_truth_apps = {str(app):app for app in ground_truth.apps}
+
+        # find all classified relations in the doc that have been classified with rdgai
+        pairs = pairs or [pair for pair in doc.get_classified_pairs() if pair.rdgai_responsible()]
+
+        if len(pairs) == 0:
+            print("No rdgai relations found in predicted document.")
+            return
+
+        # find all classified relations in the ground truth that correspond to the classified relations in the doc
+        items = [evaluation_item(pair, ground_truth_apps.get(str(pair.app), None)) for pair in pairs]
+        items = [item for item in items if item]
 
-    # find all classified relations in the ground truth that correspond to the classified relations in the doc
     predicted = []
     gold = []
     correct_items = []
     incorrect_items = []
-
-    # Create a dictionary of ground truth relation elements to their corresponding pairs
-    ground_truth_pair_dict = dict()
-    for pair in ground_truth.get_classified_pairs():
-        for relation_element in pair.relation_elements():
-            ground_truth_pair_dict[relation_element] = pair
-
-
-    # find all classified relations in the doc that have been classified with rdgai
-    pairs = pairs or [pair for pair in doc.get_classified_pairs() if pair.rdgai_responsible()]
-
-    if len(pairs) == 0:
-        print("No rdgai relations found in predicted document.")
-        return
-
-    for pair in pairs:
-        # find app
-        app = pair.app
-        app_id = str(app)
-        
-        active = pair.active.n
-        passive = pair.passive.n
-
-        ground_truth_app = ground_truth_apps.get(app_id, None)
-        if ground_truth_app is None:
-            continue
-        
-        ground_truth_relations = [element for element in find_elements(ground_truth_app.element, f".//relation[@active='{active}']") if element.attrib['passive'] == passive]
-        if not ground_truth_relations:
-            continue
-        ground_truth_relation = ground_truth_relations[0]
-        ground_truth_pair = ground_truth_pair_dict[ground_truth_relation]
-        
-        # exclude any classified with rdgai
-        if ground_truth_pair.rdgai_responsible():
-            continue
-
-        ground_truth_types = ground_truth_pair.relation_type_names()
-        predicted_types = pair.relation_type_names()
-
-        description = pair.get_description()
-
-        eval_item = EvalItem(
-            app_id=app_id,
-            app=app,
-            text_in_context=app.text_in_context(),
-            active=ground_truth_pair.active,
-            passive=ground_truth_pair.passive,
-            reading_transition_str=ground_truth_pair.reading_transition_str(),
-            ground_truth=ground_truth_types,
-            predicted=predicted_types,
-            description=description,
-            ground_truth_description=ground_truth_pair.get_description(),
-        )
-        if ground_truth_types == predicted_types:
+    for eval_item in items:
+        if eval_item.ground_truth == eval_item.predicted:
             correct_items.append(eval_item)
         else:
             incorrect_items.append(eval_item)
 
-        predicted.append(" ".join(sorted(predicted_types)))
-        gold.append(" ".join(sorted(ground_truth_types)))
+        predicted.append(" ".join(sorted(eval_item.predicted)))
+        gold.append(" ".join(sorted(eval_item.ground_truth)))
 
     print(len(predicted), len(gold))
     assert len(predicted) == len(gold), f"Predicted and gold lengths do not match: {len(predicted)} != {len(gold)}"
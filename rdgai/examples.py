@@ -0,0 +1,231 @@
+import json
+from pathlib import Path
+import numpy as np
+from rapidfuzz.distance import Levenshtein
+from rapidfuzz.process import cdist
+
+from .cache import DiskCache, hash_key
+
+DEFAULT_MAX_CANDIDATES = 2000
+DEFAULT_EXAMPLE_CACHE_SIZE = 16 * 1024 * 1024
+
+
+def distance_matrix(pairs:list, workers:int=-1) -> np.ndarray:
+    """
+    The distance between each pair of pairs: the sum of the Levenshtein distances between their active texts and between their passive texts.
+
+    The distances are computed in bulk with rapidfuzz using `workers` threads (-1 uses all the cores).
+    """
+    active_texts = [pair.active.text for pair in pairs]
+    passive_texts = [pair.passive.text for pair in pairs]
+    active_distances = cdist(active_texts, active_texts, scorer=Levenshtein.distance, dtype=np.int32, workers=workers)
+    passive_distances = cdist(passive_texts, passive_texts, scorer=Levenshtein.distance, dtype=np.int32, workers=workers)
+    return (active_distances + passive_distances).astype(np.float64)
+
+
+def stratified_sample(items:list, size:int, random_state:int=42) -> list:
+    """
+    Draws one item at random from each of `size` blocks of consecutive items of (nearly) equal size.
+
+    When the items are in document order, this keeps the sample spread across the whole document.
+    """
+    if len(items) <= size:
+        return items
+    rng = np.random.default_rng(random_state)
+    boundaries = np.linspace(0, len(items), size + 1).astype(int)
+    return [items[rng.integers(start, end)] for start, end in zip(boundaries[:-1], boundaries[1:])]
+
+
+def select_medoids(pairs:list, k:int, random_state:int=42, workers:int=-1, max_candidates:int|None=DEFAULT_MAX_CANDIDATES) -> list:
+    """
+    Selects `k` representative pairs as the medoids found with k-medoids clustering of the distances between the pairs.
+
+    If there are more than `max_candidates` pairs then the medoids are selected from a stratified sample of that size.
+    """
+    import kmedoids
+
+    if len(pairs) <= k:
+        return pairs
+    if max_candidates and len(pairs) > max_candidates:
+        pairs = stratified_sample(pairs, max(max_candidates, k), random_state=random_state)
+
+    result = kmedoids.fasterpam(distance_matrix(pairs, workers=workers), k, random_state=random_state, init="build")
+    return [pairs[index] for index in result.medoids]
+
+
+def pair_distances(pair, pairs:list, workers:int=-1) -> np.ndarray:
+    """ The distances (as in `distance_matrix`) between a pair and each of the pairs in a list. """
+    if not pairs:
+        return np.zeros(0)
+    active_distances = cdist([pair.active.text], [other.active.text for other in pairs], scorer=Levenshtein.distance, dtype=np.int32, workers=workers)
+    passive_distances = cdist([pair.passive.text], [other.passive.text for other in pairs], scorer=Levenshtein.distance, dtype=np.int32, workers=workers)
+    return (active_distances + passive_distances)[0].astype(np.float64)
+
+
+class MedoidSelector():
+    """
+    Keeps the distance matrix of a set of pairs up to date as pairs are added and removed
+    so that medoids can be selected again without rebuilding it.
+
+    Adding or removing a pair takes time proportional to the number of pairs.
+    Once pairs have been added or removed, the medoids selected previously for each (k, random_state) are used as the starting point
+    when they are selected again. The result then depends on the order of the changes and not only on the pairs (see `changed`).
+    """
+    def __init__(self, pairs:list|None=None, workers:int=-1):
+        self.pairs = list(pairs or [])
+        self.workers = workers
+        self.index = {pair: index for index, pair in enumerate(self.pairs)}
+        self.matrix = distance_matrix(self.pairs, workers=workers) if self.pairs else np.zeros((0, 0))
+        self.medoids:dict[tuple[int,int],list] = {}
+        self.changed = False # Whether pairs have been added or removed since it was created
+
+    def __len__(self) -> int:
+        return len(self.pairs)
+
+    def __contains__(self, pair) -> bool:
+        return pair in self.index
+
+    def add(self, pair) -> None:
+        if pair in self.index:
+            return
+        count = len(self.pairs)
+        if count == len(self.matrix):
+            # Grow the matrix geometrically so that adding pairs one at a time does not copy it each time
+            capacity = max(8, 2 * count)
+            matrix = np.zeros((capacity, capacity))
+            matrix[:count, :count] = self.matrix[:count, :count]
+            self.matrix = matrix
+
+        distances = pair_distances(pair, self.pairs, workers=self.workers)
+        self.matrix[count, :count] = distances
+        self.matrix[:count, count] = distances
+        self.matrix[count, count] = 0.0
+        self.index[pair] = count
+        self.pairs.append(pair)
+        self.changed = True
+
+    def remove(self, pair) -> None:
+        index = self.index.pop(pair, None)
+        if index is None:
+            return
+        # Move the last pair into the place of the removed pair
+        last = len(self.pairs) - 1
+        if index != last:
+            last_pair = self.pairs[last]
+            self.pairs[index] = last_pair
+            self.index[last_pair] = index
+            self.matrix[index, :] = self.matrix[last, :]
+            self.matrix[:, index] = self.matrix[:, last]
+            self.matrix[index, index] = 0.0
+        self.pairs.pop()
+        self.changed = True
+
+    def select(self, k:int, random_state:int=42) -> list:
+        """
+        Selects `k` medoids.
+
+        If pairs have changed, it starts from the medoids selected previously for this k and random state if they are all still present.
+        Otherwise the result is the same as `select_medoids` for the pairs the selector was created with.
+        """
+        import kmedoids
+
+        if len(self.pairs) <= k:
+            return list(self.pairs)
+
+        count = len(self.pairs)
+        matrix = np.ascontiguousarray(self.matrix[:count, :count])
+        previous = [self.index[pair] for pair in self.medoids.get((k, random_state), []) if pair in self.index] if self.changed else []
+        if len(previous) == k:
+            result = kmedoids.fasterpam(matrix, np.array(previous))
+        else:
+            result = kmedoids.fasterpam(matrix, k, random_state=random_state, init="build")
+
+        medoids = [self.pairs[index] for index in result.medoids]
+        self.medoids[(k, random_state)] = medoids
+        return medoids
+
+
+class ExampleSelector():
+    """
+    Selects the representative examples of a relation type, preferring pairs with descriptions,
+    and is updated as pairs are classified so that the distance matrices do not need to be rebuilt.
+    """
+    def __init__(self, pairs:list, workers:int=-1):
+        self.described = MedoidSelector([pair for pair in pairs if pair.has_description()], workers=workers)
+        self.undescribed = MedoidSelector([pair for pair in pairs if not pair.has_description()], workers=workers)
+
+    def __len__(self) -> int:
+        return len(self.described) + len(self.undescribed)
+
+    @property
+    def changed(self) -> bool:
+        """ Whether the selection may depend on the order in which pairs were changed rather than only on the pairs. """
+        return self.described.changed or self.undescribed.changed
+
+    def matches(self, pairs:list) -> bool:
+        """ Whether the selector has exactly these pairs, each with the pairs with or without descriptions as it should be. """
+        if len(pairs) != len(self):
+            return False
+        return all(pair in (self.described if pair.has_description() else self.undescribed) for pair in pairs)
+
+    def update(self, pair, candidate:bool) -> None:
+        """ Adds or removes a pair which has changed, moving it between the pairs with and without descriptions if necessary. """
+        described = candidate and pair.has_description()
+        if candidate and not described:
+            self.described.remove(pair)
+            self.undescribed.add(pair)
+        elif described:
+            self.undescribed.remove(pair)
+            self.described.add(pair)
+        else:
+            self.described.remove(pair)
+            self.undescribed.remove(pair)
+
+    def select(self, k:int, random_state:int=42) -> list:
+        examples = self.described.select(k, random_state=random_state)
+        if len(examples) < k:
+            examples = examples + self.undescribed.select(k - len(examples), random_state=random_state)
+        return examples
+
+
+def pair_identifier(pair) -> tuple[str,str,str]:
+    return (str(pair.app), pair.active.n, pair.passive.n)
+
+
+class ExampleCache():
+    """
+    Stores the representative examples selected for relation types on disk so that k-medoids does not need to be run again
+    when the same examples are used in another run.
+
+    The key is made from the name of the relation type, a hash of the texts and descriptions of its candidate pairs,
+    k, the random state and the maximum number of candidates.
+    The identifiers of the selected pairs (app ID and reading identifiers) are stored as JSON.
+    """
+    def __init__(self, directory:Path|str, max_size:int=DEFAULT_EXAMPLE_CACHE_SIZE):
+        self.cache = DiskCache(Path(directory)/"examples", max_size=max_size, suffix=".json")
+
+    def key(self, name:str, pairs:list, k:int, random_state:int, max_candidates:int|None) -> str:
+        content = [
+            (*pair_identifier(pair), pair.active.text, pair.passive.text, pair.get_description() if pair.has_description() else None)
+            for pair in pairs
+        ]
+        return hash_key(name, hash_key(content), k, random_state, max_candidates)
+
+    def get(self, key:str, pairs:list) -> list|None:
+        """ Returns the stored examples as pairs from `pairs` or None if they are not stored or cannot all be found. """
+        data = self.cache.get(key)
+        if data is None:
+            return None
+        try:
+            identifiers = json.loads(data)
+        except ValueError:
+            return None
+
+        pairs_by_identifier = {pair_identifier(pair): pair for pair in pairs}
+        examples = [pairs_by_identifier.get(tuple(identifier), None) for identifier in identifiers]
+        if None in examples:
+            return None
+        return examples
+
+    def set(self, key:str, examples:list) -> None:
+        self.cache.set(key, json.dumps([pair_identifier(pair) for pair in examples], ensure_ascii=False).encode("utf-8"))
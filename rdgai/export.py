@@ -1,22 +1,31 @@
 from pathlib import Path
+from typing import Iterable
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.worksheet.datavalidation import DataValidation
 from openpyxl.styles import Font
 import pandas as pd
 
-from .apparatus import Doc
+from .apparatus import Doc, App
+from .streaming import StreamingDoc
 
 
-def export_variants_to_excel(doc:Doc, output:Path):
-    """ Export the variants to an Excel file."""
-    wb = Workbook()
+def export_variants_to_excel(doc:Doc, output:Path, apps:Iterable[App]|None=None):
+    """
+    Export the variants to an Excel file.
+    
+    The rows are written as the apps are iterated so a StreamingDoc can be exported without holding it in memory.
+    By default the apps are `doc.apps` or `doc.iter_apps()` for a StreamingDoc.
+    """
+    if apps is None:
+        apps = doc.iter_apps() if isinstance(doc, StreamingDoc) else doc.apps
+
+    wb = Workbook(write_only=True)
     header_font = Font(bold=True)
 
     relation_types = doc.relation_types
 
-    # Rename the default sheet
-    ws = wb.active
-    ws.title = 'Variants'
+    ws = wb.create_sheet('Variants')
 
     headers = [
         'App ID', 'Context', 
@@ -25,56 +34,60 @@ def export_variants_to_excel(doc:Doc, output:Path):
         'Description', 'Relation Type(s)',
     ]
 
-    for col_num, header in enumerate(headers, start=1):  # Start from column A (1)
-        cell = ws.cell(row=1, column=col_num)
-        cell.value = header
-        cell.font = header_font
+    def header_row(headers:list[str], worksheet) -> list[WriteOnlyCell]:
+        cells = []
+        for header in headers:
+            cell = WriteOnlyCell(worksheet, value=header)
+            cell.font = header_font
+            cells.append(cell)
+        return cells
+
+    ws.append(header_row(headers, ws))
 
     current_row = 2
-    for app in doc.apps:
+    max_relation_types = 10
+    for app in apps:
+        context = app.text_in_context()
         for pair in app.non_redundant_pairs:
-            ws[f'A{current_row}'] = str(app)
-            ws[f'B{current_row}'] = app.text_in_context()
-            ws[f'C{current_row}'] = pair.active.n
-            ws[f'D{current_row}'] = pair.passive.n
-            ws[f'E{current_row}'] = pair.active.text
-            ws[f'F{current_row}'] = pair.passive.text
-            ws[f'G{current_row}'] = pair.get_description()
-            
-            for relation_type_index, relation_type in enumerate(pair.types):
-                column = ord('H') + relation_type_index
-                ws[f'{chr(column)}{current_row}'] = str(relation_type)
-            
+            row = [
+                str(app),
+                context,
+                pair.active.n,
+                pair.passive.n,
+                pair.active.text,
+                pair.passive.text,
+                pair.get_description(),
+            ]
+            row += [str(relation_type) for relation_type in pair.types]
+            ws.append(row)
             current_row += 1
 
-    data_val = DataValidation(type="list",formula1=f'"{",".join(relation_types.keys())}"')
-    ws.add_data_validation(data_val)
+        max_relation_types = max(max_relation_types, max((len(pair.types) for pair in app.pairs), default=0))
 
-    max_relation_types = max(10, max(len(pair.types) for app in doc.apps for pair in app.pairs))
     end_column = chr(ord('H') + max_relation_types - 1)
 
+    data_val = DataValidation(type="list",formula1=f'"{",".join(relation_types.keys())}"')
+    ws.data_validations.append(data_val)
     data_val.add(f"H2:{end_column}{current_row}")
 
     # Create new sheet with descriptions of categories and counts
     categories_worksheet = wb.create_sheet('Categories')
 
-    # Add a header to the "Category" column
     headers = ['Category', 'Inverse', 'Count', 'Inverse Count', 'Total', 'Description']
-    for col_num, header in enumerate(headers, start=1): 
-        cell = categories_worksheet.cell(row=1, column=col_num)
-        cell.value = header
-        cell.font = header_font
+    categories_worksheet.append(header_row(headers, categories_worksheet))
 
     # Populate the categories from relation_types.keys()
     for idx, category in enumerate(relation_types.values(), start=2):  # Start from row 2
         category_name = str(category)
         inverse_name = str(category.inverse) if category.inverse else category_name
-        categories_worksheet[f'A{idx}'] = category_name
-        categories_worksheet[f'B{idx}'] = inverse_name
-        categories_worksheet[f'C{idx}'] = f'=COUNTIF(Variants!G:{end_column}, "{category_name}")'
-        categories_worksheet[f'D{idx}'] = f'=COUNTIF(Variants!G:{end_column}, "{inverse_name}")'
-        categories_worksheet[f'E{idx}'] = f'=SUM(C{idx}:D{idx})'
-        categories_worksheet[f'F{idx}'] = category.description
+        categories_worksheet.append([
+            category_name,
+            inverse_name,
+            f'=COUNTIF(Variants!G:{end_column}, "{category_name}")',
+            f'=COUNTIF(Variants!G:{end_column}, "{inverse_name}")',
+            f'=SUM(C{idx}:D{idx})',
+            category.description,
+        ])
 
     wb.save(output)
 
@@ -95,21 +108,21 @@ def import_classifications_from_dataframe(doc:Doc, variants_df:pd.DataFrame, out
         #     assert type in relation_types, f'{type} not in {relation_types.keys()}'
         types = set(relation_types[type] for type in types if type in relation_types)
 
-        for pair in app.pairs:
-            if str(pair.active.n) == str(active_reading_id) and str(pair.passive.n) == str(passive_reading_id):
-                # Add relations
-                for type in types - pair.types:
-                    pair.add_type_with_inverse(type, responsible=responsible)
-            
-                # Remove relations
-                for type in pair.types - types:
-                    pair.remove_type_with_inverse(type)
-
-                if description:
-                    pair.add_description(description)
-                elif description == "":
-                    # remove description if it is an empty string
-                    # don't do anything if description is 'None'
-                    pair.remove_description()
+        pair = app.get_pair(str(active_reading_id), str(passive_reading_id))
+        if pair is not None:
+            # Add relations
+            for type in types - pair.types:
+                pair.add_type_with_inverse(type, responsible=responsible)
+        
+            # Remove relations
+            for type in pair.types - types:
+                pair.remove_type_with_inverse(type)
+
+            if description:
+                pair.add_description(description)
+            elif description == "":
+                # remove description if it is an empty string
+                # don't do anything if description is 'None'
+                pair.remove_description()
 
     doc.write(output)        
@@ -0,0 +1,102 @@
+import json
+import secrets
+import threading
+from collections import deque
+from typing import Iterator
+
+DEFAULT_MAX_EVENTS = 1000
+DEFAULT_HEARTBEAT = 15.0
+
+
+class ChangeFeed():
+    """
+    Broadcasts changes to the clients of the GUI as server-sent events.
+
+    The most recent `max_events` events are kept in memory so that a client which reconnects can be sent the events it missed.
+    Event IDs are made from a token for this feed and a counter so that IDs from before the server restarted are not mistaken for current ones.
+    If the events a client missed are no longer available then it is sent a `reset` event and should reload what it is showing.
+    Events can also be published with a name (e.g. `reset` when the document was changed by another program).
+    """
+    def __init__(self, max_events:int=DEFAULT_MAX_EVENTS):
+        self.events = deque(maxlen=max_events)
+        self.token = secrets.token_hex(4)
+        self.last_id = 0
+        self.condition = threading.Condition()
+        self.closed = False
+
+    def event_id(self, number:int) -> str:
+        return f"{self.token}-{number}"
+
+    def publish(self, data:dict, event:str="") -> str:
+        """ Adds an event (with the name `event` if given) and wakes the clients waiting for it. Returns the ID of the event. """
+        with self.condition:
+            self.last_id += 1
+            self.events.append((self.last_id, data, event))
+            self.condition.notify_all()
+            return self.event_id(self.last_id)
+
+    def position(self, last_event_id:str|None) -> int|None:
+        """
+        The number of the last event a client has received from its Last-Event-ID.
+
+        Clients without an ID start from the current event. Returns None if the events after it are no longer available.
+        """
+        if not last_event_id:
+            return self.last_id
+        token, _, number = last_event_id.rpartition("-")
+        if token != self.token or not number.isdigit() or int(number) > self.last_id:
+            return None
+        number = int(number)
+        oldest = self.events[0][0] if self.events else self.last_id + 1
+        if number < oldest - 1:
+            return None
+        return number
+
+    def since(self, number:int) -> list[tuple[int,dict,str]]:
+        with self.condition:
+            return [item for item in self.events if item[0] > number]
+
+    def wait(self, number:int, timeout:float|None=None) -> list[tuple[int,dict,str]]:
+        """ Waits until there are events after `number` (or the timeout passes or the feed is closed) and returns them. """
+        with self.condition:
+            self.condition.wait_for(lambda: self.last_id > number or self.closed, timeout=timeout)
+            return self.since(number)
+
+    def close(self) -> None:
+        """ Ends the streams of all the clients. """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def format(self, number:int, data:dict, event:str="") -> str:
+        lines = [f"id: {self.event_id(number)}"]
+        if event:
+            lines.append(f"event: {event}")
+        lines.append(f"data: {json.dumps(data, ensure_ascii=False)}")
+        return "\n".join(lines) + "\n\n"
+
+    def stream(self, last_event_id:str|None=None, heartbeat:float=DEFAULT_HEARTBEAT) -> Iterator[str]:
+        """
+        Yields the events for a client in the text/event-stream format, starting after `last_event_id`, until the feed is closed.
+
+        A comment is sent if there have been no events for `heartbeat` seconds so that disconnected clients are noticed.
+        """
+        with self.condition:
+            number = self.position(last_event_id)
+            reset = number is None
+            if reset:
+                number = self.last_id
+        yield self.format(number, {}, event="reset") if reset else "retry: 1000\n\n"
+
+        while not self.closed:
+            events = self.wait(number, timeout=heartbeat)
+            if not events:
+                yield ": keep-alive\n\n"
+                continue
+            if events[0][0] > number + 1:
+                # This client fell so far behind that some of its events have been dropped from the buffer
+                number = events[-1][0]
+                yield self.format(number, {}, event="reset")
+                continue
+            for number, data, event in events:
+                yield self.format(number, data, event=event)
@@ -0,0 +1,280 @@
+import hashlib
+import functools
+import threading
+from pathlib import Path
+
+from .apparatus import Doc, App, Pair, RelationType
+from .mapper import Mapper
+from .persistence import WriteBehind, Edit, VersionConflict, DEFAULT_FLUSH_DELAY, DEFAULT_WATCH_INTERVAL
+from .feed import ChangeFeed
+
+ASSETS_DIR = Path(__file__).parent / "templates" / "assets"
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+ASSET_MAX_AGE = 365 * 24 * 60 * 60
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 5000
+DEFAULT_THREADS = 8
+DEFAULT_MAX_EVENT_STREAMS = DEFAULT_THREADS // 2
+EVENT_STREAM_RETRY_AFTER = 30
+
+
+def asset_version(path:str) -> str:
+    """
+    A short hash of the contents of an asset which is added to its URL so that browsers can cache it until it changes.
+
+    The hash is only computed again when the modification time of the file changes.
+    """
+    return hash_asset(path, (ASSETS_DIR/path).stat().st_mtime_ns)
+
+
+@functools.lru_cache(maxsize=128)
+def hash_asset(path:str, mtime_ns:int) -> str:
+    return hashlib.sha256((ASSETS_DIR/path).read_bytes()).hexdigest()[:12]
+
+
+def paginate(items, page:int=1, per_page:int=DEFAULT_PAGE_SIZE) -> tuple[list,dict]:
+    """ Returns the items on a page (numbered from 1) and the details of the pagination to include in a response. """
+    per_page = max(1, min(per_page, MAX_PAGE_SIZE))
+    total = len(items)
+    pages = max(1, (total + per_page - 1) // per_page)
+    page = max(1, min(page, pages))
+    start = (page - 1) * per_page
+    return list(items[start:start + per_page]), dict(page=page, per_page=per_page, total=total, pages=pages)
+
+
+def pair_data(pair:Pair, mapper:Mapper, relation_types:list[RelationType]) -> dict:
+    return dict(
+        key=mapper.key(pair),
+        active=str(pair.active),
+        passive=str(pair.passive),
+        types=[mapper.key(relation_type) for relation_type in relation_types if relation_type in pair.types],
+        rdgai=pair.rdgai_responsible(),
+        description=pair.get_description(),
+    )
+
+
+def create_flask_app(doc:Doc, output:Path, all_apps:bool=False, flush_delay:float|None=None, watch_interval:float=DEFAULT_WATCH_INTERVAL, max_event_streams:int=DEFAULT_MAX_EVENT_STREAMS):
+    """
+    Creates a Flask app to view and classify a document.
+
+    The page shows the first variation unit and the client loads the others from the JSON API as they are navigated to:
+
+    - `GET /api/apps?page=&per_page=` lists the names of the variation units.
+    - `GET /api/apps/<name>` gives the readings and pairs of a variation unit along with its HTML.
+    - `GET /api/relation-types` lists the relation types and `GET /api/relation-types/<name>/pairs?page=&per_page=` lists their pairs.
+    - `POST /api/relation-type` and `POST /api/desc` change the classification or description of a pair.
+
+    CSS and JavaScript are served from `/assets/` with their hash in the URL so that browsers can cache them.
+    Edits are persisted with `WriteBehind` which is available as the `persistence` attribute of the app.
+
+    The app can be served with several threads: each request holds the lock of the `WriteBehind` while it uses the document.
+    The details of a variation unit include its version. If a POST includes the `version` the client last saw
+    and the variation unit has been changed since, then the edit is refused with a 409 (Conflict) response.
+    Successful edits give the new version in the `X-App-Version` header.
+
+    `GET /api/events` is a stream of server-sent events with the new state of the pairs changed by each edit, which is available as the `feed` attribute of the app.
+    Clients which reconnect with a `Last-Event-ID` header are sent the events they missed.
+    Each stream holds a thread of the server for as long as the page is open, so at most `max_event_streams` are open at once
+    (unless it is zero) and other clients are refused with a 503 (Service Unavailable) response so that threads are left for the rest of the API.
+    The output is checked for changes made by another program every `watch_interval` seconds (unless it is zero).
+    These are merged into the document and a `reset` event with the names of the variation units which changed is sent so that clients reload them.
+    """
+    from flask import Flask, Response, request, render_template, jsonify, abort, stream_with_context
+
+    persistence = WriteBehind(doc, output, delay=DEFAULT_FLUSH_DELAY if flush_delay is None else flush_delay)
+    recovered = persistence.recover()
+    if recovered:
+        print(f"Recovered {recovered} edits from {persistence.log.path}")
+
+    # Lazily loaded documents need the classified pairs for the listings of the relation types
+    doc.load_classified_apps()
+    mapper = Mapper(doc)
+    app_names = list(doc.id_to_app)
+    app_positions = {name: index for index, name in enumerate(app_names)}
+
+    app = Flask(__name__, static_folder=str(ASSETS_DIR), static_url_path="/assets")
+    app.config["SEND_FILE_MAX_AGE_DEFAULT"] = ASSET_MAX_AGE
+    app.persistence = persistence
+
+    feed = ChangeFeed()
+    app.feed = feed
+
+    def publish(edit:Edit, pair:Pair) -> None:
+        # Changing the type of a pair can also change the type of the pair in the opposite direction
+        pairs = [pair]
+        opposite = pair.app.get_pair(pair.passive.n, pair.active.n)
+        if opposite is not None:
+            pairs.append(opposite)
+        relation_types = list(doc.relation_types.values())
+        feed.publish(dict(
+            app=edit.app_id,
+            version=persistence.version(edit.app_id),
+            pairs=[pair_data(changed, mapper, relation_types) for changed in pairs],
+        ))
+
+    persistence.listeners.append(publish)
+    persistence.reset_listeners.append(lambda names: feed.publish(dict(apps=names), event="reset"))
+    if watch_interval:
+        persistence.watch(watch_interval)
+
+    @app.context_processor
+    def asset_url_processor():
+        def asset_url(path:str) -> str:
+            return f"/assets/{path}?v={asset_version(path)}"
+        return dict(asset_url=asset_url)
+
+    def get_page_arguments() -> tuple[int,int]:
+        return request.args.get("page", 1, type=int), request.args.get("per_page", DEFAULT_PAGE_SIZE, type=int)
+
+    def get_app(name:str) -> App:
+        if name not in app_positions:
+            abort(404)
+        return doc[name]
+
+    def app_pairs(variation_unit:App) -> list[Pair]:
+        return variation_unit.pairs if all_apps else variation_unit.non_redundant_pairs
+
+    @app.route("/")
+    def root():
+        with persistence.lock:
+            first_app = doc[app_names[0]] if app_names else None
+            version = persistence.version(app_names[0]) if app_names else 0
+            return render_template('gui.html', doc=doc, app=first_app, version=version, mapper=mapper, all_apps=all_apps)
+
+    @app.route("/api/apps")
+    def api_apps():
+        names, pagination = paginate(app_names, *get_page_arguments())
+        start = (pagination["page"] - 1) * pagination["per_page"]
+        items = [dict(name=name, index=start + offset) for offset, name in enumerate(names)]
+        return jsonify(items=items, **pagination)
+
+    @app.route("/api/apps/<path:name>")
+    def api_app(name:str):
+        with persistence.lock:
+            variation_unit = get_app(name)
+            index = app_positions[name]
+            relation_types = list(doc.relation_types.values())
+            return jsonify(
+                key=mapper.key(variation_unit),
+                name=name,
+                index=index,
+                version=persistence.version(name),
+                previous=app_names[index - 1] if index > 0 else None,
+                next=app_names[index + 1] if index + 1 < len(app_names) else None,
+                text_before=variation_unit.text_before(),
+                text=variation_unit.text_with_signs(),
+                text_after=variation_unit.text_after(),
+                readings=[dict(n=reading.n, text=str(reading), witnesses=reading.witnesses) for reading in variation_unit.readings],
+                pairs=[pair_data(pair, mapper, relation_types) for pair in app_pairs(variation_unit)],
+                html=render_template('app.html', doc=doc, app=variation_unit, mapper=mapper, all_apps=all_apps),
+            )
+
+    @app.route("/api/relation-types")
+    def api_relation_types():
+        with persistence.lock:
+            return jsonify(items=[
+                dict(key=mapper.key(relation_type), name=relation_type.name, description=relation_type.description, count=len(relation_type.pairs))
+                for relation_type in doc.relation_types.values()
+            ])
+
+    @app.route("/api/relation-types/<name>/pairs")
+    def api_relation_type_pairs(name:str):
+        with persistence.lock:
+            relation_type = doc.relation_types.get(name, None)
+            if relation_type is None:
+                abort(404)
+            pairs, pagination = paginate(relation_type.pairs_sorted(), *get_page_arguments())
+            items = [dict(app=str(pair.app), active=str(pair.active), passive=str(pair.passive)) for pair in pairs]
+            return jsonify(items=items, **pagination)
+
+    event_streams = threading.BoundedSemaphore(max_event_streams) if max_event_streams else None
+
+    @app.route("/api/events")
+    def api_events():
+        if event_streams and not event_streams.acquire(blocking=False):
+            return Response(
+                "Too many pages are following changes. Try again later.",
+                status=503,
+                headers={"Retry-After": str(EVENT_STREAM_RETRY_AFTER)},
+            )
+
+        last_event_id = request.headers.get("Last-Event-ID", request.args.get("last_event_id", None))
+        response = Response(
+            stream_with_context(feed.stream(last_event_id)),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+        if event_streams:
+            response.call_on_close(event_streams.release)
+        return response
+
+    def apply(edit:Edit, data:dict):
+        """ Applies an edit from a POST and gives the response. """
+        version = data.get('version', None)
+        try:
+            persistence.apply(edit, expected_version=None if version is None else int(version))
+        except VersionConflict as conflict:
+            print(str(conflict))
+            return jsonify(error=str(conflict), version=conflict.version), 409
+        return "Success", 200, {"X-App-Version": str(persistence.version(edit.app_id))}
+
+    @app.route("/api/relation-type", methods=['POST'])
+    def api_relation_type():
+        data = request.get_json()
+
+        with persistence.lock:
+            relation_type = mapper.obj(data['relation_type'])
+            assert isinstance(relation_type, RelationType), f"Expected RelationType, got {type(relation_type)}"
+
+            pair = mapper.obj(data['pair'])
+            assert isinstance(pair, Pair), f"Expected Pair, got {type(pair)}"
+
+            try:
+                if data['operation'] not in ['add', 'remove']:
+                    raise ValueError(f"Unknown operation {data['operation']}")
+                print(data['operation'], relation_type)
+                return apply(Edit.create(f"{data['operation']}-type", pair, relation_type=relation_type), data)
+            except Exception as e:
+                print(str(e))
+                return str(e), 400
+
+    @app.route("/api/desc", methods=['POST'])
+    def api_desc():
+        data = request.get_json()
+
+        with persistence.lock:
+            pair = mapper.obj(data['pair'])
+            assert isinstance(pair, Pair), f"Expected Pair, got {type(pair)}"
+
+            try:
+                if data['operation'] == 'remove':
+                    return apply(Edit.create("remove-description", pair), data)
+                elif data['operation'] == 'add':
+                    return apply(Edit.create("add-description", pair, description=data['description']), data)
+                else:
+                    raise ValueError(f"Unknown operation {data['operation']}")
+            except Exception as e:
+                print(str(e))
+                return str(e), 400
+
+    return app
+
+
+def serve(flask_app, host:str=DEFAULT_HOST, port:int=DEFAULT_PORT, threads:int=DEFAULT_THREADS) -> None:
+    """
+    Serves a Flask app with a production WSGI server which handles requests on several threads.
+
+    It uses waitress (with `threads` worker threads) if it is installed and otherwise the threaded server from werkzeug
+    which starts a thread for each request.
+    """
+    try:
+        import waitress
+    except ImportError:
+        from werkzeug.serving import make_server
+
+        print(f"Serving on http://{host}:{port} (install waitress to use a fixed number of threads)")
+        make_server(host, port, flask_app, threaded=True).serve_forever()
+    else:
+        print(f"Serving on http://{host}:{port} with {threads} threads")
+        waitress.serve(flask_app, host=host, port=port, threads=threads)
@@ -0,0 +1,95 @@
+import os
+import json
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from dataclasses import dataclass, asdict
+
+from .apparatus import Pair
+
+
+def pair_key(pair:Pair) -> tuple[str, str, str]:
+    """ Returns a key for a pair of readings made from the app ID and the active and passive reading identifiers. """
+    return (str(pair.app), pair.active.n, pair.passive.n)
+
+
+@dataclass
+class JournalEntry():
+    app_id: str
+    active: str
+    passive: str
+    category: str
+    justification: str
+    model: str = ""
+    timestamp: str = ""
+
+    def key(self) -> tuple[str, str, str]:
+        return (self.app_id, self.active, self.passive)
+
+
+class Journal():
+    """
+    An append-only JSON Lines file recording the response of the language model for each pair as soon as it is received.
+
+    It is used to resume classification runs which were interrupted without sending any pair to the model twice.
+    """
+    def __init__(self, path:Path|str):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+
+    @classmethod
+    def default_path(cls, output:Path) -> Path:
+        """ The path of the journal that sits alongside an output TEI file. """
+        output = Path(output)
+        return output.with_name(f"{output.name}.journal.jsonl")
+
+    def clear(self) -> None:
+        """ Removes the entries from a previous run so that they are not applied when this run is resumed. """
+        with self.lock:
+            self.path.unlink(missing_ok=True)
+
+    def record(self, pair:Pair, category:str, justification:str, model:str="") -> JournalEntry:
+        """ Appends the response for a pair to the journal and flushes it to disk. """
+        app_id, active, passive = pair_key(pair)
+        entry = JournalEntry(
+            app_id=app_id,
+            active=active,
+            passive=passive,
+            category=category,
+            justification=justification,
+            model=model,
+            timestamp=datetime.now(timezone.utc).isoformat(),
+        )
+        line = json.dumps(asdict(entry), ensure_ascii=False) + "\n"
+        with self.lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+        return entry
+
+    def entries(self) -> list[JournalEntry]:
+        """
+        Reads the entries in the journal.
+
+        A partially written line at the end of the file (e.g. from a crash) is ignored.
+        """
+        if not self.path.exists():
+            return []
+
+        entries = []
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    data = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                entries.append(JournalEntry(**data))
+        return entries
+
+    def keys(self) -> set[tuple[str, str, str]]:
+        return set(entry.key() for entry in self.entries())
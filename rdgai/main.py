@@ -4,12 +4,18 @@ from rich.console import Console
 import pandas as pd
 
 from .apparatus import Doc
+from .streaming import StreamingDoc
 from .export import export_variants_to_excel, import_classifications_from_dataframe
 from .classification import classify as classify_fn
 from .evaluation import evaluate_docs
 from .classification import DEFAULT_MODEL_ID
 from .validation import validate as validate_fn
 from .prompts import build_preamble
+from .journal import Journal
+from .cache import default_cache_dir
+from .batch import export_batch_requests, import_batch_results, BATCH_FORMATS
+from .persistence import DEFAULT_FLUSH_DELAY
+from .gui import serve, DEFAULT_HOST, DEFAULT_PORT, DEFAULT_THREADS
 
 console = Console()
 error_console = Console(stderr=True, style="bold red")
@@ -37,8 +43,37 @@ def get_output_path(doc:Path, output:Path, inplace:bool) -> Path:
     return output
 
 
+@app.callback()
+def main(
+    ctx:typer.Context,
+    example_cache:bool=typer.Option(True, "--example-cache/--no-example-cache", help="Whether or not to store the representative examples selected for the prompts in the cache directory so that they do not need to be selected again for the same classified pairs."),
+):
+    """ Rdgai classifies the relations between variant readings in a TEI XML critical apparatus. """
+    ctx.obj = dict(example_cache_dir=default_cache_dir() if example_cache else None)
+
+
+def doc_options(ctx:typer.Context) -> dict:
+    """ The keyword arguments for reading documents with the example cache if it is enabled by --example-cache. """
+    return dict(ctx.obj or {})
+
+
+def read_doc(path:Path, lazy:bool=False, example_cache_dir:Path|None=None) -> Doc:
+    """ Reads a TEI document, using the example cache in `example_cache_dir` if it is given. """
+    return Doc(path, lazy=lazy, example_cache_dir=example_cache_dir)
+
+
+def get_cache_dir(cache_dir:Path|None, cache:bool) -> Path|None:
+    """ Returns the directory for the response cache or None if caching is disabled. Giving a directory turns caching on. """
+    if cache_dir:
+        return cache_dir
+    if not cache:
+        return None
+    return default_cache_dir()
+
+
 @app.command()
 def classify(
+    ctx:typer.Context,
     doc:Path=typer.Argument(..., help="The path to the TEI XML document to classify."),
     output:Path=typer.Argument(None, help="The path to the output TEI XML file."),
     inplace: bool = typer.Option(False, "--inplace", "-i", help="Overwrite the input file."),
@@ -48,14 +83,47 @@ def classify(
     temperature:float=typer.Option(0.1, help="Temperature for sampling from the language model."),
     prompt_only:bool=typer.Option(False, help="Only print the prompt and not classify."),
     examples:int=typer.Option(10, help="Number of examples to include in the prompt."),
-    examples_doc:Path=typer.Option(None, help="The path to a TEI XML document to use for examples.")
+    examples_doc:Path=typer.Option(None, help="The path to a TEI XML document to use for examples."),
+    workers:int=typer.Option(1, "--workers", "--max-concurrency", help="Number of requests to send to the language model concurrently."),
+    requests_per_minute:int=typer.Option(0, help="Maximum number of requests per minute to send to the language model. Zero means no limit."),
+    tokens_per_minute:int=typer.Option(0, help="Maximum number of (estimated) prompt tokens per minute to send to the language model. Zero means no limit."),
+    checkpoint_every:int=typer.Option(10, help="Write the output file after this many pairs have been classified. Zero means only write by time."),
+    checkpoint_interval:float=typer.Option(60.0, help="Write the output file when this many seconds have passed since the last write. Zero means only write by number of pairs."),
+    journal:Path=typer.Option(None, help="Record each response from the language model in this journal file so that the run can be resumed. It is cleared at the start of a run unless --resume is used."),
+    resume:bool=typer.Option(False, help="Apply the responses in the journal to the document and only classify the remaining pairs. By default the journal is the output path with '.journal.jsonl' appended."),
+    prompt_caching:bool=typer.Option(False, help="Mark the prompt preamble for caching by the provider if the language model supports it."),
+    cache_dir:Path=typer.Option(None, help="Directory for the cache of responses from the language model. Giving it turns on --cache. By default it is $RDGAI_CACHE_DIR or ~/.cache/rdgai."),
+    cache:bool=typer.Option(False, "--cache/--no-cache", help="Whether or not to store the responses from the language model and reuse them for prompts that have been sent before. The number reused is printed at the end."),
+    batch:bool=typer.Option(False, help="Classify all the pairs of readings in a variation unit with a single request to the language model."),
+    batch_export:Path=typer.Option(None, help="Write the prompts for the unclassified pairs to this JSON Lines file for a provider's batch API instead of classifying."),
+    batch_format:str=typer.Option("openai", help=f"The batch API to write the --batch-export file for. One of: {', '.join(BATCH_FORMATS)}."),
+    batch_import:Path=typer.Option(None, help="Apply the responses in this JSON Lines file of results from a provider's batch API instead of classifying."),
+    stream:bool=typer.Option(False, help="Read and write the document one variation unit at a time so that it does not need to fit in memory."),
 ):
     """
     Classifies relations in TEI documents.
     """
-    doc = Doc(doc)
+    if stream and (batch_export or batch_import):
+        raise typer.BadParameter("You cannot use --stream with --batch-export or --batch-import.")
+    if batch_format not in BATCH_FORMATS:
+        raise typer.BadParameter(f"--batch-format must be one of: {', '.join(BATCH_FORMATS)}")
+
+    doc = StreamingDoc(doc, **doc_options(ctx)) if stream else read_doc(doc, **doc_options(ctx))
+    examples_doc = read_doc(examples_doc, **doc_options(ctx)) if examples_doc and Path(examples_doc).exists() else None
+
+    if batch_export:
+        count = export_batch_requests(doc, batch_export, llm=llm, temperature=temperature, examples=examples, examples_doc=examples_doc, batch_format=batch_format)
+        console.print(f"Wrote {count} requests to {batch_export}")
+        return
+
     output = get_output_path(doc, output, inplace)
-    examples_doc = Doc(examples_doc) if examples_doc and Path(examples_doc).exists() else None
+    if batch_import:
+        count = import_batch_results(doc, batch_import, output, console=console)
+        console.print(f"Classified {count} pairs from {batch_import}")
+        return
+
+    if resume and not journal:
+        journal = Journal.default_path(output)
 
     return classify_fn(
         doc=doc, 
@@ -68,62 +136,94 @@ def classify(
         examples=examples, 
         console=console,
         examples_doc=examples_doc,
+        workers=workers,
+        requests_per_minute=requests_per_minute,
+        tokens_per_minute=tokens_per_minute,
+        checkpoint_every=checkpoint_every,
+        checkpoint_interval=checkpoint_interval,
+        journal=journal,
+        resume=resume,
+        prompt_caching=prompt_caching,
+        cache_dir=get_cache_dir(cache_dir, cache),
+        batch=batch,
     )
 
 
 @app.command()
 def classified_pairs(
+    ctx:typer.Context,
     doc:Path=typer.Argument(..., help="The path to the TEI XML document with the classifications."),
 ):
     """ Print classified pairs in a document. """
-    doc = Doc(doc)
+    doc = read_doc(doc, lazy=True, **doc_options(ctx))
     doc.print_classified_pairs(console)
 
 
 @app.command()
 def html(
+    ctx:typer.Context,
     doc:Path=typer.Argument(..., help="The path to the TEI XML document to render as HTML."),
     output:Path=typer.Argument(..., help="The path to the output HTML file."),
     all_apps:bool=typer.Option(False, help="Whether or not to use all variation unit `app` elements. By default it shows only non-redundant pairs of readings."),
 ):    
     """ Renders the variation units of a TEI document as HTML. """
-    doc = Doc(doc)
+    doc = read_doc(doc, **doc_options(ctx))
     doc.render_html(output, all_apps=all_apps)
 
 
 @app.command()
 def gui(
+    ctx:typer.Context,
     doc:Path=typer.Argument(..., help="The path to the TEI XML document to classify."),
     output:Path=typer.Argument(None, help="The path to the output TEI XML file."),
     inplace: bool = typer.Option(False, "--inplace", "-i", help="Overwrite the input file."),
     debug:bool=True,
     use_reloader:bool=False,
     all_apps:bool=typer.Option(False, help="Whether or not to use all variation unit `app` elements. By default it shows only non-redundant pairs of readings."),
+    flush_delay:float=typer.Option(DEFAULT_FLUSH_DELAY, help="The number of seconds without edits before the output is written. Edits are logged as soon as they are made."),
+    host:str=typer.Option(DEFAULT_HOST, help="The interface to serve the GUI on. Use 0.0.0.0 to allow other computers to connect."),
+    port:int=typer.Option(DEFAULT_PORT, help="The port to serve the GUI on."),
+    production:bool=typer.Option(False, help="Serve with a multithreaded production WSGI server (waitress if installed) so that several people can classify at once."),
+    threads:int=typer.Option(DEFAULT_THREADS, help="The number of threads for the production server. Each open page uses one for its feed of changes, which are limited to half of the threads."),
 ):
     """ Starts a Flask app to view and classify a TEI document. """
     output = get_output_path(doc, output, inplace)
-    doc = Doc(doc)
-    flask_app = doc.flask_app(output, all_apps=all_apps)
-    flask_app.run(debug=debug, use_reloader=use_reloader)
+    doc = read_doc(doc, lazy=True, **doc_options(ctx))
+    flask_app = doc.flask_app(output, all_apps=all_apps, flush_delay=flush_delay, max_event_streams=max(1, threads // 2) if production else 0)
+    try:
+        if production:
+            serve(flask_app, host=host, port=port, threads=threads)
+        else:
+            flask_app.run(host=host, port=port, debug=debug, use_reloader=use_reloader)
+    finally:
+        flask_app.feed.close()
+        flask_app.persistence.close()
 
 
 @app.command()
 def evaluate(
+    ctx:typer.Context,
     predicted:Path=typer.Argument(..., help="The path to the TEI XML document with predictions from Rdgai to evaluate."),
     ground_truth:Path=typer.Argument(..., help="The path to the input TEI XML document to use as the ground truth for evaluation."),
     confusion_matrix:Path=typer.Option(None, help="Path to write the confusion matrix plot as a CSV file."),
     confusion_matrix_plot:Path=typer.Option(None, help="Path to write the confusion matrix plot as an HTML file."),
     report:Path=typer.Option(None, help="Path to write the report."),
+    stream:bool=typer.Option(False, help="Read the documents one variation unit at a time so that they do not need to fit in memory."),
 ):
     """ Evaluates the classifications in a predicted document against a ground truth document. """
-    predicted = Doc(predicted)
-    ground_truth = Doc(ground_truth)
+    if stream and report:
+        raise typer.BadParameter("You cannot use --stream with --report.")
+
+    doc_class = StreamingDoc if stream else read_doc
+    predicted = doc_class(predicted, **doc_options(ctx))
+    ground_truth = doc_class(ground_truth, **doc_options(ctx))
     
     evaluate_docs(predicted, ground_truth, confusion_matrix=confusion_matrix, confusion_matrix_plot=confusion_matrix_plot, report=report)
 
 
 @app.command()
 def validate(
+    ctx:typer.Context,
     ground_truth:Path=typer.Argument(..., help="The path to the input TEI XML document to use as the ground truth for evaluation."),
     output:Path=typer.Argument(..., help="The path to the output TEI XML file."),
     proportion:float=typer.Option(0.5, help="Proportion of classified pairs to use for validation."),
@@ -135,9 +235,17 @@ def validate(
     confusion_matrix_plot:Path=typer.Option(None, help="Path to write the confusion matrix plot as an HTML file."),
     seed:int=typer.Option(42, help="Seed for random sampling of validation pairs."),
     report:Path=typer.Option(None, help="Path to write the report."),
+    workers:int=typer.Option(1, "--workers", "--max-concurrency", help="Number of requests to send to the language model concurrently."),
+    requests_per_minute:int=typer.Option(0, help="Maximum number of requests per minute to send to the language model. Zero means no limit."),
+    tokens_per_minute:int=typer.Option(0, help="Maximum number of (estimated) prompt tokens per minute to send to the language model. Zero means no limit."),
+    prompt_caching:bool=typer.Option(False, help="Mark the prompt preamble for caching by the provider if the language model supports it."),
+    cache_dir:Path=typer.Option(None, help="Directory for the cache of responses from the language model. Giving it turns on --cache. By default it is $RDGAI_CACHE_DIR or ~/.cache/rdgai."),
+    cache:bool=typer.Option(False, "--cache/--no-cache", help="Whether or not to store the responses from the language model and reuse them for prompts that have been sent before. The number reused is printed at the end."),
+    batch:bool=typer.Option(False, help="Classify all the pairs of readings in a variation unit with a single request to the language model."),
 ):
     """ Takes a ground truth document, chooses a proportion of classified pairs to validate against and outputs a report. """
-    ground_truth = Doc(ground_truth)
+    options = doc_options(ctx)
+    ground_truth = read_doc(ground_truth, **options)
     
     validate_fn(
         ground_truth, 
@@ -151,33 +259,44 @@ def validate(
         confusion_matrix=confusion_matrix, 
         confusion_matrix_plot=confusion_matrix_plot, 
         report=report,
+        workers=workers,
+        requests_per_minute=requests_per_minute,
+        tokens_per_minute=tokens_per_minute,
+        prompt_caching=prompt_caching,
+        cache_dir=get_cache_dir(cache_dir, cache),
+        batch=batch,
+        example_cache_dir=options.get("example_cache_dir", None),
     )
 
 
 @app.command()
 def clean(
+    ctx:typer.Context,
     doc:Path=typer.Argument(..., help="The path to the TEI XML document to clean."),
     output:Path=typer.Argument(None, help="The path to the output TEI XML file."),
     inplace: bool = typer.Option(False, "--inplace", "-i", help="Overwrite the input file."),
 ):
     """ Cleans a TEI XML file for common errors. """
     output = get_output_path(doc, output, inplace)
-    doc = Doc(doc)
+    doc = read_doc(doc, **doc_options(ctx))
     doc.clean(output=output)
 
 
 @app.command()
 def export(
+    ctx:typer.Context,
     doc:Path=typer.Argument(..., help="The path to the TEI XML document to export."),
     output:Path=typer.Argument(..., help="The path to the output Excel file."),
+    stream:bool=typer.Option(False, help="Read the document one variation unit at a time so that it does not need to fit in memory."),
 ):
     """ Exports pairs of readings with classifications from a TEI document to an Excel spreadsheet. """
-    doc = Doc(doc)
+    doc = StreamingDoc(doc, **doc_options(ctx)) if stream else read_doc(doc, **doc_options(ctx))
     export_variants_to_excel(doc, output)
 
 
 @app.command()
 def import_classifications(
+    ctx:typer.Context,
     doc:Path=typer.Argument(..., help="The path to the base TEI XML document to use for importing the classifications from Excel."),
     spreadsheet:Path=typer.Argument(..., help="The path to the Excel file to import."),
     output:Path=typer.Argument(None, help="The path to the output TEI XML file."),
@@ -185,7 +304,7 @@ def import_classifications(
     responsible:str=typer.Option("", help="The responsible party for the classifications. By default it is the name of the spreadsheet."),
 ):
     """ Imports classifications from a spreadsheet into a TEI document. """
-    doc = Doc(doc)
+    doc = read_doc(doc, **doc_options(ctx))
     output = get_output_path(doc, output, inplace)
 
     if spreadsheet.suffix == ".xlsx":
@@ -204,10 +323,11 @@ def import_classifications(
 
 @app.command()
 def prompt_preamble(
+    ctx:typer.Context,
     doc:Path=typer.Argument(..., help="The path to the TEI XML document to classify."),
     examples:int=typer.Option(10, help="Number of examples to include in the prompt."),
 ):
     """ Prints the prompt preamble for a TEI document for a given number of examples. """
-    doc = Doc(doc)
+    doc = read_doc(doc, lazy=True, **doc_options(ctx))
     template = build_preamble(doc, examples)
     print(template)
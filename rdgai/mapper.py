@@ -1,25 +1,87 @@
+from urllib.parse import quote, unquote
+
+SEPARATOR = "/"
+
+
+def make_key(*parts) -> str:
+    """ Joins the parts of a key, percent-encoding each part so that the key can be split again. """
+    return SEPARATOR.join(quote(str(part), safe="") for part in parts)
+
+
+def split_key(key:str) -> list[str]:
+    return [unquote(part) for part in key.split(SEPARATOR)]
+
+
+def object_key(object) -> str:
+    """
+    The key of an object derived from its identifiers:
+
+    - a relation type: `type/<name>`
+    - an app: `app/<app ID>`
+    - a pair: `pair/<app ID>/<active reading n>/<passive reading n>`
+
+    Other objects use `str(object)`.
+    """
+    from .apparatus import App, Pair, RelationType
+
+    if isinstance(object, Pair):
+        return make_key("pair", object.app, object.active.n, object.passive.n)
+    if isinstance(object, App):
+        return make_key("app", object)
+    if isinstance(object, RelationType):
+        return make_key("type", object.name)
+    return str(object)
 
 
 class Mapper():
-    def __init__(self):
+    """
+    Maps objects to string keys which can be used in HTML and in API calls, and back again.
+
+    The keys of apps, pairs and relation types are derived from their identifiers (see `object_key`)
+    so that they are the same each time a document is loaded and can be written by scripts.
+    If a document is given, keys which have not been given out yet are resolved by looking them up in it.
+    Two different objects cannot have the same key because a key which was made unique some other way
+    could not be resolved again after a restart, so a ValueError is raised instead.
+    """
+    def __init__(self, doc=None):
+        self.doc = doc
         self.key_to_object = {}
         self.object_to_key = {}
-    
+
     def key(self, object):
         if object in self.object_to_key:
             return self.object_to_key[object]
-        
-        key = str(object)
-        # check if key is already in use and if it is, then make unique by adding number
-        if key in self.key_to_object:
-            i = 2
-            while f"{key}_{i}" in self.key_to_object:
-                i += 1
-            key = f"{key}_{i}"
+
+        key = object_key(object)
+        existing = self.key_to_object.get(key, None)
+        if existing is None and self.doc is not None:
+            existing = self.resolve(key)
+        if existing is not None and existing is not object:
+            raise ValueError(f"The key '{key}' is already used for a different object: {existing!r}")
 
         self.key_to_object[key] = object
         self.object_to_key[object] = key
         return key
 
     def obj(self, key):
-        return self.key_to_object.get(key)
\ No newline at end of file
+        object = self.key_to_object.get(key, None)
+        if object is None and self.doc is not None:
+            object = self.resolve(key)
+            if object is not None:
+                self.key_to_object[key] = object
+                self.object_to_key.setdefault(object, key)
+        return object
+
+    def resolve(self, key:str):
+        """ Finds the app, pair or relation type in the document for a key or returns None if there isn't one. """
+        kind, *parts = split_key(key)
+        try:
+            if kind == "type" and len(parts) == 1:
+                return self.doc.relation_types.get(parts[0], None)
+            if kind == "app" and len(parts) == 1:
+                return self.doc[parts[0]]
+            if kind == "pair" and len(parts) == 3:
+                return self.doc[parts[0]].get_pair(parts[1], parts[2])
+        except (KeyError, IndexError):
+            pass
+        return None
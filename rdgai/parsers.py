@@ -1,3 +1,4 @@
+import re
 from dataclasses import dataclass
 from langchain_core.runnables import Runnable
 
@@ -28,3 +29,34 @@ class CategoryParser(Runnable):
                     
         return category, justification
 
+
+
+@dataclass
+class BatchCategoryParser(Runnable):
+    relation_type_names: list[str]
+
+    def invoke(self, llm_output:str, *args, **kwargs) -> list[tuple[str, str, str, str]]:
+        """
+        Parses the output of a language model for a batch of pairs to a list of (active, passive, category, justification).
+
+        Each line should have the format: active → passive = category : justification
+        Lines which cannot be parsed or which do not have a known category are skipped.
+        """
+        llm_output = llm_output.strip()
+        if "-----" in llm_output:
+            llm_output = llm_output[:llm_output.find("-----")]
+
+        results = []
+        for line in llm_output.splitlines():
+            match = re.match(r"^\s*[-*]?\s*(\S+)\s*(?:→|->|➞)\s*(\S+)\s*=\s*([^:]+?)\s*(?::\s*(.*))?$", line)
+            if not match:
+                continue
+
+            active, passive, category, justification = match.groups()
+            category = category.strip().strip("*`'\"")
+            if category not in self.relation_type_names:
+                continue
+
+            results.append((active, passive, category, (justification or "").strip()))
+
+        return results
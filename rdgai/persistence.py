@@ -0,0 +1,329 @@
+import os
+import json
+import time
+import atexit
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable
+from dataclasses import dataclass, asdict
+
+from lxml import etree as ET
+
+from .apparatus import Doc, App, Pair, RelationType
+from .tei import TRANSCRIPTIONAL_LIST_RELATIONS
+
+DEFAULT_FLUSH_DELAY = 2.0
+DEFAULT_WATCH_INTERVAL = 2.0
+
+
+class VersionConflict(Exception):
+    """ Raised when an edit is made to a variation unit which has changed since the client last saw it. """
+    def __init__(self, app_id:str, expected:int, version:int):
+        super().__init__(f"{app_id} has been changed by someone else (version {version} rather than {expected}). Reload it and try again.")
+        self.app_id = app_id
+        self.expected = expected
+        self.version = version
+
+
+@dataclass
+class Edit():
+    """ A change made to a pair of readings in the GUI. """
+    operation: str
+    app_id: str
+    active: str
+    passive: str
+    relation_type: str = ""
+    description: str = ""
+    timestamp: str = ""
+
+    @classmethod
+    def create(cls, operation:str, pair:Pair, relation_type:RelationType|None=None, description:str="") -> "Edit":
+        return cls(
+            operation=operation,
+            app_id=str(pair.app),
+            active=pair.active.n,
+            passive=pair.passive.n,
+            relation_type=relation_type.name if relation_type else "",
+            description=description,
+            timestamp=datetime.now(timezone.utc).isoformat(),
+        )
+
+    def apply(self, doc:Doc) -> Pair:
+        """ Makes the change to the document and returns the pair which was changed. """
+        pair = doc[self.app_id].get_pair(self.active, self.passive)
+        if pair is None:
+            raise ValueError(f"Cannot find pair {self.active} ➞ {self.passive} in {self.app_id}")
+
+        if self.operation == "add-type":
+            pair.add_type_with_inverse(doc.relation_types[self.relation_type])
+        elif self.operation == "remove-type":
+            pair.remove_type_with_inverse(doc.relation_types[self.relation_type])
+        elif self.operation == "add-description":
+            pair.add_description(self.description)
+        elif self.operation == "remove-description":
+            pair.remove_description()
+        else:
+            raise ValueError(f"Unknown operation {self.operation}")
+        return pair
+
+
+def stat_signature(stat:os.stat_result) -> tuple[int,int,int]:
+    """ Identifies the version of a file from its inode, size and modification time, which are kept when it is renamed. """
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+def file_signature(path:Path) -> tuple[int,int,int]|None:
+    """ The signature of a file (see `stat_signature`) or None if it does not exist. """
+    try:
+        return stat_signature(path.stat())
+    except FileNotFoundError:
+        return None
+
+
+def relations_xml(app:App) -> bytes:
+    return b"".join(ET.tostring(element, with_tail=False) for element in TRANSCRIPTIONAL_LIST_RELATIONS(app.element, app.namespaced))
+
+
+def pair_state(pair:Pair) -> tuple:
+    """ The classification of a pair: the names of its relation types, who is responsible for them and its description. """
+    responsible = sorted(element.get("resp", "") for element in pair.relation_elements())
+    return (pair.relation_type_names(), responsible, pair.get_description())
+
+
+def sync_pair(doc:Doc, pair:Pair, source:Pair) -> None:
+    """ Changes the classification of a pair to match the same pair (`source`) in another copy of the document. """
+    for relation_type in list(pair.types):
+        pair.remove_type(relation_type)
+    pair.remove_description()
+    for source_type in source.types:
+        relation_type = doc.relation_types.get(source_type.name, None) or doc.add_relation_type(source_type.name, source_type.description)
+        pair.add_type(relation_type, responsible=source.element_for_type(source_type).get("resp", None))
+    if source.has_description():
+        pair.add_description(source.get_description())
+
+
+class EditLog():
+    """
+    An append-only JSON Lines file of the edits which have not yet been written to the output TEI file.
+
+    Each edit is flushed to disk as soon as it is made so that it can be recovered after a crash.
+    """
+    def __init__(self, path:Path|str):
+        self.path = Path(path)
+
+    @classmethod
+    def default_path(cls, output:Path) -> Path:
+        """ The path of the edit log that sits alongside an output TEI file. """
+        output = Path(output)
+        return output.with_name(f"{output.name}.edits.jsonl")
+
+    def record(self, edit:Edit) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(asdict(edit), ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def entries(self) -> list[Edit]:
+        """ Reads the edits in the log. A partially written line at the end of the file (e.g. from a crash) is ignored. """
+        if not self.path.exists():
+            return []
+
+        edits = []
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    edits.append(Edit(**json.loads(line)))
+                except (json.JSONDecodeError, TypeError):
+                    continue
+        return edits
+
+    def clear(self) -> None:
+        self.path.unlink(missing_ok=True)
+
+
+class WriteBehind():
+    """
+    Applies edits to a document in memory and writes the document to the output later on a background thread.
+
+    Each edit is recorded in an EditLog straight away. The output is written once there have been no edits for `delay` seconds
+    (or at most `max_delay` seconds after the first edit which has not been written) and when it is closed.
+    The log is cleared each time the output is written. If `delay` is zero then the output is written after every edit.
+
+    All changes to the document and writes of the output are made while holding `lock` so that it can be shared by several threads.
+    Each variation unit has a version which is incremented by each edit to it, so that edits made from an out-of-date view can be refused.
+    The functions in `listeners` are called with each edit and the pair it changed once it has been applied.
+
+    If the output is changed by another program (e.g. `rdgai classify` writing to the same file), the changes are merged into the document
+    before it is written so that they are not overwritten (see `merge_external`). Call `watch` to also check for them on a background thread.
+    The functions in `reset_listeners` are called with the names of the variation units which were changed this way.
+    """
+    def __init__(self, doc:Doc, output:Path|str, delay:float=DEFAULT_FLUSH_DELAY, max_delay:float|None=None, log:EditLog|None=None):
+        self.doc = doc
+        self.output = Path(output)
+        self.delay = delay
+        self.max_delay = max_delay if max_delay is not None else 10 * delay
+        self.log = log or EditLog(EditLog.default_path(self.output))
+        self.lock = threading.RLock()
+        self.timer = None
+        self.dirty_since = None
+        self.closed = False
+        self.versions:dict[str,int] = {}
+        self.listeners:list[Callable[[Edit,Pair],None]] = []
+        self.reset_listeners:list[Callable[[list[str]],None]] = []
+        self.output_signature = file_signature(self.output)
+        self.stopped = threading.Event()
+        atexit.register(self.close)
+
+    def recover(self) -> int:
+        """
+        Applies the edits in the log from a previous session which were not written to the output and then writes the output.
+
+        Returns the number of edits recovered.
+        """
+        edits = self.log.entries()
+        with self.lock:
+            for edit in edits:
+                try:
+                    edit.apply(self.doc)
+                except (KeyError, ValueError) as err:
+                    print(f"Cannot recover edit {edit}: {err}")
+            self.write()
+            self.log.clear()
+        return len(edits)
+
+    def write(self) -> None:
+        """
+        Writes the document to the output and records the signature of the file which was written.
+
+        The signature comes from the write itself rather than from the output afterwards so that a change made by another program
+        straight after this write is still noticed, while this write is never mistaken for one.
+        """
+        with self.lock:
+            stat = self.doc.write(self.output)
+            self.output_signature = stat_signature(stat) if stat is not None else file_signature(self.output)
+
+    def merge_external(self) -> list[str]:
+        """
+        Merges changes made to the output by another program since it was last written or checked.
+
+        The classifications of the pairs in the variation units which differ are changed to match the file,
+        then the edits which have not been written yet are made again so that they take precedence.
+        The variation units which were changed get a new version and the `reset_listeners` are called with their names, which are returned.
+        The output is only read once for each change to it, even if it cannot be read (e.g. because the other program is still writing it).
+        """
+        with self.lock:
+            signature = file_signature(self.output)
+            if signature is None or signature == self.output_signature:
+                return []
+            self.output_signature = signature
+            try:
+                source = Doc(self.output)
+            except Exception as err:
+                print(f"Cannot read the changes made to {self.output}: {err}")
+                return []
+
+            changed = []
+            for name, source_app in source.id_to_app.items():
+                try:
+                    app = self.doc[name]
+                except KeyError:
+                    continue
+                if relations_xml(app) == relations_xml(source_app):
+                    continue
+                for source_pair in source_app.pairs:
+                    pair = app.get_pair(source_pair.active.n, source_pair.passive.n)
+                    if pair is not None and pair_state(pair) != pair_state(source_pair):
+                        sync_pair(self.doc, pair, source_pair)
+                        if name not in changed:
+                            changed.append(name)
+
+            if not changed:
+                return []
+            for edit in self.log.entries():
+                try:
+                    edit.apply(self.doc)
+                except (KeyError, ValueError) as err:
+                    print(f"Cannot apply edit {edit} again: {err}")
+            for name in changed:
+                self.versions[name] = self.version(name) + 1
+            print(f"Merged the changes made to {len(changed)} variation units in {self.output} by another program")
+            for listener in self.reset_listeners:
+                listener(changed)
+            return changed
+
+    def watch(self, interval:float=DEFAULT_WATCH_INTERVAL) -> None:
+        """ Checks for changes to the output made by another program every `interval` seconds on a background thread until it is closed. """
+        def run():
+            while not self.stopped.wait(interval):
+                self.merge_external()
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def version(self, app_id:str) -> int:
+        """ The number of edits which have been made to a variation unit since the document was loaded. """
+        return self.versions.get(app_id, 0)
+
+    def apply(self, edit:Edit, expected_version:int|None=None) -> Pair:
+        """
+        Applies an edit to the document, records it in the log and schedules the output to be written.
+
+        If `expected_version` is given and the variation unit has a different version then it raises VersionConflict without making the edit.
+        """
+        with self.lock:
+            version = self.version(edit.app_id)
+            if expected_version is not None and expected_version != version:
+                raise VersionConflict(edit.app_id, expected_version, version)
+            pair = edit.apply(self.doc)
+            self.versions[edit.app_id] = version + 1
+            for listener in self.listeners:
+                listener(edit, pair)
+            self.log.record(edit)
+            if self.dirty_since is None:
+                self.dirty_since = time.monotonic()
+            if self.delay:
+                self.schedule()
+            else:
+                self.flush()
+        return pair
+
+    def schedule(self) -> None:
+        with self.lock:
+            delay = min(self.delay, max(0.0, self.dirty_since + self.max_delay - time.monotonic()))
+            if self.timer is not None:
+                self.timer.cancel()
+            self.timer = threading.Timer(delay, self.flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+    @property
+    def pending(self) -> bool:
+        """ Whether there are edits which have not been written to the output. """
+        return self.dirty_since is not None
+
+    def flush(self) -> None:
+        """ Writes the document to the output if there are edits which have not been written. """
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            if self.dirty_since is None:
+                return
+            # Keep any changes another program has made to the output since it was last written
+            self.merge_external()
+            self.write()
+            self.log.clear()
+            self.dirty_since = None
+
+    def close(self) -> None:
+        """ Writes any pending edits. This is also called when the program exits. """
+        if self.closed:
+            return
+        self.closed = True
+        self.stopped.set()
+        self.flush()
+        atexit.unregister(self.close)
@@ -1,6 +1,7 @@
+from dataclasses import dataclass
 from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
 from langchain_core.prompts.chat import ChatPromptTemplate
-from .apparatus import Pair, Doc
+from .apparatus import App, Pair, Doc
 
 
 def select_spaced_elements(lst:list, k:int) -> list:
@@ -18,78 +19,13 @@ def select_spaced_elements(lst:list, k:int) -> list:
     return [lst[i] for i in indices]
 
 
-# def build_template(app:App, examples:int=10) -> ChatPromptTemplate:
-#     doc = app.doc
-    
-#     readings = app.readings
-
-#     system_message = f"You are an academic who is an expert in textual criticism in {language}."
-
-#     human_message = (
-#         f"I am analyzing textual variants in a {language} document.\n"
-#         "I want to classify the types of changes made to readings as the text was copied.\n"
-#         "If reading 1 were to change to reading 2, what type of change would that be?\n"
-#     )
-    
-#     # Add the categories to the message
-#     relation_categories = doc.relation_types.values()
-#     human_message += f"\nHere are {len(relation_categories)} possible categories for the types of changes in the text:\n"     
-#     for category in relation_categories:
-#         human_message += f"{category.str_with_description()}\n"
-#         instance_strings = sorted(set(instance.reading_transition_str() for instance in category.pairs if not instance.rdgai_responsible()), key=len)
-#         for instance_string in select_spaced_elements(instance_strings, examples):
-#             human_message += f"\te.g. {instance_string}\n"
-
-#     # Add the context to the message
-#     human_message += f"\nI am variation unit is marked as {app.text_with_signs()} in this text:\n"
-#     human_message += f"{app.text_in_context()}\n"
-
-#     # Add the readings to the message        
-#     human_message += f"\nHere are the {len(readings)} readings at that variation unit. Remember them so you can analyze them later:\n"
-#     for reading in readings:
-#         reading_text = reading.text or "OMITTED"
-#         human_message += f"{reading.n}: {reading_text}\n"
-
-#     # Describe output format
-#     human_message += (
-#         f"\nYou need to output the classifications of the readings in the following format.\n"
-#         # "If going reading 1 to reading 2 was the same category of change, you would output the following:\n"
-#         # "reading_2_id <-> reading_1_id = category : justification\n"
-
-#         "If reading 1 were to change to reading 2, you would output the following:\n"
-#         "reading_1_id → reading_2_id = category : justification\n"
-#         "You also should output classificaitons from reading 2 to reading 1. It could be the same category or a different one:\n"
-#         "reading_2_id → reading_1_id = category : justification\n"
-        
-#         "For the justification, give a one sentence explanation of why the change is classified as that category.\n"
-#         "Separate the result for each pair of readings with a newline and do not add extra new line characters.\n"
-#     )
-
-#     # Add the classified relation examples to the message
-#     human_message += f"\nGiven the readings above, you can output the following pairs of relations:\n"
-#     for i, reading1 in enumerate(readings):
-#         for j in range(i + 1, len(readings)):
-#             reading2 = readings[j]
-#             human_message += f"{reading1.n} → {reading2.n}\n"
-
-#     human_message += "\nIf the change between one of those pairs of readings does not fit one of the categories, then do not output anything for that pair.\n"
-#     human_message += f"\nWhen you are finished, output 5 hyphens: '-----'.\n"
-
-#     ai_message = "Certainly, classifications for combinations of the readings are:"
-
-#     template = ChatPromptTemplate.from_messages(messages=[
-#         SystemMessage(system_message),
-#         HumanMessage(human_message),
-#         AIMessage(ai_message),        
-#     ])
-#     return template
-
-
 def build_system_message(doc:Doc) -> str:
     return f"You are an academic who is an expert in textual criticism in {doc.language}."
 
 
-def build_preamble(doc:Doc, examples:int=10) -> str:
+def build_categories_message(doc:Doc, examples:int=10) -> str:
+    """ Describes the categories with representative examples. This is the start of the preamble for all types of prompts. """
+    doc.load_classified_apps()
     relation_categories = doc.relation_types.values()
     human_message = (
         f"I am analyzing textual variants in a document written in {doc.language}.\n"
@@ -112,7 +48,15 @@ def build_preamble(doc:Doc, examples:int=10) -> str:
                 human_message += f" [{pair.get_description()}]"
             human_message += "\n"
 
-    human_message += "\n"
+    return human_message
+
+
+def build_preamble(doc:Doc, examples:int=10) -> str:
+    return build_categories_message(doc, examples) + build_pair_instructions()
+
+
+def build_pair_instructions() -> str:
+    human_message = "\n"
     human_message += "I will give you a two variant readings. On the first line of your response, provide the correct category name for changing from the first reading to the second reading.\n"
     human_message += "Do not provide any other text than the name of the category on the first line.\n"
     human_message += "Then on a second line, give a justification of your decision according the definitions of the categories provided and similar examples.\n"
@@ -121,33 +65,145 @@ def build_preamble(doc:Doc, examples:int=10) -> str:
     return human_message
 
 
-def build_template(pair:Pair, examples:int=10, examples_doc:Doc|None=None) -> ChatPromptTemplate:
-    app = pair.app
-    examples_doc = examples_doc or app.doc
+def build_batch_instructions() -> str:
+    human_message = "\n"
+    human_message += "I will give you a variation unit with a number of variant readings and a list of pairs of those readings.\n"
+    human_message += "For each pair, provide the correct category name for changing from the first reading to the second reading and a one sentence justification of your decision according the definitions of the categories provided and similar examples.\n"
+    human_message += "Output each pair on its own line in this format:\n"
+    human_message += "reading_1_id → reading_2_id = category : justification\n"
+    human_message += "Do not add extra new line characters.\n"
+    human_message += f"When you are finished, output 5 hyphens: '-----'.\n"
+    return human_message
+
 
-    system_message = build_system_message(examples_doc)
-    human_message = build_preamble(examples_doc, examples)    
+def build_batch_preamble(doc:Doc, examples:int=10) -> str:
+    return build_categories_message(doc, examples) + build_batch_instructions()
 
-    human_message += f"\nThe variation unit you need to classify is marked as {app.text_with_signs(pair.active.text)} in this text:\n"
-    human_message += f"{app.text_in_context(pair.active.text)}\n"
 
-    active_reading_text = app.text_with_signs(str(pair.active))
-    passive_reading_text = app.text_with_signs(str(pair.passive))
-    human_message += f"\nWhat category would best describe a change from {active_reading_text} to {passive_reading_text}?\n"
+def relation_types_signature(doc:Doc) -> tuple:
+    """ A value which changes whenever the relation types of a document or their example pairs change. """
+    return tuple(
+        (name, relation_type.description, str(relation_type.inverse), relation_type.revision)
+        for name, relation_type in doc.relation_types.items()
+    )
 
-    relation_categories = examples_doc.relation_types.values()
-    relation_categories_list = ", ".join(str(category) for category in relation_categories)
-    human_message += f"Respond with one of these categories: {relation_categories_list}\n"
-    human_message += f"On the second line, provide a justification for your decision."
 
-    ai_message = f"Certainly, the category for changing from {active_reading_text} to {passive_reading_text} is:"
+@dataclass
+class CompiledPrompt():
+    """
+    The parts of the classification prompt which are the same for every pair, rendered once for a document and number of examples.
+    """
+    doc: Doc
+    examples: int
+    signature: tuple
+    system_message: str
+    preamble: str
+    batch_preamble: str
+    categories_list: str
+
+    @classmethod
+    def compile(cls, doc:Doc, examples:int=10) -> "CompiledPrompt":
+        categories_message = build_categories_message(doc, examples)
+        return cls(
+            doc=doc,
+            examples=examples,
+            signature=relation_types_signature(doc),
+            system_message=build_system_message(doc),
+            preamble=categories_message + build_pair_instructions(),
+            batch_preamble=categories_message + build_batch_instructions(),
+            categories_list=", ".join(str(category) for category in doc.relation_types.values()),
+        )
+
+    def build_messages(self, preamble:str, human_message:str, ai_message:str, cache_control:dict|None=None) -> ChatPromptTemplate:
+        if cache_control:
+            human_content = [
+                {"type": "text", "text": preamble, "cache_control": cache_control},
+                {"type": "text", "text": human_message},
+            ]
+        else:
+            human_content = preamble + human_message
+
+        template = ChatPromptTemplate.from_messages(messages=[
+            SystemMessage(self.system_message),
+            HumanMessage(human_content),
+            AIMessage(ai_message),        
+        ])
+        return template
+
+    def is_current(self) -> bool:
+        return self.signature == relation_types_signature(self.doc)
+
+    def build_template(self, pair:Pair, cache_control:dict|None=None) -> ChatPromptTemplate:
+        """
+        Builds the prompt for the pair of readings.
+
+        The preamble is always at the start of the human message so that it is a stable prefix which providers can cache.
+        If `cache_control` is given then the preamble is sent as a separate content block marked with it
+        (e.g. {"type": "ephemeral"} for Anthropic models).
+        """
+        app = pair.app
+
+        human_message = f"\nThe variation unit you need to classify is marked as {app.text_with_signs(pair.active.text)} in this text:\n"
+        human_message += f"{app.text_in_context(pair.active.text)}\n"
+
+        active_reading_text = app.text_with_signs(str(pair.active))
+        passive_reading_text = app.text_with_signs(str(pair.passive))
+        human_message += f"\nWhat category would best describe a change from {active_reading_text} to {passive_reading_text}?\n"
+
+        human_message += f"Respond with one of these categories: {self.categories_list}\n"
+        human_message += f"On the second line, provide a justification for your decision."
+
+        ai_message = f"Certainly, the category for changing from {active_reading_text} to {passive_reading_text} is:"
+
+        return self.build_messages(self.preamble, human_message, ai_message, cache_control=cache_control)
+
+    def build_app_template(self, app:App, pairs:list[Pair], cache_control:dict|None=None) -> ChatPromptTemplate:
+        """ Builds a prompt to classify a number of pairs of readings in a variation unit with a single request. """
+        readings = app.readings
+
+        human_message = f"\nThe variation unit you need to classify is marked as {app.text_with_signs()} in this text:\n"
+        human_message += f"{app.text_in_context()}\n"
+
+        human_message += f"\nHere are the {len(readings)} readings at that variation unit:\n"
+        for reading in readings:
+            human_message += f"{reading.n}: {reading}\n"
+
+        human_message += f"\nClassify the change for each of these {len(pairs)} pairs of readings:\n"
+        for pair in pairs:
+            human_message += f"{pair.active.n} → {pair.passive.n}\n"
+
+        human_message += f"\nUse one of these categories: {self.categories_list}\n"
+        human_message += "Output one line for each pair in the format: reading_1_id → reading_2_id = category : justification"
+
+        ai_message = "Certainly, the classifications for the pairs of readings are:"
+
+        return self.build_messages(self.batch_preamble, human_message, ai_message, cache_control=cache_control)
+
+
+def compile_prompt(doc:Doc, examples:int=10) -> CompiledPrompt:
+    """
+    Returns the compiled prompt for the document and number of examples.
+
+    It is cached on the document and recompiled when the relation types or their example pairs change.
+    The classified apps of a lazily loaded document are loaded when the prompt is first compiled.
+    """
+    compiled = doc.compiled_prompts.get(examples, None)
+    if compiled is None or not compiled.is_current():
+        compiled = CompiledPrompt.compile(doc, examples)
+        doc.compiled_prompts[examples] = compiled
+    return compiled
+
+
+def build_template(pair:Pair, examples:int=10, examples_doc:Doc|None=None, cache_control:dict|None=None) -> ChatPromptTemplate:
+    examples_doc = examples_doc or pair.app.doc
+    return compile_prompt(examples_doc, examples).build_template(pair, cache_control=cache_control)
+
 
-    template = ChatPromptTemplate.from_messages(messages=[
-        SystemMessage(system_message),
-        HumanMessage(human_message),
-        AIMessage(ai_message),        
-    ])
-    return template
+def build_app_template(app:App, pairs:list[Pair]|None=None, examples:int=10, examples_doc:Doc|None=None, cache_control:dict|None=None) -> ChatPromptTemplate:
+    """ Builds a prompt to classify the pairs of readings in a variation unit (by default the non-redundant pairs). """
+    examples_doc = examples_doc or app.doc
+    pairs = pairs if pairs is not None else app.non_redundant_pairs
+    return compile_prompt(examples_doc, examples).build_app_template(app, pairs, cache_control=cache_control)
 
 
 def build_review_prompt(
@@ -0,0 +1,452 @@
+import os
+import copy
+import tempfile
+from pathlib import Path
+from typing import Iterator, TextIO
+from collections import deque
+from dataclasses import dataclass, field
+from lxml import etree as ET
+from lxml.etree import _Element as Element
+
+from .apparatus import Doc, App, RelationType, read_relation_types
+from .languages import convert_language_code
+from .tei import find_parent, make_nc_name, is_namespaced, tei_tag, extract_text, APPS, RELATIONS, TRANSCRIPTIONAL_LIST_RELATIONS, SKIPPED_TAGS
+
+XML_NAMESPACE = "http://www.w3.org/XML/1998/namespace"
+CONTEXT_WORDS = 100
+
+
+def local_name(tag) -> str:
+    """ Returns the tag without the namespace. Comments and processing instructions give an empty string. """
+    if not isinstance(tag, str):
+        return ""
+    return tag.rsplit("}", 1)[-1]
+
+
+def escape_text(text:str) -> str:
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def escape_attribute(value:str) -> str:
+    return escape_text(value).replace('"', "&quot;").replace("\n", "&#10;").replace("\r", "&#13;").replace("\t", "&#9;")
+
+
+def qualified_name(tag:str, nsmap:dict, attribute:bool=False) -> str:
+    """ Converts a tag or attribute name in Clark notation ({uri}local) to a prefixed name using the namespaces in scope. """
+    if not tag.startswith("{"):
+        return tag
+    uri, local = tag[1:].split("}", 1)
+    if uri == XML_NAMESPACE:
+        return f"xml:{local}"
+    for prefix, namespace in nsmap.items():
+        # Attributes cannot be in the default namespace
+        if namespace == uri and (prefix or not attribute):
+            return f"{prefix}:{local}" if prefix else local
+    return local
+
+
+def start_tag(element:Element) -> str:
+    """ The start tag of an element without the closing '>' so that it can also be used for empty elements. """
+    parent = element.getparent()
+    inherited = parent.nsmap if parent is not None else {}
+    parts = [qualified_name(element.tag, element.nsmap)]
+    for prefix, uri in element.nsmap.items():
+        if inherited.get(prefix, None) != uri:
+            parts.append(f'xmlns:{prefix}="{escape_attribute(uri)}"' if prefix else f'xmlns="{escape_attribute(uri)}"')
+    for key, value in element.attrib.items():
+        parts.append(f'{qualified_name(key, element.nsmap, attribute=True)}="{escape_attribute(value)}"')
+    return "<" + " ".join(parts)
+
+
+def end_tag(element:Element) -> str:
+    return f"</{qualified_name(element.tag, element.nsmap)}>"
+
+
+def serialize_chunk(element:Element) -> str:
+    """
+    Serializes an element with all its children but without its tail.
+
+    lxml declares the namespaces in scope on the element. Declarations already made by its ancestors are removed.
+    """
+    text = ET.tostring(element, encoding="unicode", with_tail=False)
+    parent = element.getparent()
+    if parent is None or not isinstance(element.tag, str):
+        return text
+
+    end = text.index(">")
+    first_tag = text[:end]
+    for prefix, uri in parent.nsmap.items():
+        if element.nsmap.get(prefix, None) == uri:
+            declaration = f' xmlns:{prefix}="{uri}"' if prefix else f' xmlns="{uri}"'
+            first_tag = first_tag.replace(declaration, "", 1)
+    return first_tag + text[end:]
+
+
+class StreamWriter():
+    """
+    Writes a document incrementally from the events of `lxml.etree.iterparse`.
+
+    Elements are written tag by tag as they are parsed. The text of an element is written when its first child starts
+    (or when it ends) and the tail of a child is written when the next child starts (or when the parent ends),
+    since by then the parser has read them completely.
+    Whole subtrees (e.g. variation units) can be written with `write_node` once they have been processed.
+    """
+    def __init__(self, file:TextIO):
+        self.file = file
+        self.stack = [] # [element, start tag written, last child] for each element which has started but not ended
+        self.top_level = False
+
+    def before_child(self) -> None:
+        if not self.stack:
+            if self.top_level:
+                self.file.write("\n")
+            self.top_level = True
+            return
+
+        entry = self.stack[-1]
+        element, opened, last_child = entry
+        if not opened:
+            self.file.write(start_tag(element) + ">" + escape_text(element.text or ""))
+            entry[1] = True
+        elif last_child is not None:
+            self.file.write(escape_text(last_child.tail or ""))
+
+    def start(self, element:Element) -> None:
+        self.before_child()
+        self.stack.append([element, False, None])
+
+    def end(self, element:Element) -> None:
+        _, opened, last_child = self.stack.pop()
+        if opened:
+            tail = last_child.tail if last_child is not None else ""
+            self.file.write(escape_text(tail or "") + end_tag(element))
+        elif element.text:
+            self.file.write(start_tag(element) + ">" + escape_text(element.text) + end_tag(element))
+        else:
+            self.file.write(start_tag(element) + "/>")
+
+        if self.stack:
+            self.stack[-1][2] = element
+
+    def write_node(self, node:Element) -> None:
+        """ Writes a whole element (or comment or processing instruction) without its tail. """
+        self.before_child()
+        self.file.write(serialize_chunk(node))
+        if self.stack:
+            self.stack[-1][2] = node
+
+
+class OpenElement():
+    """ The last words of the text of an element which has started but not ended. """
+    def __init__(self, width:int):
+        self.content = deque(maxlen=width)
+        self.siblings = deque(maxlen=width) # The content of its children since the last milestone
+        self.text_added = False
+        self.pending_tail:Element|None = None # The last child, whose tail has not been added yet
+
+
+class PrecedingText():
+    """
+    Keeps the last words of the text which has been streamed so that apps outside of an `ab` have the text before them
+    as `App.text_before` gives for a whole document: the text of their preceding siblings up to a milestone (at most `width` words).
+
+    Elements are released once they have been processed so their text is accumulated as they are parsed.
+    The text of an element is added when its first child starts (or when it ends) and the tail of a child is added
+    when the next child starts (or when the parent ends), since by then the parser has read them completely.
+    """
+    def __init__(self, width:int=CONTEXT_WORDS):
+        self.width = width
+        self.open:dict[Element,OpenElement] = {}
+
+    def settle(self, element:Element, state:OpenElement) -> None:
+        """ Adds the text of an element and the tail of its last child which have been read completely. """
+        if not state.text_added:
+            state.content.extend((element.text or "").split())
+            state.text_added = True
+        child = state.pending_tail
+        if child is not None:
+            tag = local_name(child.tag)
+            if tag not in SKIPPED_TAGS:
+                words = (child.tail or "").split()
+                state.content.extend(words)
+                if tag != "milestone":
+                    state.siblings.extend(words)
+            state.pending_tail = None
+
+    def start(self, element:Element, track:bool=True) -> None:
+        """ Records that an element has started. If `track` is False then its text is extracted when it ends instead. """
+        parent = element.getparent()
+        if parent in self.open:
+            self.settle(parent, self.open[parent])
+        if track:
+            self.open[element] = OpenElement(self.width)
+
+    def end(self, element:Element) -> None:
+        """ Adds the text of an element which has ended (without its tail) to its parent. This must be called before it is released. """
+        tag = local_name(element.tag)
+        state = self.open.pop(element, None)
+        if state is None:
+            words = extract_text(element, include_tail=False).split()
+        else:
+            self.settle(element, state)
+            words = list(state.content)
+            if tag == "w":
+                words = ["".join(words)] if words else []
+        if tag in SKIPPED_TAGS:
+            words = []
+
+        parent_state = self.open.get(element.getparent(), None)
+        if parent_state is None:
+            return
+        parent_state.content.extend(words)
+        if tag == "milestone":
+            parent_state.siblings.clear()
+        else:
+            parent_state.siblings.extend(words)
+        parent_state.pending_tail = element
+
+    def before(self, element:Element) -> str:
+        """ The text of the preceding siblings of an element which has started, up to a milestone. """
+        state = self.open.get(element.getparent(), None)
+        return " ".join(state.siblings) if state else ""
+
+
+def release(element:Element) -> None:
+    """ Frees the memory used by an element which has been processed along with its preceding siblings. """
+    element.clear(keep_tail=True)
+    parent = element.getparent()
+    if parent is not None:
+        while element.getprevious() is not None:
+            del parent[0]
+
+
+@dataclass
+class StreamingDoc(Doc):
+    """
+    A TEI document which is parsed incrementally with `lxml.etree.iterparse` so that it does not need to fit in memory.
+
+    The relation types are read when it is created. The apps are not kept: they are given one at a time by `iter_apps`
+    which can also write the document back out with any changes.
+    Pairs which are already classified are kept (without their context) so that they can be used as examples in prompts.
+    """
+    language_code: str = field(default="", init=False)
+    example_apps: list[App] = field(default_factory=list, init=False, repr=False)
+    examples_loaded: bool = field(default=False, init=False, repr=False)
+    iterating: int = field(default=0, init=False, repr=False)
+
+    def __post_init__(self):
+        self.path = Path(self.path)
+        self.read_header()
+
+    def read_header(self) -> None:
+        """ Reads the language and the relation types without keeping the rest of the document. """
+        interp_group = None
+        for event, element in ET.iterparse(str(self.path), events=("start", "end")):
+            tag = local_name(element.tag)
+            if event == "start":
+                if element.getparent() is None:
+                    self.namespaced = is_namespaced(element)
+                if tag == "text" and not self.language_code:
+                    self.language_code = element.attrib.get(f"{{{XML_NAMESPACE}}}lang", "")
+                continue
+
+            if tag == "interpGrp" and element.attrib.get("type", "") == "transcriptional" and find_parent(element, "text") is not None:
+                interp_group = copy.deepcopy(element)
+                break
+            if find_parent(element, "interpGrp") is None:
+                release(element)
+
+        self.relation_types = read_relation_types(interp_group) if interp_group is not None else {}
+        self.use_example_cache()
+
+    @property
+    def language(self):
+        return convert_language_code(self.language_code)
+
+    def add_relation_type(self, name:str, description:str="") -> RelationType:
+        """
+        Adds a relation type which is used in a relation but is not defined in the interpGrp.
+
+        Unlike `Doc.add_relation_type`, it is not added to the interpGrp in the output because that has already been written.
+        """
+        if name in self.relation_types:
+            return self.relation_types[name]
+
+        interp = ET.Element(tei_tag("interp", self.namespaced), attrib={f"{{{XML_NAMESPACE}}}id":name})
+        relation_type = RelationType(name=name, element=interp, description=description, example_cache=self.example_cache)
+        self.relation_types[name] = relation_type
+        return relation_type
+
+    def load_classified_apps(self) -> None:
+        """
+        Reads compact copies of the apps with classified pairs so that the relation types have their examples for the prompts.
+
+        Each copy only has the text of the readings in classified pairs and the relations, not the context or the rest of the app,
+        so the memory used is proportional to the number of classified pairs rather than to the size of the document.
+        """
+        if self.examples_loaded:
+            return
+        self.examples_loaded = True
+
+        for app in self.iter_apps():
+            if any(pair.types for pair in app.non_redundant_pairs):
+                self.example_apps.append(App(self.example_element(app), doc=self))
+
+    def example_element(self, app:App) -> Element:
+        """ A new app element with the name of an app, the text of the readings in its classified pairs and its relations. """
+        element = ET.Element(tei_tag("app", self.namespaced), attrib={f"{{{XML_NAMESPACE}}}id": str(app)})
+        classified = {n for pair in app.pairs if pair.types for n in pair.key()}
+        for reading in app.readings:
+            if reading.n in classified:
+                rdg = ET.SubElement(element, tei_tag("rdg", self.namespaced), attrib={"n": reading.n})
+                rdg.text = reading.text
+        list_relation = ET.SubElement(element, tei_tag("listRelation", self.namespaced), attrib={"type": "transcriptional"})
+        for relations in TRANSCRIPTIONAL_LIST_RELATIONS(app.element, self.namespaced):
+            for relation in RELATIONS(relations, self.namespaced):
+                list_relation.append(copy.deepcopy(relation))
+        return element
+
+    def write(self, output:str|Path):
+        """
+        Writes the document to `output` by streaming it through `iter_apps`.
+
+        The apps are not kept in memory so this writes them as they are in the file (with their names assigned).
+        To write changes to the apps, pass the output to the `iter_apps` call which yields them.
+        """
+        if self.iterating:
+            raise RuntimeError("A streamed document cannot be written while its apps are being iterated. Pass the output to `iter_apps` instead.")
+        for _ in self.iter_apps(output):
+            pass
+
+    def chunk_apps(self, chunk:Element, preceding:PrecedingText|None=None) -> Iterator[App]:
+        """
+        Yields the apps in a chunk (an `ab` or an app outside of an `ab`).
+
+        An app outside of an `ab` is given the text before it from `preceding`. The text after it has not been read yet so it has none.
+        """
+        outside_ab = local_name(chunk.tag) == "app"
+        app_elements = [chunk] if outside_ab else APPS(chunk, self.namespaced)
+        for element in app_elements:
+            app = App(element, doc=self)
+            if outside_ab and preceding is not None:
+                app.context_before = preceding.before(element)
+                app.context_after = ""
+            # Assign the name now so that it is written to the output
+            str(app)
+            # The relation types only keep the pairs of the example apps so that the examples in the prompts
+            # do not depend on which chunk is being read
+            self.release_app(app)
+            yield app
+
+    def iter_apps(self, output:str|Path|None=None) -> Iterator[App]:
+        """
+        Yields an App for each variation unit in document order.
+
+        The apps in an `ab` are yielded once the whole `ab` has been parsed so that the text around them is available.
+        Apps outside of an `ab` have the same text before them as in a whole document (the preceding siblings up to a milestone, at most 100 words)
+        but no text after them because it has not been read yet, so their prompts differ from those for a whole document.
+        After the apps have been processed, their elements are cleared from memory.
+
+        If `output` is given then the document, including the changes made to the apps, is written to it as it is parsed.
+        It is written to a temporary file which replaces the output at the end.
+        If the iteration stops early (e.g. because of an error), the rest of the document is still copied unchanged.
+        """
+        file = None
+        writer = None
+        if output:
+            output = Path(output)
+            output.parent.mkdir(parents=True, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=output.parent, prefix=f".{output.name}.", suffix=".tmp")
+            file = os.fdopen(fd, "w", encoding="utf-8")
+            file.write("<?xml version='1.0' encoding='UTF-8'?>\n")
+            writer = StreamWriter(file)
+
+        consuming = True
+        chunk = None
+        app_count = 0
+        preceding = PrecedingText()
+        self.iterating += 1
+        try:
+            for event, element in ET.iterparse(str(self.path), events=("start", "end", "comment", "pi")):
+                if event in ("comment", "pi"):
+                    if writer and chunk is None:
+                        writer.write_node(element)
+                    continue
+
+                tag = local_name(element.tag)
+                if event == "start":
+                    if tag == "app":
+                        app_count += 1
+                        self.name_app(element, app_count)
+                    if chunk is not None:
+                        continue
+                    preceding.start(element, track=tag not in ("ab", "app"))
+                    if tag in ("ab", "app"):
+                        chunk = element
+                    elif writer:
+                        if element.getparent() is None and element.getroottree().docinfo.doctype:
+                            writer.before_child()
+                            file.write(element.getroottree().docinfo.doctype)
+                        writer.start(element)
+                    continue
+
+                if chunk is not None and element is not chunk:
+                    continue
+
+                if element is chunk:
+                    chunk = None
+                    for app in self.chunk_apps(element, preceding):
+                        if consuming:
+                            try:
+                                yield app
+                            except GeneratorExit:
+                                consuming = False
+                        self.release_app(app)
+                    self.ab_context_windows.clear()
+                    self.text_cache.invalidate()
+                    if writer:
+                        writer.write_node(element)
+                    elif not consuming:
+                        return
+                elif writer:
+                    writer.end(element)
+
+                preceding.end(element)
+                release(element)
+
+            if file:
+                file.write("\n")
+                file.flush()
+                os.fsync(file.fileno())
+                file.close()
+                if output.exists():
+                    os.chmod(temp_path, output.stat().st_mode & 0o777)
+                else:
+                    umask = os.umask(0)
+                    os.umask(umask)
+                    os.chmod(temp_path, 0o666 & ~umask)
+                os.replace(temp_path, output)
+        except BaseException:
+            if file:
+                file.close()
+                Path(temp_path).unlink(missing_ok=True)
+            raise
+        finally:
+            self.iterating -= 1
+
+    def name_app(self, element:Element, index:int) -> None:
+        """
+        Names an app outside of an `ab` which has no xml:id or n from its position in the document, as `App.__str__` does.
+
+        This needs to be done as the app is parsed because the preceding apps are cleared.
+        """
+        if element.attrib.get(f"{{{XML_NAMESPACE}}}id", "") or element.attrib.get("n", ""):
+            return
+        if find_parent(element, "ab") is None:
+            element.attrib[f"{{{XML_NAMESPACE}}}id"] = make_nc_name(f"app-{index}")
+
+    def release_app(self, app:App) -> None:
+        """ Removes the pairs of an app which has been processed from the relation types so that they can be freed. """
+        for pair in app.pairs:
+            for relation_type in pair.types:
+                relation_type.pairs.discard(pair)
@@ -1,4 +1,8 @@
+import os
 import re
+import tempfile
+import bisect
+import functools
 from pathlib import Path
 from lxml import etree as ET
 from lxml.etree import _ElementTree as ElementTree
@@ -7,6 +11,66 @@ from lxml.etree import _Element as Element
 from .languages import convert_language_code
 
 
+TEI_NAMESPACE = "http://www.tei-c.org/ns/1.0"
+XML_NAMESPACE = "http://www.w3.org/XML/1998/namespace"
+
+
+def is_namespaced(doc:ElementTree|Element) -> bool:
+    """ Whether the element (or the root of the document) is in the TEI namespace. """
+    if isinstance(doc, ElementTree):
+        doc = doc.getroot()
+    return isinstance(doc.tag, str) and doc.tag.startswith(f"{{{TEI_NAMESPACE}}}")
+
+
+@functools.cache
+def namespaces_for(uri:str|None) -> dict[str|None,str]:
+    """ The namespaces used in queries for elements in the namespace `uri` (as the default namespace). """
+    if uri is None:
+        return {"xml": XML_NAMESPACE}
+    return {None: uri, "xml": XML_NAMESPACE}
+
+
+def tei_tag(name:str, namespaced:bool) -> str:
+    """ The tag for a new TEI element, in the TEI namespace if the document uses it. """
+    return f"{{{TEI_NAMESPACE}}}{name}" if namespaced else name
+
+
+def element_namespaces(element:Element) -> dict[str|None,str]:
+    tag = element.tag
+    if isinstance(tag, str) and tag.startswith("{"):
+        return namespaces_for(tag[1:].split("}", 1)[0])
+    return namespaces_for(None)
+
+
+class Query():
+    """
+    An XPath query for TEI elements which is compiled once for documents with and without the TEI namespace.
+
+    The path is written without prefixes (e.g. `.//listRelation[@type='transcriptional']`).
+    """
+    def __init__(self, path:str):
+        self.path = path
+        self.plain = ET.XPath(path)
+        # Add the prefix to each element name in the path (i.e. names which are not attributes or within predicates)
+        namespaced_path = re.sub(r"(^|/)([A-Za-z_][\w.-]*)", r"\1tei:\2", path)
+        self.namespaced = ET.XPath(namespaced_path, namespaces={"tei": TEI_NAMESPACE})
+
+    def __call__(self, element:ElementTree|Element|None, namespaced:bool|None=None) -> list[Element]:
+        """ Runs the query from the element. If `namespaced` is not given then it is found from the element. """
+        if element is None:
+            return []
+        if namespaced is None:
+            namespaced = is_namespaced(element)
+        return (self.namespaced if namespaced else self.plain)(element)
+
+
+APPS = Query(".//app")
+READINGS = Query(".//rdg")
+RELATIONS = Query(".//relation")
+DESCRIPTIONS = Query(".//desc")
+TRANSCRIPTIONAL_LIST_RELATIONS = Query(".//listRelation[@type='transcriptional']")
+
+
 def get_language_code(doc:ElementTree|Element) -> str:
     """ Reads the element <text> and returns the value of the xml:lang attribute."""
     text = find_element(doc, ".//text")
@@ -30,42 +94,139 @@ def make_nc_name(string):
     return result
 
 
-def extract_text(node:Element, include_tail:bool=True, sep:str=" ") -> str:
-    if node is None:
-        return ""
-    
-    if isinstance(node.tag, str):
-        tag = re.sub(r"{.*}", "", node.tag)
-    else:
-        return ""
+XML_ID = "{http://www.w3.org/XML/1998/namespace}id"
+SKIPPED_TAGS = {"pc", "witDetail", "note"}
 
-    if tag in ["pc", "witDetail", "note"]:
-        return ""
-    if tag == "app":            
+
+class TextCache():
+    """
+    Stores the text extracted from elements of a document so that it is only extracted once.
+
+    It also holds an index of the elements by xml:id to resolve `ref` elements, which is built the first time it is needed.
+    The cache must be invalidated with `invalidate` when the document is changed.
+    """
+    def __init__(self):
+        self.texts:dict[Element,dict[tuple[str,bool],str]] = {}
+        self.id_index:dict[str,Element]|None = None
+        self.has_refs = False
+
+    def get(self, node:Element, sep:str, include_tail:bool) -> str|None:
+        return self.texts.get(node, {}).get((sep, include_tail), None)
+
+    def set(self, node:Element, sep:str, include_tail:bool, text:str) -> None:
+        self.texts.setdefault(node, {})[(sep, include_tail)] = text
+
+    def get_by_id(self, node:Element, identifier:str) -> Element|None:
+        if self.id_index is None:
+            root = node.getroottree().getroot()
+            self.id_index = {}
+            for element in root.iter():
+                element_id = element.get(XML_ID) if isinstance(element.tag, str) else None
+                if element_id:
+                    self.id_index.setdefault(element_id, element)
+        self.has_refs = True
+        return self.id_index.get(identifier, None)
+
+    def invalidate(self, element:Element|None=None) -> None:
+        """
+        Removes the text of an element which has changed and of its ancestors (whose text includes it).
+
+        If no element is given, or if the text of any element refers to another through a `ref`, then the whole cache is cleared.
+        """
+        self.id_index = None
+        if element is None or self.has_refs:
+            self.texts.clear()
+            self.has_refs = False
+            return
+        while element is not None:
+            self.texts.pop(element, None)
+            element = element.getparent()
+
+
+def _text_dependencies(node:Element, sep:str, cache:TextCache) -> tuple[list[tuple[Element,str,bool]],str|None]:
+    """
+    The elements whose text is needed to find the text of a node, as tuples of (element, separator, include tail).
+
+    If the text of the node is made from its own text and tail and the texts of the dependencies (its children)
+    then the separator between them is also returned. Otherwise it is None and the text is just the text of its single dependency
+    (e.g. the lemma of an app).
+    """
+    tag = node.tag.rsplit("}", 1)[-1]
+    if tag in SKIPPED_TAGS:
+        return [], None
+    if tag == "app":
         lemma = find_element(node, ".//lem")
         if lemma is None:
             lemma = find_element(node, ".//rdg")
-        return extract_text(lemma) or ""
+        return ([(lemma, " ", True)] if lemma is not None else []), None
     if tag == "ref":
-        root = node.getroottree().getroot()
-        target_id = node.attrib['target'].lstrip("#")
-        ns = {"tei": "http://www.tei-c.org/ns/1.0"}
-        target = root.xpath(f"//*[@xml:id='{target_id}']", namespaces=ns)
-
-        if target:
-            return extract_text(target[0])
+        target = cache.get_by_id(node, node.attrib.get("target", "").lstrip("#"))
+        if target is not None:
+            return [(target, " ", True)], None
 
     if tag == "w":
         sep = ""
+    return [(child, sep, True) for child in node], sep
 
-    text = node.text or ""
-    for child in node:
-        text += sep + extract_text(child, sep=sep)
 
-    if include_tail and node.tail:
-        text += sep + node.tail
+def extract_text(node:Element, include_tail:bool=True, sep:str=" ", cache:TextCache|None=None) -> str:
+    """
+    Extracts the text of an element and its descendants.
+
+    Variation units give the text of their lemma (or first reading) and `ref` elements give the text of their target.
+    Punctuation and notes are skipped. Words (`w`) are joined without spaces.
 
-    return text.strip()
+    The tree is traversed without recursion so deeply nested documents do not reach the recursion limit.
+    If a `cache` is given then the text of each element is stored in it and reused.
+    """
+    if node is None:
+        return ""
+    if not isinstance(node.tag, str):
+        return ""
+    
+    cache = cache if cache is not None else TextCache()
+    texts = cache.texts
+    result = texts.get(node, {}).get((sep, include_tail), None)
+    if result is not None:
+        return result
+
+    # Each frame is [element, separator, include tail, dependencies, separator for children]. 
+    # The dependencies are found when the frame is first visited and the text is found once they have all been visited.
+    stack = [[node, sep, include_tail, None, None]]
+    visiting = set()
+    while stack:
+        frame = stack[-1]
+        element, element_sep, element_tail, dependencies, child_sep = frame
+        if dependencies is None:
+            if not isinstance(element.tag, str):
+                texts.setdefault(element, {})[(element_sep, element_tail)] = ""
+                stack.pop()
+                continue
+            dependencies, child_sep = frame[3], frame[4] = _text_dependencies(element, element_sep, cache)
+            visiting.add((element, element_sep, element_tail))
+            pushed = False
+            for dependency in reversed(dependencies):
+                if dependency not in visiting and (dependency[1], dependency[2]) not in texts.get(dependency[0], ()):
+                    stack.append([*dependency, None, None])
+                    pushed = True
+            if pushed:
+                continue
+
+        # Circular references give no text
+        dependency_texts = [texts.get(child, {}).get((child_sep_, child_tail), "") for child, child_sep_, child_tail in dependencies]
+        if child_sep is not None:
+            text = (element.text or "") + "".join(child_sep + child_text for child_text in dependency_texts)
+            if element_tail and element.tail:
+                text += child_sep + element.tail
+            text = text.strip()
+        else:
+            text = dependency_texts[0] if dependency_texts else ""
+
+        texts.setdefault(element, {})[(element_sep, element_tail)] = text
+        visiting.discard((element, element_sep, element_tail))
+        stack.pop()
+
+    return texts[node][(sep, include_tail)]
 
 
 def read_tei(path:Path) -> ElementTree:
@@ -78,14 +239,15 @@ def find_element(doc:ElementTree|Element, xpath:str) -> Element|None:
     assert doc is not None, f"Document is None in find_element({doc}, {xpath})"
     if isinstance(doc, ElementTree):
         doc = doc.getroot()
-    namespaces = doc.nsmap | {"xml": "http://www.w3.org/XML/1998/namespace"}
-    element = doc.find(xpath, namespaces=namespaces)
-    if element is None:
-        try:
+    namespaces = element_namespaces(doc)
+    try:
+        element = doc.find(xpath, namespaces=namespaces)
+        # Elements without a namespace can also be in a namespaced document (e.g. if they were added by other tools)
+        if element is None and None in namespaces:
             element = doc.find(xpath)
-        except SyntaxError:
-            return None
-    return element
+        return element
+    except SyntaxError:
+        return None
 
 
 def find_elements(doc:ElementTree|Element|None, xpath:str) -> list[Element]:
@@ -93,9 +255,10 @@ def find_elements(doc:ElementTree|Element|None, xpath:str) -> list[Element]:
         return []
     if isinstance(doc, ElementTree):
         doc = doc.getroot()
-    namespaces = doc.nsmap | {"xml": "http://www.w3.org/XML/1998/namespace"}
+    namespaces = element_namespaces(doc)
     results = doc.findall(xpath, namespaces=namespaces)
-    results += doc.findall(xpath)
+    if not results and None in namespaces:
+        results = doc.findall(xpath)
     return results
 
 
@@ -132,9 +295,38 @@ def find_parent(element:Element, tag:str) -> Element|None:
     return None
 
 
-def write_tei(doc:ElementTree, path:Path|str) -> None:
-    Path(path).parent.mkdir(parents=True, exist_ok=True)
-    doc.write(str(path), encoding="utf-8", xml_declaration=True, pretty_print=True)
+def write_tei(doc:ElementTree, path:Path|str, atomic:bool=True) -> os.stat_result:
+    """
+    Writes the TEI document to a file and returns the status of the file which was written.
+
+    If `atomic` is True, then the document is first written to a temporary file in the same directory
+    which is then renamed to the path so that an interrupted write never leaves a truncated file.
+    The status is then taken from the temporary file before it is renamed, so that it is never the status of a file written by another program.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if not atomic:
+        doc.write(str(path), encoding="utf-8", xml_declaration=True, pretty_print=True)
+        return path.stat()
+
+    fd, temp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            doc.write(f, encoding="utf-8", xml_declaration=True, pretty_print=True)
+            f.flush()
+            os.fsync(f.fileno())
+            stat = os.fstat(f.fileno())
+        if path.exists():
+            os.chmod(temp_path, path.stat().st_mode & 0o777)
+        else:
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(temp_path, 0o666 & ~umask)
+        os.replace(temp_path, path)
+    except BaseException:
+        Path(temp_path).unlink(missing_ok=True)
+        raise
+    return stat
 
 
 def get_reading_identifier(reading:Element, check:bool=False, create_if_necessary:bool=True) -> str:
@@ -156,7 +348,7 @@ def get_reading_identifier(reading:Element, check:bool=False, create_if_necessar
     return identifier
 
 
-def extract_text_siblings(element:Element, until_tag:str, preceding:bool=False, truncate:int|None=None) -> str:
+def extract_text_siblings(element:Element, until_tag:str, preceding:bool=False, truncate:int|None=None, cache:TextCache|None=None) -> str:
     """
     Extracts text from sibling elements of the given element until a sibling with the specified tag is encountered.
     
@@ -165,6 +357,7 @@ def extract_text_siblings(element:Element, until_tag:str, preceding:bool=False,
         until_tag (str): The tag name of the sibling element that will stop the extraction process.
         preceding (bool): If True, extracts text from preceding siblings; if False, extracts from following siblings.
         truncate (int|None): If specified, limits the number of words extracted to this value.
+        cache (TextCache|None): If specified, the cache used to store the text of the siblings.
         
     Returns:
         str: A string containing the concatenated text from the sibling elements, up to the specified limit if provided.
@@ -175,7 +368,7 @@ def extract_text_siblings(element:Element, until_tag:str, preceding:bool=False,
         if isinstance(tag, str) and tag.rsplit("}", 1)[-1] == until_tag:
             break
 
-        text = extract_text(sibling)
+        text = extract_text(sibling, cache=cache)
         if text:
             my_words = text.split()
             if preceding:
@@ -191,3 +384,94 @@ def extract_text_siblings(element:Element, until_tag:str, preceding:bool=False,
         words.reverse()
 
     return " ".join(words)
+
+
+def last_words(text:str, count:int|None=None) -> str:
+    """ Returns the last `count` words of the text (or the whole text if `count` is None). """
+    if count is None:
+        return text
+    return " ".join(text.split()[-count:]) if count > 0 else ""
+
+
+def first_words(text:str, count:int|None=None) -> str:
+    """ Returns the first `count` words of the text (or the whole text if `count` is None). """
+    if count is None:
+        return text
+    return " ".join(text.split()[:count]) if count > 0 else ""
+
+
+class ContextWindows():
+    """
+    The text of the children of an element (e.g. an `ab`) extracted once so that the text before and after
+    each child can be found without extracting the text of the other children again.
+
+    The texts of the children are joined with spaces. The character offsets of each child
+    and of each word are stored so that a window of a given number of words is found in time proportional to its width.
+    """
+    def __init__(self, texts:list[str], positions:dict[Element,int]|None=None):
+        self.texts = texts
+        self.positions = positions or {}
+        self.spans = []
+        items = []
+        offset = 0
+        for text in texts:
+            if text:
+                if items:
+                    offset += 1
+                items.append(text)
+                self.spans.append((offset, offset + len(text)))
+                offset += len(text)
+            else:
+                self.spans.append((offset, offset))
+
+        self.text = " ".join(items)
+        self.word_starts = []
+        self.word_ends = []
+        for match in re.finditer(r"\S+", self.text):
+            self.word_starts.append(match.start())
+            self.word_ends.append(match.end())
+
+    @classmethod
+    def from_element(cls, element:Element, cache:TextCache|None=None) -> "ContextWindows":
+        texts = []
+        positions = {}
+        for index, child in enumerate(element):
+            positions[child] = index
+            texts.append(extract_text(child, cache=cache))
+        return cls(texts, positions)
+
+    def position(self, child:Element) -> int|None:
+        return self.positions.get(child, None)
+
+    def before(self, position:int|None, width:int|None=None) -> str:
+        """
+        The text of the children before the one at `position`.
+
+        If `position` is None then the text of all the children is given.
+        If `width` is given then only that number of words before the child is given.
+        """
+        start = len(self.text) if position is None else self.spans[position][0]
+        if width is None:
+            return self.text[:start].strip()
+        count = bisect.bisect_right(self.word_ends, start)
+        if width <= 0 or count == 0:
+            return ""
+        return self.text[self.word_starts[max(0, count - width)]:start].strip()
+
+    def after(self, position:int|None, width:int|None=None) -> str:
+        """
+        The text of the children after the one at `position`.
+
+        If `position` is None then there is no text after it.
+        If `width` is given then only that number of words after the child is given.
+        """
+        if position is None:
+            return ""
+        end = self.spans[position][1]
+        if width is None:
+            return self.text[end:].strip()
+        first = bisect.bisect_left(self.word_starts, end)
+        last = min(len(self.word_starts), first + width)
+        if width <= 0 or last <= first:
+            return ""
+        return self.text[end:self.word_ends[last - 1]].strip()
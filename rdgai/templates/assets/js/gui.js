@@ -0,0 +1,229 @@
+// Client for the Rdgai GUI which loads the variation units from the server as they are navigated to.
+const state = {
+    appPage: 0,
+    appPages: 1,
+    loadingApps: false,
+    appCache: new Map(),
+    current: null,
+    relationType: null,
+    relationTypePage: 0,
+};
+
+const appPane = document.getElementById('app-pane');
+const relationTypePane = document.getElementById('relation-type-pane');
+
+async function fetchJSON(url) {
+    const response = await fetch(url);
+    if (!response.ok) {
+        throw new Error(`Failed to load ${url}: ${response.statusText}`);
+    }
+    return response.json();
+}
+
+function initTooltips(element) {
+    element.querySelectorAll('[data-bs-toggle="tooltip"]').forEach(function (tooltipTriggerEl) {
+        new bootstrap.Tooltip(tooltipTriggerEl);
+    });
+}
+
+function addLink(list, templateId, text, dataset) {
+    const item = document.getElementById(templateId).content.firstElementChild.cloneNode(true);
+    const link = item.querySelector('a');
+    link.querySelector('span').textContent = text;
+    Object.assign(link.dataset, dataset);
+    list.appendChild(item);
+    return link;
+}
+
+async function loadAppPage() {
+    if (state.loadingApps || state.appPage >= state.appPages) {
+        return;
+    }
+    state.loadingApps = true;
+    try {
+        const data = await fetchJSON(`/api/apps?page=${state.appPage + 1}`);
+        const list = document.getElementById('app-list');
+        data.items.forEach(item => {
+            const link = addLink(list, 'app-link-template', item.name, { appName: item.name });
+            if (item.name === state.current?.name) {
+                link.classList.add('active');
+            }
+        });
+        state.appPage = data.page;
+        state.appPages = data.pages;
+    } finally {
+        state.loadingApps = false;
+    }
+}
+
+async function loadRelationTypes() {
+    const data = await fetchJSON('/api/relation-types');
+    const list = document.getElementById('relation-type-list');
+    data.items.forEach(item => {
+        addLink(list, 'relation-type-link-template', `${item.name} (${item.count})`, { relationType: item.name });
+    });
+}
+
+async function getApp(name) {
+    if (!state.appCache.has(name)) {
+        state.appCache.set(name, await fetchJSON(`/api/apps/${encodeURIComponent(name)}`));
+    }
+    return state.appCache.get(name);
+}
+
+async function showApp(name) {
+    if (!name) {
+        return;
+    }
+    const data = await getApp(name);
+    state.current = data;
+    appPane.innerHTML = data.html;
+    appPane.dataset.app = data.key;
+    appPane.dataset.appName = data.name;
+    appPane.dataset.version = data.version;
+    appPane.hidden = false;
+    relationTypePane.hidden = true;
+    initTooltips(appPane);
+
+    document.querySelectorAll('#app-list .nav-link').forEach(link => {
+        link.classList.toggle('active', link.dataset.appName === name);
+    });
+    history.replaceState(null, '', `#${encodeURIComponent(name)}`);
+
+    // Load the next variation unit in the background so that it shows immediately
+    if (data.next) {
+        getApp(data.next).catch(error => console.error(error));
+    }
+}
+
+async function showRelationType(name, page = 1) {
+    const data = await fetchJSON(`/api/relation-types/${encodeURIComponent(name)}/pairs?page=${page}`);
+    const list = relationTypePane.querySelector('ul');
+    if (page === 1) {
+        relationTypePane.querySelector('h1').textContent = name;
+        list.innerHTML = '';
+    }
+    data.items.forEach(item => {
+        addLink(list, 'app-link-template', `${item.app}: ${item.active} ➜ ${item.passive}`, { appName: item.app });
+    });
+    state.relationType = name;
+    state.relationTypePage = data.page;
+    relationTypePane.querySelector('button').hidden = data.page >= data.pages;
+    relationTypePane.hidden = false;
+    appPane.hidden = true;
+}
+
+async function relationBtnClick(button) {
+    try {
+        const response = await fetch("/api/relation-type", {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({
+                "pair": button.dataset.pair,
+                "relation_type": button.dataset.relationtype,
+                "operation": button.classList.contains("btn-primary") ? "remove" : "add",
+                "version": Number(appPane.dataset.version)
+            })
+        });
+        // The cached variation unit no longer matches the server
+        state.appCache.delete(appPane.dataset.appName);
+        if (response.ok) {
+            button.classList.toggle('btn-primary');
+            button.classList.toggle('btn-secondary');
+            appPane.dataset.version = response.headers.get('X-App-Version');
+        } else if (response.status === 409) {
+            // Someone else has changed this variation unit so show their changes before trying again
+            const data = await response.json();
+            alert(data.error);
+            await showApp(appPane.dataset.appName);
+        } else {
+            alert("Failed to update TEI. Check connection to rdgai server");
+            console.error('Failed to post data:', response.statusText);
+        }
+    } catch (error) {
+        console.error('Error:', error);
+    }
+}
+
+function applyChange(data) {
+    // The cached copy of the variation unit no longer matches the server
+    state.appCache.delete(data.app);
+    if (appPane.dataset.appName !== data.app) {
+        return;
+    }
+    data.pairs.forEach(pair => {
+        const buttons = appPane.querySelectorAll(`.relation-btn[data-pair="${CSS.escape(pair.key)}"]`);
+        buttons.forEach(button => {
+            const selected = pair.types.includes(button.dataset.relationtype);
+            button.classList.toggle('btn-primary', selected);
+            button.classList.toggle('btn-secondary', !selected);
+        });
+        if (buttons.length) {
+            buttons[0].closest('.row').querySelector('.desc').textContent = pair.description;
+        }
+    });
+    appPane.dataset.version = data.version;
+}
+
+function subscribe() {
+    // The browser reconnects automatically and sends the ID of the last event so that missed changes are replayed
+    const events = new EventSource('/api/events');
+    events.onmessage = function (event) {
+        applyChange(JSON.parse(event.data));
+    };
+    events.addEventListener('reset', function () {
+        // Some changes were missed or the file was changed by another program so reload everything shown
+        state.appCache.clear();
+        showApp(appPane.dataset.appName).catch(error => console.error(error));
+    });
+    events.onerror = function () {
+        // The browser does not reconnect if the server refuses the stream because too many pages are open, so try again later
+        if (events.readyState === EventSource.CLOSED) {
+            setTimeout(subscribe, 30000);
+        }
+    };
+}
+
+document.addEventListener('click', function (event) {
+    const button = event.target.closest('.relation-btn');
+    if (button) {
+        relationBtnClick(button);
+        return;
+    }
+    const link = event.target.closest('a.nav-link');
+    if (link && link.dataset.appName) {
+        event.preventDefault();
+        showApp(link.dataset.appName).catch(error => console.error(error));
+    } else if (link && link.dataset.relationType) {
+        event.preventDefault();
+        showRelationType(link.dataset.relationType).catch(error => console.error(error));
+    }
+});
+
+relationTypePane.querySelector('button').addEventListener('click', function () {
+    showRelationType(state.relationType, state.relationTypePage + 1).catch(error => console.error(error));
+});
+
+document.getElementById('app-list-container').addEventListener('scroll', function () {
+    if (this.scrollTop + this.clientHeight >= this.scrollHeight - 100) {
+        loadAppPage().catch(error => console.error(error));
+    }
+});
+
+document.addEventListener('keydown', function (e) {
+    if (!state.current) {
+        return;
+    }
+    if (e.key === 'ArrowRight') {
+        showApp(state.current.next).catch(error => console.error(error));
+    } else if (e.key === 'ArrowLeft') {
+        showApp(state.current.previous).catch(error => console.error(error));
+    }
+});
+
+document.addEventListener('DOMContentLoaded', function () {
+    initTooltips(appPane);
+    const name = location.hash ? decodeURIComponent(location.hash.slice(1)) : appPane.dataset.appName;
+    Promise.all([loadAppPage(), loadRelationTypes(), showApp(name)]).catch(error => console.error(error));
+    subscribe();
+});
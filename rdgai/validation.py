@@ -4,7 +4,8 @@ from rich.console import Console
 import llmloader
 
 from .apparatus import Doc, Pair
-from .classification import classify, DEFAULT_MODEL_ID
+from .classification import classify, get_model_id, DEFAULT_MODEL_ID
+from .cache import DEFAULT_CACHE_SIZE
 from .evaluation import evaluate_docs
 
 
@@ -23,14 +24,26 @@ def validate(
     confusion_matrix:Path|None=None,
     confusion_matrix_plot:Path|None=None,
     report:Path|None=None,
+    workers:int=1,
+    requests_per_minute:int=0,
+    tokens_per_minute:int=0,
+    prompt_caching:bool=False,
+    cache_dir:Path|None=None,
+    cache_size:int=DEFAULT_CACHE_SIZE,
+    batch:bool=False,
+    example_cache_dir:Path|None=None,
 ):
     """
     Partitions the classified pairs in the document and uses a proportion for examples and the remainder for classification.
     Then it evaluates the classifications and writes a report.
+
+    The representative examples are stored in `example_cache_dir` if it is given so that they are not selected again
+    when the same ground truth is validated with the same seed.
     """
     ground_truth.write(output)
-    doc = Doc(output)
+    doc = Doc(output, example_cache_dir=example_cache_dir)
 
+    model_id = get_model_id(llm)
     llm = llmloader.load(model=llm, api_key=api_key, temperature=temperature)
 
     # Find pairs to classify
@@ -51,8 +64,17 @@ def validate(
         pairs=validation_pairs,
         verbose=verbose,
         llm=llm,
+        temperature=temperature,
         examples=examples,
         console=console,
+        workers=workers,
+        requests_per_minute=requests_per_minute,
+        tokens_per_minute=tokens_per_minute,
+        prompt_caching=prompt_caching,
+        cache_dir=cache_dir,
+        cache_size=cache_size,
+        model_id=model_id,
+        batch=batch,
     )
 
     # Evaluate classifications
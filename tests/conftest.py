@@ -16,6 +16,14 @@ def make_fixture(path):
     return fixture_function
 
 
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    """ Keeps the caches used in the tests out of the user's cache directory. """
+    path = tmp_path / "rdgai-cache"
+    monkeypatch.setenv("RDGAI_CACHE_DIR", str(path))
+    return path
+
+
 for path in TEST_DATA_DIR.glob("*.xml"):
     make_fixture(path)
     
@@ -2,6 +2,10 @@ import re
 import pytest
 from rdgai.apparatus import Doc, Pair, RelationType
 from lxml.etree import _Element as Element
+from rdgai.tei import find_elements
+
+from .util import make_synthetic_tei
+from .conftest import TEST_DATA_DIR
 
 
 def test_doc_print_classified_pairs(arb, capsys):
@@ -37,6 +41,30 @@ def test_doc_get_classified_pairs_minimal(minimal):
     assert len(result) == 0
 
 
+def test_doc_add_relation_type_single_interpgrp(no_interpgrp, tmp_path):
+    no_interpgrp.add_relation_type("category4", "Description 4")
+    no_interpgrp.add_relation_type("category5", "Description 5")
+    output = tmp_path / "output.xml"
+    no_interpgrp.write(output)
+    assert output.read_text().count("<interpGrp") == 1
+
+    result = Doc(output)
+    assert "category4" in result.relation_types
+    assert "category5" in result.relation_types
+
+
+def test_doc_added_elements_namespaced(minimal, tmp_path):
+    pair = minimal.apps[0].pairs[0]
+    relation = pair.add_type(minimal.relation_types['category1'], description="Justification")
+    assert relation.tag == "{http://www.tei-c.org/ns/1.0}relation"
+    assert relation.getparent().tag == "{http://www.tei-c.org/ns/1.0}listRelation"
+
+    output = tmp_path / "output.xml"
+    minimal.write(output)
+    result = Doc(output)
+    assert result.apps[0].get_pair(pair.active.n, pair.passive.n).get_description() == "Justification"
+
+
 def test_doc_get_classified_pairs_minimal(no_interpgrp):
     assert len(no_interpgrp.relation_types) == 3
     result = no_interpgrp.get_classified_pairs()
@@ -208,6 +236,73 @@ def test_pair_remove_type2(minimal):
     assert relation_element.attrib == {'active': '1', 'passive': '2', 'ana': '#category2'}
 
 
+def test_pair_descriptions_indexed(minimal):
+    app = minimal.apps[0]
+    pair = app.pairs[0]
+    assert not pair.has_description()
+
+    pair.add_description("First description")
+    assert pair.has_description()
+    assert pair.get_description() == "First description"
+    relation_element = pair.relation_elements()[0]
+    assert app.relation_elements_for("1", "2") == [relation_element]
+    assert relation_element.attrib == {'active': '1', 'passive': '2'}
+
+    pair.add_description("Second description")
+    assert pair.get_description() == "Second description"
+    assert len(app.desc_elements_for("1", "2")) == 1
+
+    pair.remove_description()
+    assert not pair.has_description()
+    assert app.desc_elements_for("1", "2") == []
+
+
+def test_pair_remove_type_removes_relation_from_index(minimal):
+    app = minimal.apps[0]
+    pair = app.pairs[0]
+    relation_type = minimal.relation_types['category1']
+    pair.add_type(relation_type, description="A description")
+    assert len(app.relation_elements_for("1", "2")) == 1
+    assert len(app.desc_elements_for("1", "2")) == 1
+
+    pair.remove_type(relation_type)
+    assert app.relation_elements_for("1", "2") == []
+    assert app.desc_elements_for("1", "2") == []
+    assert not pair.has_description()
+
+
+def test_relation_index_matches_tree(arb):
+    for app in arb.apps[:20]:
+        for pair in app.pairs:
+            relations = find_elements(app.element, f".//relation[@active='{pair.active.n}'][@passive='{pair.passive.n}']")
+            assert pair.relation_elements() == relations
+
+
+def test_app_get_pair(minimal):
+    app = minimal.apps[0]
+    pair = app.get_pair("1", "3")
+    assert str(pair) == "Reading 1 ➞ Reading 3"
+    assert pair.get_inverse() is app.get_pair("3", "1")
+    assert app.get_pair("1", "4") is None
+
+
+def test_app_many_readings(tmp_path):
+    path = tmp_path / "synthetic.xml"
+    path.write_text(make_synthetic_tei(apps=2, readings=60, categories=4))
+    doc = Doc(path)
+
+    assert len(doc.apps) == 2
+    for app in doc.apps:
+        assert len(app.readings) == 60
+        assert len(app.pairs) == 60 * 59
+        assert len(app.non_redundant_pairs) == 60 * 59 // 2
+        pair = app.get_pair("3", "7")
+        assert pair.relation_type_names() == {"category2"}
+        assert pair in doc.relation_types["category2"].pairs
+
+    assert sum(len(relation_type.pairs) for relation_type in doc.relation_types.values()) == 2 * 60 * 59
+
+
 def test_app_hash(arb):
     assert hash(arb.apps[0]) == hash(arb.apps[0])
     assert hash(arb.apps[0]) != hash(arb.apps[1])
@@ -225,6 +320,27 @@ def test_app_str_fallbacks(app_names):
     assert str(app_names.apps[3]) == "NoAB"
     
 
+def test_app_names_assigned_on_load(tmp_path, monkeypatch):
+    path = tmp_path / "synthetic.xml"
+    path.write_text(make_synthetic_tei(apps=5, readings=2, classified=False, named=False))
+    doc = Doc(path)
+    assert [app.name for app in doc.apps] == [f"B1K1V1-{index}" for index in range(1, 6)]
+    assert list(doc.id_to_app) == [app.name for app in doc.apps]
+
+    # The names are cached so the apps do not need to be found again
+    monkeypatch.setattr("rdgai.apparatus.find_elements", lambda *args: pytest.fail("find_elements called"))
+    assert str(doc.apps[3]) == "B1K1V1-4"
+
+
+def test_doc_not_namespaced(tmp_path):
+    path = tmp_path / "plain.xml"
+    path.write_text((TEST_DATA_DIR/"minimal.xml").read_text().replace(' xmlns="http://www.tei-c.org/ns/1.0"', ''))
+    doc = Doc(path)
+    assert not doc.namespaced
+    assert len(doc.apps) == len(Doc(TEST_DATA_DIR/"minimal.xml").apps)
+    assert [reading.n for reading in doc.apps[0].readings] == ["1", "2", "3"]
+
+
 def test_app_text_in_context(app_names):
     assert app_names.apps[0].text_in_context() == 'Word1 ⸂Reading 1⸃ Word2 Reading 1 Word3 Word4'
     assert app_names.apps[1].text_in_context() == 'Word1 Reading 1 Word2 ⸂Reading 1⸃ Word3 Word4'
@@ -232,6 +348,21 @@ def test_app_text_in_context(app_names):
     assert app_names.apps[3].text_in_context() == 'Word1 Reading 1 Word2 Reading 1 Word3 Word4 ⸂Reading 1⸃'
 
 
+def test_app_text_in_context_width(app_names):
+    app = app_names.apps[1]
+    assert app.text_before(width=3) == 'Reading 1 Word2'
+    assert app.text_after(width=1) == 'Word3'
+    assert app.text_in_context(width=1) == 'Word2 ⸂Reading 1⸃ Word3'
+    assert app.text_before(width=0) == ''
+    assert app.text_after(width=100) == 'Word3 Word4'
+
+
+def test_app_context_windows_shared(app_names):
+    windows = app_names.apps[0].ab_context_windows()
+    assert app_names.apps[1].ab_context_windows() is windows
+    assert app_names.apps[3].ab_context_windows() is None
+
+
 def test_app_text_after_without_ab_stops_at_milestone(tmp_path):
     path = tmp_path / "milestone.xml"
     path.write_text("""
@@ -367,7 +498,7 @@ def test_doc_render_html(minimal, tmp_path):
 @pytest.fixture
 def minimal_flask_test_client(minimal, tmp_path):
     output = tmp_path / "minimal.xml"
-    flask_app = minimal.flask_app(output)
+    flask_app = minimal.flask_app(output, flush_delay=0)
     client = flask_app.test_client()
     client.output = output
     return client
@@ -382,8 +513,8 @@ def test_doc_flask_app(minimal_flask_test_client):
 
 def test_doc_flask_app_add_remove(minimal_flask_test_client):
     data = {
-        "relation_type": "category1",
-        "pair": "Reading 1 ➞ Reading 2",
+        "relation_type": "type/category1",
+        "pair": "pair/app/1/2",
         "operation": "add"
     }
     response = minimal_flask_test_client.get("/")
@@ -405,7 +536,7 @@ def test_doc_flask_app_add_remove(minimal_flask_test_client):
 def test_doc_flask_app_add_remove_description(minimal_flask_test_client):
     data = {
         "description": "Justification",
-        "pair": "Reading 1 ➞ Reading 2",
+        "pair": "pair/app/1/2",
         "operation": "add"
     }
     response = minimal_flask_test_client.get("/")
@@ -428,7 +559,7 @@ def test_doc_flask_app_add_remove_description(minimal_flask_test_client):
 def test_doc_flask_app_add_description_error(minimal_flask_test_client):
     data = {
         "description": 1,
-        "pair": "Reading 1 ➞ Reading 2",
+        "pair": "pair/app/1/2",
         "operation": "unknown"
     }
     response = minimal_flask_test_client.get("/")
@@ -440,8 +571,8 @@ def test_doc_flask_app_add_description_error(minimal_flask_test_client):
 
 def test_doc_flask_app_add_type_error(minimal_flask_test_client):
     data = {
-        "relation_type": "category1",
-        "pair": "Reading 1 ➞ Reading 2",
+        "relation_type": "type/category1",
+        "pair": "pair/app/1/2",
         "operation": "unknown"
     }
     response = minimal_flask_test_client.get("/")
@@ -460,3 +591,48 @@ def test_doc_clean(messy, tmp_path):
     assert '<relation active="1" passive="3" ana="#category2"/>' in result
     assert '<relation active="2" passive="3" ana="#category3"/>' in result
     assert len(re.findall("<relation ", result)) == 3
+
+    # The index is rebuilt after the duplicates are removed
+    assert len(messy.apps[0].relation_elements_for("1", "2")) == 1
+
+
+def test_doc_lazy_id_to_app():
+    doc = Doc(TEST_DATA_DIR/"app_names.xml", lazy=True)
+    assert len(doc) == 4
+    assert list(doc.id_to_app) == ["app", "app2", "ab-3", "NoAB"]
+    assert len(doc.loaded_apps) == 0
+
+    app = doc["ab-3"]
+    assert str(app) == "ab-3"
+    assert len(doc.loaded_apps) == 1
+    assert doc["ab-3"] is app
+    assert doc.apps[2] is app
+
+
+def test_doc_lazy_apps_match_eager(arb):
+    doc = Doc(arb.path, lazy=True)
+    assert [str(app) for app in doc.apps] == [str(app) for app in arb.apps]
+    assert [str(pair) for pair in doc.get_classified_pairs()] == [str(pair) for pair in arb.get_classified_pairs()]
+
+
+def test_doc_lazy_load_classified_apps(arb):
+    doc = Doc(arb.path, lazy=True)
+    doc.load_classified_apps()
+    for name, relation_type in doc.relation_types.items():
+        assert len(relation_type.pairs) == len(arb.relation_types[name].pairs)
+    assert len(doc.loaded_apps) < len(doc)
+
+
+def test_doc_lazy_load_classified_apps_once(arb, monkeypatch):
+    from rdgai.prompts import compile_prompt
+    doc = Doc(arb.path, lazy=True)
+    compiled = compile_prompt(doc, 5)
+    monkeypatch.setattr("rdgai.apparatus.RELATIONS", lambda *args: pytest.fail("app elements scanned again"))
+    assert compile_prompt(doc, 5) is compiled
+    doc.load_classified_apps()
+
+
+def test_doc_lazy_preamble(arb):
+    from rdgai.prompts import build_preamble
+    doc = Doc(arb.path, lazy=True)
+    assert build_preamble(doc, 5) == build_preamble(arb, 5)
@@ -0,0 +1,106 @@
+import json
+import pytest
+from rich.console import Console
+from typer.testing import CliRunner
+
+from rdgai.main import app
+from rdgai.batch import export_batch_requests, import_batch_results, batch_custom_id, get_batch_result_text
+
+from .conftest import TEST_DATA_DIR
+
+runner = CliRunner()
+
+
+def test_batch_custom_id(minimal):
+    pairs = minimal.apps[0].non_redundant_pairs
+    ids = [batch_custom_id(pair) for pair in pairs]
+    assert len(set(ids)) == len(ids)
+    assert all(len(custom_id) <= 64 for custom_id in ids)
+    assert ids[0] == batch_custom_id(minimal.apps[0].non_redundant_pairs[0])
+
+
+def test_export_batch_requests(minimal, tmp_path):
+    output = tmp_path / "requests.jsonl"
+    count = export_batch_requests(minimal, output, llm="gpt-4o-mini", temperature=0.2)
+    assert count == 3
+
+    requests = [json.loads(line) for line in output.read_text().splitlines()]
+    assert len(requests) == 3
+    request = requests[0]
+    assert request['custom_id'] == batch_custom_id(minimal.apps[0].non_redundant_pairs[0])
+    assert request['url'] == "/v1/chat/completions"
+    assert request['body']['model'] == "gpt-4o-mini"
+    assert request['body']['temperature'] == 0.2
+    messages = request['body']['messages']
+    assert [message['role'] for message in messages] == ["system", "user", "assistant"]
+    assert messages[0]['content'] == "You are an academic who is an expert in textual criticism in Arabic."
+    assert "What category would best describe a change from ⸂Reading 1⸃ to ⸂Reading 2⸃?" in messages[1]['content']
+
+
+def test_export_batch_requests_anthropic(minimal, tmp_path):
+    output = tmp_path / "requests.jsonl"
+    count = export_batch_requests(minimal, output, llm="claude-3-5-haiku-20241022", temperature=0.2, batch_format="anthropic")
+    assert count == 3
+
+    request = json.loads(output.read_text().splitlines()[0])
+    assert request['custom_id'] == batch_custom_id(minimal.apps[0].non_redundant_pairs[0])
+    params = request['params']
+    assert params['model'] == "claude-3-5-haiku-20241022"
+    assert params['temperature'] == 0.2
+    assert params['max_tokens'] > 0
+    assert params['system'] == "You are an academic who is an expert in textual criticism in Arabic."
+    assert [message['role'] for message in params['messages']] == ["user", "assistant"]
+
+    with pytest.raises(ValueError):
+        export_batch_requests(minimal, output, batch_format="unknown")
+
+
+def test_get_batch_result_text():
+    assert get_batch_result_text({"content": "text"}) == "text"
+    assert get_batch_result_text({"response": {"status_code": 200, "body": {"choices": [{"message": {"content": "text"}}]}}}) == "text"
+    assert get_batch_result_text({"response": {"status_code": 400, "body": {}}}) is None
+    assert get_batch_result_text({"result": {"type": "succeeded", "message": {"content": [{"type": "text", "text": "text"}]}}}) == "text"
+    assert get_batch_result_text({"result": {"type": "errored"}}) is None
+    assert get_batch_result_text({"error": {"message": "failed"}}) is None
+
+
+def test_import_batch_results(minimal, tmp_path):
+    output = tmp_path / "output.xml"
+    count = import_batch_results(minimal, TEST_DATA_DIR/"minimal_batch_results.jsonl", output)
+    assert count == 2
+
+    result = output.read_text()
+    assert '<relation active="1" passive="2" ana="#category1" resp="#rdgai">' in result
+    assert '<desc>justification1</desc>' in result
+    assert '<relation active="2" passive="1" ana="#category1" resp="#rdgai">' in result
+    assert '<relation active="1" passive="3" ana="#category2" resp="#rdgai">' in result
+    assert '<desc>justification2</desc>' in result
+    # The request for 2 → 3 failed
+    assert '<relation active="2" passive="3"' not in result
+
+
+def test_import_batch_results_malformed_line(minimal, tmp_path):
+    results = tmp_path / "results.jsonl"
+    lines = (TEST_DATA_DIR/"minimal_batch_results.jsonl").read_text().splitlines()
+    results.write_text("\n".join([lines[0], "[]", *lines[1:], '{"custom_id": "rdgai-']) + "\n")
+
+    console = Console(record=True, width=200)
+    count = import_batch_results(minimal, results, tmp_path / "output.xml", console=console)
+    assert count == 2
+    text = console.export_text()
+    assert "Cannot read line 2" in text
+    assert f"Cannot read line {len(lines) + 2}" in text
+
+
+def test_main_classify_batch_export_import(tmp_path):
+    requests = tmp_path / "requests.jsonl"
+    result = runner.invoke(app, ["classify", str(TEST_DATA_DIR/"minimal.xml"), "--batch-export", str(requests)])
+    assert result.exit_code == 0
+    assert "Wrote 3 requests" in result.stdout
+    assert len(requests.read_text().splitlines()) == 3
+
+    output = tmp_path / "output.xml"
+    result = runner.invoke(app, ["classify", str(TEST_DATA_DIR/"minimal.xml"), str(output), "--batch-import", str(TEST_DATA_DIR/"minimal_batch_results.jsonl")])
+    assert result.exit_code == 0
+    assert "Classified 2 pairs" in result.stdout
+    assert '<relation active="1" passive="2" ana="#category1" resp="#rdgai">' in output.read_text()
@@ -0,0 +1,118 @@
+import os
+from pathlib import Path
+from langchain_core.runnables import RunnableLambda
+from langchain_core.messages import AIMessage
+from langchain_core.prompts.chat import ChatPromptTemplate
+
+from rdgai.cache import DiskCache, CachedLLM, default_cache_dir, hash_key
+from rdgai.classification import classify
+from rdgai.apparatus import Doc
+
+
+def test_default_cache_dir_env(monkeypatch, tmp_path):
+    monkeypatch.setenv("RDGAI_CACHE_DIR", str(tmp_path))
+    assert default_cache_dir() == tmp_path
+
+
+def test_default_cache_dir_xdg(monkeypatch, tmp_path):
+    monkeypatch.delenv("RDGAI_CACHE_DIR")
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    assert default_cache_dir() == tmp_path / "rdgai"
+
+
+def test_hash_key():
+    assert hash_key("a", 0.1, "prompt") == hash_key("a", 0.1, "prompt")
+    assert hash_key("a", 0.1, "prompt") != hash_key("a", 0.2, "prompt")
+
+
+def test_disk_cache_get_set(tmp_path):
+    cache = DiskCache(tmp_path)
+    key = hash_key("x")
+    assert cache.get(key) is None
+    assert key not in cache
+    cache.set(key, b"value")
+    assert key in cache
+    assert cache.get(key) == b"value"
+    assert DiskCache(tmp_path).get(key) == b"value"
+    cache.clear()
+    assert cache.get(key) is None
+
+
+def test_disk_cache_lru_eviction(tmp_path):
+    cache = DiskCache(tmp_path, max_size=35)
+    keys = [hash_key(i) for i in range(3)]
+    for index, key in enumerate(keys):
+        cache.set(key, b"0123456789")
+        path = cache.path(key)
+        os.utime(path, ns=(index * 10**9, index * 10**9))
+
+    # Reading the first key makes it the most recently used
+    assert cache.get(keys[0]) == b"0123456789"
+    cache.set(hash_key(3), b"0123456789")
+
+    assert keys[0] in cache
+    assert keys[1] not in cache
+    assert keys[2] in cache
+    assert hash_key(3) in cache
+    assert cache.size() == 30
+
+
+def test_disk_cache_evicts_below_limit(tmp_path, monkeypatch):
+    cache = DiskCache(tmp_path, max_size=1000)
+    for i in range(100):
+        cache.set(hash_key(i), b"0123456789")
+
+    scans = []
+    evict = cache.evict
+    monkeypatch.setattr(cache, "evict", lambda: scans.append(1) or evict())
+    for i in range(100, 120):
+        cache.set(hash_key(i), b"0123456789")
+
+    # Each eviction makes room for several more entries rather than only the one being written
+    assert len(scans) == 2
+    assert cache.size() <= 1000
+
+
+def test_cached_llm(tmp_path):
+    calls = []
+    def llm(prompt_value, *args, **kwargs):
+        calls.append(prompt_value)
+        return "category1\njustification1"
+
+    cache = DiskCache(tmp_path)
+    cached_llm = CachedLLM(RunnableLambda(llm), cache=cache, model_id="model", temperature=0.1)
+    template = ChatPromptTemplate.from_messages([("human", "prompt")])
+    chain = template | cached_llm
+
+    # The response is a message whether or not it came from the cache
+    miss = chain.invoke({})
+    hit = chain.invoke({})
+    assert isinstance(miss, AIMessage) and isinstance(hit, AIMessage)
+    assert miss.content == hit.content == "category1\njustification1"
+    assert len(calls) == 1
+    assert cached_llm.hits == 1
+
+    other_temperature = CachedLLM(RunnableLambda(llm), cache=cache, model_id="model", temperature=0.5)
+    (template | other_temperature).invoke({})
+    assert len(calls) == 2
+
+
+def test_classify_cache(minimal, tmp_path, capsys):
+    calls = []
+    def llm(prompt_value, *args, **kwargs):
+        calls.append(prompt_value)
+        return "category1\njustification1"
+
+    cache_dir = tmp_path / "cache"
+    classify(minimal, tmp_path / "output1.xml", llm=RunnableLambda(llm), cache_dir=cache_dir, model_id="model")
+    assert len(calls) == 3
+
+    assert "Reused" not in capsys.readouterr().out
+
+    classify(Doc(minimal.path), tmp_path / "output2.xml", llm=RunnableLambda(llm), cache_dir=cache_dir, model_id="model")
+    assert len(calls) == 3
+    assert "Reused 3 responses from the cache" in capsys.readouterr().out
+    assert (tmp_path / "output1.xml").read_text() == (tmp_path / "output2.xml").read_text()
+
+    classify(Doc(minimal.path), tmp_path / "output3.xml", llm=RunnableLambda(llm), model_id="model")
+    assert len(calls) == 6
@@ -1,4 +1,9 @@
-from rdgai.classification import classify
+import time
+import pytest
+from rdgai.apparatus import Doc
+from rdgai.journal import Journal
+from langchain_core.messages import AIMessage
+from rdgai.classification import classify, RateLimiter, Checkpoint, UsageReport, prompt_cache_control
 from langchain_core.runnables import RunnableLambda
 
 mock_llm = RunnableLambda(lambda *x, **kwargs: "category1\njustification1")
@@ -65,4 +70,194 @@ def test_classify_minimal_missing_category(minimal, capsys, tmp_path):
     assert '<relation active="2" passive="1" ana="#category1" resp="#rdgai">' not in result
     assert '<desc>c.f. Reading 1 ➞ Reading 2</desc>' not in result
     
-        
\ No newline at end of file
+        
+
+def test_classify_minimal_workers(minimal, tmp_path):
+    serial_output = tmp_path / "serial.xml"
+    concurrent_output = tmp_path / "concurrent.xml"
+
+    classify(minimal, serial_output, llm=mock_llm)
+    classify(Doc(minimal.path), concurrent_output, llm=mock_llm, workers=4)
+
+    assert concurrent_output.exists()
+    assert concurrent_output.read_text() == serial_output.read_text()
+
+
+def test_classify_pairs_concurrently_order(arb, tmp_path):
+    output = tmp_path / "output.xml"
+    pairs = arb.get_unclassified_pairs(redundant=False)[:6]
+    answers = {str(pair): f"Orthography\njustification {index}" for index, pair in enumerate(pairs)}
+
+    def slow_llm(prompt_value, *args, **kwargs):
+        prompt = prompt_value.to_string()
+        for index, pair in enumerate(pairs):
+            if f"from {pair.app.text_with_signs(str(pair.active))} to {pair.app.text_with_signs(str(pair.passive))}?" in prompt:
+                # Answer the earlier pairs last to check that results are applied in pair order
+                time.sleep(0.01 * (len(pairs) - index))
+                return answers[str(pair)]
+        return ""
+
+    classify(arb, output, pairs=pairs, llm=RunnableLambda(slow_llm), workers=3)
+    for index, pair in enumerate(pairs):
+        assert pair.get_description() == f"justification {index}"
+
+
+def test_classify_pairs_concurrently_bounded(arb, tmp_path):
+    calls = []
+    def failing_llm(prompt_value, *args, **kwargs):
+        calls.append(prompt_value)
+        time.sleep(0.01)
+        raise RuntimeError("Service unavailable")
+
+    pairs = arb.get_unclassified_pairs(redundant=False)[:12]
+    with pytest.raises(RuntimeError):
+        classify(arb, tmp_path / "output.xml", pairs=pairs, llm=RunnableLambda(failing_llm), workers=2)
+
+    # Only twice as many requests as workers are sent ahead and the rest are cancelled after the error
+    assert len(calls) <= 4
+
+
+def test_classify_rate_limiter_skips_cache_hits(minimal, tmp_path, monkeypatch):
+    acquired = []
+    monkeypatch.setattr(RateLimiter, "acquire", lambda self, tokens=0: acquired.append(tokens))
+
+    cache_dir = tmp_path / "cache"
+    classify(minimal, tmp_path / "output1.xml", llm=mock_llm, cache_dir=cache_dir, model_id="model", requests_per_minute=100)
+    assert len(acquired) == 3
+    assert all(tokens > 0 for tokens in acquired)
+
+    classify(Doc(minimal.path), tmp_path / "output2.xml", llm=mock_llm, cache_dir=cache_dir, model_id="model", requests_per_minute=100)
+    assert len(acquired) == 3
+
+
+def test_rate_limiter_requests():
+    rate_limiter = RateLimiter(requests_per_minute=2, period=0.2)
+    start = time.monotonic()
+    for _ in range(3):
+        rate_limiter.acquire()
+    assert time.monotonic() - start >= 0.15
+
+
+def test_rate_limiter_tokens():
+    rate_limiter = RateLimiter(tokens_per_minute=100, period=0.2)
+    start = time.monotonic()
+    rate_limiter.acquire(60)
+    rate_limiter.acquire(60)
+    assert time.monotonic() - start >= 0.15
+
+
+def test_rate_limiter_no_limits():
+    rate_limiter = RateLimiter()
+    for _ in range(100):
+        rate_limiter.acquire(1000)
+    assert len(rate_limiter.history) == 0
+
+
+def test_checkpoint_every(minimal, tmp_path):
+    output = tmp_path / "output.xml"
+    checkpoint = Checkpoint(minimal, output, every=2, interval=0)
+    assert not checkpoint.step()
+    assert not output.exists()
+    assert checkpoint.step()
+    assert output.exists()
+    assert checkpoint.pending == 0
+
+
+def test_checkpoint_interval(minimal, tmp_path):
+    output = tmp_path / "output.xml"
+    checkpoint = Checkpoint(minimal, output, every=0, interval=0.05)
+    assert not checkpoint.step()
+    time.sleep(0.06)
+    assert checkpoint.step()
+    assert output.exists()
+
+
+def test_classify_writes_checkpoints(minimal, tmp_path, monkeypatch):
+    output = tmp_path / "output.xml"
+    writes = []
+    monkeypatch.setattr(Doc, "write", lambda self, path: writes.append(path))
+
+    classify(minimal, output, llm=mock_llm, checkpoint_every=2, checkpoint_interval=0)
+
+    # Three pairs in minimal.xml: one checkpoint after two pairs and the final write
+    assert writes == [output, output]
+
+
+def test_classify_flushes_on_error(minimal, tmp_path):
+    output = tmp_path / "output.xml"
+    calls = []
+
+    def failing_llm(*args, **kwargs):
+        calls.append(1)
+        if len(calls) > 1:
+            raise ConnectionError("network down")
+        return "category1\njustification1"
+
+    with pytest.raises(ConnectionError):
+        classify(minimal, output, llm=RunnableLambda(failing_llm), checkpoint_every=100, checkpoint_interval=0)
+
+    assert '<relation active="1" passive="2" ana="#category1" resp="#rdgai">' in output.read_text()
+
+
+def test_classify_usage_report(minimal, tmp_path, capsys):
+    def llm_with_usage(prompt_value, *args, **kwargs):
+        return AIMessage(
+            "category1\njustification1",
+            usage_metadata=dict(
+                input_tokens=100,
+                output_tokens=5,
+                total_tokens=105,
+                input_token_details=dict(cache_read=80, cache_creation=0),
+            ),
+        )
+
+    usage = classify(minimal, tmp_path / "output.xml", llm=RunnableLambda(llm_with_usage))
+    assert usage.requests == 3
+    assert usage.input_tokens == 300
+    assert usage.cache_read_tokens == 240
+    assert usage.uncached_input_tokens == 60
+    assert "Token usage for 3 requests: 300 input (240 cache hits" in capsys.readouterr().out
+
+
+def test_usage_report_ignores_strings():
+    usage = UsageReport()
+    assert usage.record("category1") == "category1"
+    assert usage.requests == 0
+
+
+def test_prompt_cache_control():
+    assert prompt_cache_control(mock_llm) is None
+
+
+def test_classify_prompt_caching_unsupported(minimal, tmp_path, capsys):
+    classify(minimal, tmp_path / "output.xml", llm=mock_llm, prompt_caching=True)
+    assert "Prompt caching cannot be requested explicitly" in capsys.readouterr().out
+
+
+def test_classify_batch(minimal, tmp_path):
+    output = tmp_path / "output.xml"
+    prompts = []
+
+    def batch_llm(prompt_value, *args, **kwargs):
+        prompt = prompt_value.to_string()
+        prompts.append(prompt)
+        if "Classify the change for each of these" in prompt:
+            # The pair 2 → 3 is missing so it should be classified individually
+            return "1 → 2 = category2 : batch justification 1\n1 → 3 = category3 : batch justification 2\n-----"
+        return "category1\nsingle justification"
+
+    classify(minimal, output, llm=RunnableLambda(batch_llm), batch=True, journal=tmp_path / "journal.jsonl")
+
+    assert len(prompts) == 2
+    pairs = minimal.apps[0].non_redundant_pairs
+    assert pairs[0].relation_type_names() == {"category2"}
+    assert pairs[0].get_description() == "batch justification 1"
+    assert pairs[1].relation_type_names() == {"category3"}
+    assert pairs[2].relation_type_names() == {"category1"}
+    assert pairs[2].get_description() == "single justification"
+
+    result = output.read_text()
+    assert '<relation active="1" passive="2" ana="#category2" resp="#rdgai">' in result
+    assert '<relation active="2" passive="3" ana="#category1" resp="#rdgai">' in result
+
+    assert len(Journal(tmp_path / "journal.jsonl").entries()) == 3
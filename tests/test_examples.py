@@ -0,0 +1,138 @@
+import numpy as np
+import pytest
+
+from rdgai.apparatus import Doc
+from rdgai.examples import distance_matrix, stratified_sample, select_medoids, ExampleCache, MedoidSelector, ExampleSelector
+
+
+def test_distance_matrix(arb):
+    pairs = arb.relation_types['Orthography'].pairs_sorted()[:4]
+    matrix = distance_matrix(pairs, workers=1)
+    assert matrix.shape == (4, 4)
+    assert np.all(np.diag(matrix) == 0)
+    assert np.array_equal(matrix, matrix.T)
+    assert np.array_equal(matrix, distance_matrix(pairs, workers=-1))
+
+
+def test_stratified_sample():
+    items = list(range(100))
+    sample = stratified_sample(items, 10, random_state=0)
+    assert len(sample) == 10
+    for index, item in enumerate(sample):
+        assert index * 10 <= item < (index + 1) * 10
+    assert stratified_sample(items, 10, random_state=0) == sample
+    assert stratified_sample(items, 200) == items
+
+
+def test_select_medoids_max_candidates(arb):
+    pairs = arb.relation_types['Single_Major_Word_Change'].pairs_sorted()
+    medoids = select_medoids(pairs, 5, max_candidates=20)
+    assert len(medoids) == 5
+    assert all(pair in pairs for pair in medoids)
+    assert select_medoids(pairs[:3], 5) == pairs[:3]
+
+
+def test_example_cache(arb, tmp_path):
+    doc = Doc(arb.path, example_cache_dir=tmp_path)
+    examples = doc.relation_types['Orthography'].representative_examples(5)
+    assert len(ExampleCache(tmp_path).cache.entries()) == 1
+
+    doc = Doc(arb.path, example_cache_dir=tmp_path)
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr("rdgai.apparatus.select_medoids", lambda *args, **kwargs: pytest.fail("select_medoids called"))
+        cached = doc.relation_types['Orthography'].representative_examples(5)
+    assert [str(pair) for pair in cached] == [str(pair) for pair in examples]
+    assert cached[0].app.doc is doc
+
+
+def test_example_cache_key_changes_with_descriptions(arb, tmp_path):
+    cache = ExampleCache(tmp_path)
+    pairs = arb.relation_types['Orthography'].pairs_sorted()
+    key = cache.key("Orthography", pairs, 5, 42, 2000)
+    assert cache.key("Orthography", pairs, 5, 42, 2000) == key
+    assert cache.key("Orthography", pairs, 6, 42, 2000) != key
+
+    pairs[0].add_description("A new justification")
+    assert cache.key("Orthography", pairs, 5, 42, 2000) != key
+
+
+def test_example_cache_missing_pair(arb, tmp_path):
+    cache = ExampleCache(tmp_path)
+    pairs = arb.relation_types['Orthography'].pairs_sorted()
+    cache.set("key", pairs[:2])
+    assert cache.get("key", pairs) == pairs[:2]
+    assert cache.get("key", pairs[1:]) is None
+    assert cache.get("other", pairs) is None
+
+
+def test_medoid_selector_add_remove(arb):
+    pairs = arb.relation_types['Single_Major_Word_Change'].pairs_sorted()[:30]
+    selector = MedoidSelector(pairs[:10])
+    for pair in pairs[10:]:
+        selector.add(pair)
+    selector.remove(pairs[3])
+    selector.remove(pairs[-1])
+    assert len(selector) == 28
+    assert pairs[3] not in selector
+    count = len(selector)
+    assert np.array_equal(selector.matrix[:count, :count], distance_matrix(selector.pairs))
+
+
+def test_medoid_selector_select(arb):
+    pairs = arb.relation_types['Single_Major_Word_Change'].pairs_sorted()[:30]
+    selector = MedoidSelector(pairs)
+    assert selector.select(5) == select_medoids(pairs, 5)
+    selector.add(arb.relation_types['Orthography'].pairs_sorted()[0])
+    assert len(selector.select(5)) == 5
+    assert selector.select(40) == selector.pairs
+
+
+def test_relation_type_example_selector_updated(minimal):
+    relation_type = minimal.relation_types['category1']
+    pairs = minimal.apps[0].non_redundant_pairs
+    pairs[0].add_type(relation_type, responsible="#editor")
+    assert relation_type.representative_examples(1) == [pairs[0]]
+    selector = relation_type.example_selector
+
+    pairs[1].add_type(relation_type, responsible="#editor")
+    assert relation_type.example_selector is selector
+    assert len(selector.undescribed) == 2
+
+    pairs[1].add_description("A justification")
+    assert pairs[1] in selector.described
+    assert relation_type.representative_examples(1) == [pairs[1]]
+
+    pairs[1].remove_type(relation_type)
+    assert len(selector) == 1
+    assert relation_type.representative_examples(2) == [pairs[0]]
+
+
+def test_example_selector_matches(arb):
+    pairs = arb.relation_types['Single_Major_Word_Change'].pairs_sorted()[:10]
+    other = arb.relation_types['Orthography'].pairs_sorted()[0]
+    selector = ExampleSelector(pairs)
+    assert selector.matches(pairs)
+    assert not selector.changed
+
+    # The same number of pairs but not the same pairs
+    assert not selector.matches(pairs[1:] + [other])
+
+    selector.update(other, candidate=True)
+    assert selector.changed
+    assert not selector.matches(pairs)
+
+
+def test_example_cache_not_written_after_updates(minimal, tmp_path):
+    doc = Doc(minimal.path, example_cache_dir=tmp_path)
+    relation_type = doc.relation_types['category1']
+    pairs = doc.apps[0].non_redundant_pairs
+    pairs[0].add_type(relation_type, responsible="#editor")
+    pairs[1].add_type(relation_type, responsible="#editor")
+    relation_type.representative_examples(1)
+    assert len(ExampleCache(tmp_path).cache.entries()) == 1
+
+    # The selector is updated rather than rebuilt so its examples are not stored under a key made from the pairs
+    pairs[2].add_type(relation_type, responsible="#editor")
+    assert relation_type.example_selector.changed
+    relation_type.representative_examples(1)
+    assert len(ExampleCache(tmp_path).cache.entries()) == 1
@@ -0,0 +1,73 @@
+import json
+import threading
+
+from rdgai.feed import ChangeFeed
+
+
+def parse(message:str) -> dict:
+    fields = {}
+    for line in message.strip().split("\n"):
+        key, _, value = line.partition(": ")
+        fields[key] = value
+    return fields
+
+
+def test_feed_publish_and_replay():
+    feed = ChangeFeed()
+    first = feed.publish(dict(app="A"))
+    feed.publish(dict(app="B"))
+    assert feed.position(first) == 1
+    assert feed.position(None) == 2
+    assert [data['app'] for _, data, _ in feed.since(1)] == ["B"]
+
+    stream = feed.stream(first, heartbeat=0.01)
+    assert next(stream).startswith("retry:")
+    message = parse(next(stream))
+    assert message['id'] == feed.event_id(2)
+    assert json.loads(message['data']) == dict(app="B")
+    assert next(stream) == ": keep-alive\n\n"
+    feed.close()
+    assert list(stream) == []
+
+
+def test_feed_reset_when_events_dropped():
+    feed = ChangeFeed(max_events=2)
+    first = feed.publish(dict(app="A"))
+    feed.publish(dict(app="B"))
+    assert feed.position(first) == 1
+    feed.publish(dict(app="C"))
+    assert feed.position(first) == 1
+    feed.publish(dict(app="D"))
+    assert feed.position(first) is None
+
+    stream = feed.stream(first)
+    assert parse(next(stream))['event'] == "reset"
+    feed.close()
+
+
+def test_feed_reset_after_restart():
+    old_id = ChangeFeed().publish(dict(app="A"))
+    feed = ChangeFeed()
+    feed.publish(dict(app="A"))
+    assert feed.position(old_id) is None
+    assert feed.position("nonsense") is None
+
+
+def test_feed_wait():
+    feed = ChangeFeed()
+    timer = threading.Timer(0.05, feed.publish, args=(dict(app="A"),))
+    timer.start()
+    events = feed.wait(0, timeout=5)
+    assert events == [(1, dict(app="A"), "")]
+    assert feed.wait(1, timeout=0.01) == []
+
+
+def test_feed_named_event():
+    feed = ChangeFeed()
+    stream = feed.stream(None, heartbeat=0.01)
+    next(stream)
+    feed.publish(dict(apps=["A"]), event="reset")
+    message = parse(next(stream))
+    assert message['event'] == "reset"
+    assert json.loads(message['data']) == dict(apps=["A"])
+    feed.close()
@@ -0,0 +1,234 @@
+import os
+import json
+import pytest
+from pathlib import Path
+from rdgai.apparatus import Doc
+from rdgai.gui import paginate, asset_version, ASSET_MAX_AGE
+
+from .conftest import TEST_DATA_DIR
+
+
+@pytest.fixture
+def arb_client(arb, tmp_path):
+    flask_app = arb.flask_app(tmp_path / "arb.xml", flush_delay=0)
+    return flask_app.test_client()
+
+
+@pytest.fixture
+def lazy_arb_client(tmp_path):
+    doc = Doc(TEST_DATA_DIR/"arb.xml", lazy=True)
+    flask_app = doc.flask_app(tmp_path / "arb.xml", flush_delay=0)
+    return flask_app.test_client()
+
+
+def test_paginate():
+    items, pagination = paginate(list(range(25)), page=2, per_page=10)
+    assert items == list(range(10, 20))
+    assert pagination == dict(page=2, per_page=10, total=25, pages=3)
+
+
+def test_paginate_clamps():
+    items, pagination = paginate(list(range(25)), page=10, per_page=10)
+    assert items == list(range(20, 25))
+    assert pagination['page'] == 3
+
+    items, pagination = paginate([], page=0, per_page=0)
+    assert items == []
+    assert pagination == dict(page=1, per_page=1, total=0, pages=1)
+
+
+def test_root_renders_first_app_only(arb_client):
+    response = arb_client.get("/")
+    assert response.status_code == 200
+    html = response.data.decode()
+    assert "<h1>Jn8_12-1</h1>" in html
+    assert "<h1>Jn8_12-2</h1>" not in html
+    assert "/assets/js/gui.js?v=" in html
+
+
+def test_api_apps(arb_client):
+    response = arb_client.get("/api/apps?page=2&per_page=5")
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['page'] == 2
+    assert data['total'] == 214
+    assert data['pages'] == 43
+    assert [item['index'] for item in data['items']] == [5, 6, 7, 8, 9]
+    assert data['items'][0]['name'] == "Jn8_12-6"
+
+
+def test_api_app(arb_client):
+    response = arb_client.get("/api/apps/Jn8_12-2")
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['name'] == "Jn8_12-2"
+    assert data['index'] == 1
+    assert data['previous'] == "Jn8_12-1"
+    assert data['next'] == "Jn8_12-3"
+    assert len(data['readings']) > 1
+    assert data['pairs']
+    assert "<h1>Jn8_12-2</h1>" in data['html']
+    assert all(pair['key'] in data['html'] for pair in data['pairs'])
+
+
+def test_api_app_missing(arb_client):
+    assert arb_client.get("/api/apps/missing").status_code == 404
+
+
+def test_api_relation_types(arb_client):
+    data = arb_client.get("/api/relation-types").get_json()
+    assert [item['name'] for item in data['items']] == ['Orthography', 'Single_Minor_Word_Change', 'Single_Major_Word_Change', 'Multiple_Word_Changes']
+    assert data['items'][0]['count'] == 60
+
+
+def test_api_relation_type_pairs(arb_client):
+    relation_type = arb_client.get("/api/relation-types").get_json()['items'][0]
+    data = arb_client.get(f"/api/relation-types/{relation_type['name']}/pairs?per_page=25").get_json()
+    assert data['total'] == 60
+    assert data['pages'] == 3
+    assert len(data['items']) == 25
+    assert set(data['items'][0]) == {'app', 'active', 'passive'}
+
+    assert arb_client.get("/api/relation-types/missing/pairs").status_code == 404
+
+
+def test_api_lazy_doc(lazy_arb_client):
+    assert lazy_arb_client.get("/api/relation-types").get_json()['items'][0]['count'] == 60
+    data = lazy_arb_client.get("/api/apps/Jn8_14-1").get_json()
+    assert data['previous'] == "Jn8_13-3"
+
+    pair = data['pairs'][0]
+    relation_type = lazy_arb_client.get("/api/relation-types").get_json()['items'][0]
+    operation = "remove" if relation_type['key'] in pair['types'] else "add"
+    response = lazy_arb_client.post("/api/relation-type", json=dict(pair=pair['key'], relation_type=relation_type['key'], operation=operation))
+    assert response.status_code == 200
+
+
+def test_assets_cacheable(arb_client):
+    response = arb_client.get(f"/assets/js/gui.js?v={asset_version('js/gui.js')}")
+    assert response.status_code == 200
+    assert f"max-age={ASSET_MAX_AGE}" in response.headers['Cache-Control']
+    response.close()
+
+
+def test_asset_version_cached(tmp_path, monkeypatch):
+    monkeypatch.setattr("rdgai.gui.ASSETS_DIR", tmp_path)
+    asset = tmp_path / "style.css"
+    asset.write_text("body {}")
+    version = asset_version("style.css")
+
+    reads = []
+    read_bytes = Path.read_bytes
+    monkeypatch.setattr(Path, "read_bytes", lambda self: reads.append(self) or read_bytes(self))
+    assert asset_version("style.css") == version
+    assert reads == []
+
+    asset.write_text("body { color: red; }")
+    os.utime(asset, ns=(asset.stat().st_mtime_ns + 10**9,) * 2)
+    assert asset_version("style.css") != version
+    assert len(reads) == 1
+
+
+def test_api_version_conflict(arb_client):
+    app_data = arb_client.get("/api/apps/Jn8_12-2").get_json()
+    assert app_data['version'] == 0
+    relation_type = arb_client.get("/api/relation-types").get_json()['items'][0]
+    pair = app_data['pairs'][0]
+    operation = "remove" if relation_type['key'] in pair['types'] else "add"
+    data = dict(pair=pair['key'], relation_type=relation_type['key'], operation=operation, version=0)
+
+    response = arb_client.post("/api/relation-type", json=data)
+    assert response.status_code == 200
+    assert response.headers['X-App-Version'] == "1"
+
+    # A second client which still has version 0 is refused
+    response = arb_client.post("/api/desc", json=dict(pair=pair['key'], operation="add", description="Justification", version=0))
+    assert response.status_code == 409
+    assert response.get_json()['version'] == 1
+    assert arb_client.get("/api/apps/Jn8_12-2").get_json()['pairs'][0]['description'] == pair['description']
+
+    response = arb_client.post("/api/desc", json=dict(pair=pair['key'], operation="add", description="Justification", version=1))
+    assert response.status_code == 200
+    assert arb_client.get("/api/apps/Jn8_12-2").get_json()['version'] == 2
+
+
+def test_api_concurrent_edits(arb_client):
+    from concurrent.futures import ThreadPoolExecutor
+
+    relation_type = arb_client.get("/api/relation-types").get_json()['items'][0]
+    names = [item['name'] for item in arb_client.get("/api/apps?per_page=20").get_json()['items']]
+    pairs = [(name, arb_client.get(f"/api/apps/{name}").get_json()['pairs']) for name in names]
+
+    def toggle(item):
+        name, app_pairs = item
+        for pair in app_pairs:
+            operation = "remove" if relation_type['key'] in pair['types'] else "add"
+            response = arb_client.post("/api/relation-type", json=dict(pair=pair['key'], relation_type=relation_type['key'], operation=operation))
+            assert response.status_code == 200
+        return len(app_pairs)
+
+    with ThreadPoolExecutor(8) as executor:
+        counts = list(executor.map(toggle, pairs))
+
+    for (name, _), count in zip(pairs, counts):
+        assert arb_client.get(f"/api/apps/{name}").get_json()['version'] == count
+
+
+def test_api_events(arb, tmp_path):
+    flask_app = arb.flask_app(tmp_path / "arb.xml", flush_delay=0)
+    client = flask_app.test_client()
+    app_data = client.get("/api/apps/Jn8_12-2").get_json()
+    relation_type = client.get("/api/relation-types").get_json()['items'][0]
+    pair = app_data['pairs'][0]
+    operation = "remove" if relation_type['key'] in pair['types'] else "add"
+    client.post("/api/relation-type", json=dict(pair=pair['key'], relation_type=relation_type['key'], operation=operation))
+
+    # A client which reconnects after the first event is sent the events it missed
+    last_event_id = flask_app.feed.event_id(0)
+    response = client.get("/api/events", headers={"Last-Event-ID": last_event_id}, buffered=False)
+    assert response.mimetype == "text/event-stream"
+    stream = response.response
+    assert next(stream).startswith(b"retry:")
+    event = next(stream).decode()
+    assert f"id: {flask_app.feed.event_id(1)}" in event
+    data = json.loads(event.split("data: ", 1)[1])
+    assert data['app'] == "Jn8_12-2"
+    assert data['version'] == 1
+    changed = data['pairs'][0]
+    assert changed['key'] == pair['key']
+    assert (relation_type['key'] in changed['types']) == (operation == "add")
+
+    flask_app.feed.close()
+    response.close()
+
+
+def test_api_events_limit(arb, tmp_path):
+    flask_app = arb.flask_app(tmp_path / "arb.xml", flush_delay=0, max_event_streams=1)
+    client = flask_app.test_client()
+    first = client.get("/api/events", buffered=False)
+    assert first.status_code == 200
+
+    refused = client.get("/api/events", buffered=False)
+    assert refused.status_code == 503
+    assert refused.headers["Retry-After"]
+    assert client.get("/api/apps/Jn8_12-2").status_code == 200
+
+    # Closing a stream makes room for another
+    first.close()
+    second = client.get("/api/events", buffered=False)
+    assert second.status_code == 200
+
+    flask_app.feed.close()
+    second.close()
+
+
+def test_api_keys_valid_after_restart(arb, tmp_path):
+    pair = arb.apps[1].pairs[0]
+    key = f"pair/Jn8_12-2/{pair.active.n}/{pair.passive.n}"
+
+    # The key can be used without any page having been loaded
+    client = arb.flask_app(tmp_path / "arb.xml", flush_delay=0).test_client()
+    response = client.post("/api/desc", json=dict(pair=key, operation="add", description="Justification"))
+    assert response.status_code == 200
+    assert pair.get_description() == "Justification"
+    assert client.get("/api/apps/Jn8_12-2").get_json()['pairs'][0]['key'] == key
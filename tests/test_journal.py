@@ -0,0 +1,95 @@
+import json
+from pathlib import Path
+from langchain_core.runnables import RunnableLambda
+
+from rdgai.apparatus import Doc
+from rdgai.classification import classify, replay_journal
+from rdgai.journal import Journal, JournalEntry, pair_key
+
+from .test_classification import mock_llm
+
+
+def test_journal_default_path():
+    assert Journal.default_path(Path("out/output.xml")) == Path("out/output.xml.journal.jsonl")
+
+
+def test_journal_record_and_entries(minimal, tmp_path):
+    journal = Journal(tmp_path / "journal.jsonl")
+    pair = minimal.apps[0].non_redundant_pairs[0]
+    entry = journal.record(pair, "category1", "justification1", model="gpt-4o")
+
+    assert entry.key() == pair_key(pair)
+    assert entry.timestamp
+
+    lines = journal.path.read_text().splitlines()
+    assert len(lines) == 1
+    data = json.loads(lines[0])
+    assert data['app_id'] == str(pair.app)
+    assert data['active'] == "1"
+    assert data['passive'] == "2"
+    assert data['category'] == "category1"
+    assert data['justification'] == "justification1"
+    assert data['model'] == "gpt-4o"
+
+    assert journal.entries() == [entry]
+    assert journal.keys() == {pair_key(pair)}
+
+
+def test_journal_ignores_truncated_line(tmp_path):
+    journal = Journal(tmp_path / "journal.jsonl")
+    journal.path.write_text(
+        '{"app_id": "app", "active": "1", "passive": "2", "category": "c", "justification": "j"}\n'
+        '{"app_id": "app", "active": "1", "pas'
+    )
+    assert journal.entries() == [JournalEntry(app_id="app", active="1", passive="2", category="c", justification="j")]
+
+
+def test_journal_missing_file(tmp_path):
+    assert Journal(tmp_path / "missing.jsonl").entries() == []
+
+
+def test_classify_records_journal(minimal, tmp_path):
+    output = tmp_path / "output.xml"
+    journal = tmp_path / "journal.jsonl"
+    classify(minimal, output, llm=mock_llm, journal=journal)
+
+    entries = Journal(journal).entries()
+    assert [(entry.active, entry.passive) for entry in entries] == [("1", "2"), ("1", "3"), ("2", "3")]
+    assert all(entry.category == "category1" for entry in entries)
+
+
+def test_classify_resume(minimal, tmp_path):
+    output = tmp_path / "output.xml"
+    journal = Journal(tmp_path / "journal.jsonl")
+    journal.record(minimal.apps[0].non_redundant_pairs[0], "category2", "from journal")
+
+    prompts = []
+    def llm(prompt_value, *args, **kwargs):
+        prompts.append(prompt_value.to_string())
+        return "category1\njustification1"
+
+    classify(minimal, output, llm=RunnableLambda(llm), journal=journal.path, resume=True)
+
+    # Only the two pairs missing from the journal are sent to the model
+    assert len(prompts) == 2
+    result = output.read_text()
+    assert '<relation active="1" passive="2" ana="#category2" resp="#rdgai">' in result
+    assert '<desc>from journal</desc>' in result
+    assert '<relation active="1" passive="3" ana="#category1" resp="#rdgai">' in result
+    assert len(journal.entries()) == 3
+
+
+def test_replay_journal(minimal, tmp_path):
+    journal = Journal(tmp_path / "journal.jsonl")
+    pair = minimal.apps[0].non_redundant_pairs[1]
+    journal.record(pair, "category3", "justification3")
+    journal.path.write_text(journal.path.read_text() + json.dumps(dict(app_id="missing", active="1", passive="2", category="category1", justification="")) + "\n")
+
+    doc = Doc(minimal.path)
+    answered = replay_journal(doc, journal)
+    assert answered == {pair_key(pair), ("missing", "1", "2")}
+
+    replayed_pair = doc.apps[0].non_redundant_pairs[1]
+    assert replayed_pair.relation_type_names() == {"category3"}
+    assert replayed_pair.get_description() == "justification3"
+    assert replayed_pair.get_inverse().relation_type_names() == {"category3"}
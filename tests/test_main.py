@@ -30,6 +30,44 @@ def test_main_classify(tmp_path):
     assert '<desc>c.f. Reading 1 ➞ Reading 2</desc>' in result
 
 
+@patch("llmloader.load", lambda *args, **kwargs: mock_llm)
+def test_main_classify_stream(tmp_path):
+    output = tmp_path / "output.xml"
+    result = runner.invoke(app, ["classify", str(TEST_DATA_DIR/"minimal.xml"), str(output), "--stream"])
+    assert result.exit_code == 0
+    assert '<relation active="1" passive="2" ana="#category1" resp="#rdgai">' in output.read_text()
+
+
+def test_main_classify_stream_batch_export(tmp_path):
+    result = runner.invoke(app, ["classify", str(TEST_DATA_DIR/"minimal.xml"), "--stream", "--batch-export", str(tmp_path/"requests.jsonl")])
+    assert result.exit_code != 0
+
+
+@patch("llmloader.load", lambda *args, **kwargs: mock_llm)
+def test_main_classify_journal_resume(tmp_path):
+    output = tmp_path / "output.xml"
+    journal = tmp_path / "output.xml.journal.jsonl"
+
+    # There is only a journal if one is asked for
+    result = runner.invoke(app, ["classify", str(TEST_DATA_DIR/"minimal.xml"), str(output)])
+    assert result.exit_code == 0
+    assert not journal.exists()
+
+    # Each run without --resume starts a new journal
+    for _ in range(2):
+        output.unlink()
+        result = runner.invoke(app, ["classify", str(TEST_DATA_DIR/"minimal.xml"), str(output), "--journal", str(journal)])
+        assert result.exit_code == 0
+        assert len(journal.read_text().splitlines()) == 3
+
+    output.unlink()
+    result = runner.invoke(app, ["classify", str(TEST_DATA_DIR/"minimal.xml"), str(output), "--resume"])
+    assert result.exit_code == 0
+    assert "Resuming with 3 responses" in result.stdout
+    assert len(journal.read_text().splitlines()) == 3
+    assert '<relation active="1" passive="2" ana="#category1" resp="#rdgai">' in output.read_text()
+
+
 @patch("llmloader.load", lambda *args, **kwargs: mock_llm_validation)
 def test_main_validate(tmp_path):
     output = tmp_path / "output.xml"
@@ -92,6 +130,48 @@ def test_main_classified_pairs(capsys):
     assert "Jn8_12-7: الدهر بل تكون له ➞ الدهر بل يكون له\n" in result.stdout
 
 
+@patch("llmloader.load", lambda *args, **kwargs: mock_llm)
+def test_main_classify_cache_opt_in(cache_dir, tmp_path):
+    result = runner.invoke(app, ["classify", str(TEST_DATA_DIR/"minimal.xml"), str(tmp_path/"output.xml")])
+    assert result.exit_code == 0
+    assert not (cache_dir/"responses").exists()
+
+    for _ in range(2):
+        result = runner.invoke(app, ["classify", str(TEST_DATA_DIR/"minimal.xml"), str(tmp_path/"output.xml"), "--cache"])
+        assert result.exit_code == 0
+    assert (cache_dir/"responses").exists()
+    assert "Reused 3 responses from the cache" in result.stdout
+
+
+@patch("llmloader.load", lambda *args, **kwargs: mock_llm)
+def test_main_classify_cache_dir_implies_cache(tmp_path):
+    cache_dir = tmp_path / "responses-cache"
+    result = runner.invoke(app, ["classify", str(TEST_DATA_DIR/"minimal.xml"), str(tmp_path/"output.xml"), "--cache-dir", str(cache_dir)])
+    assert result.exit_code == 0
+    assert (cache_dir/"responses").exists()
+
+
+@patch("llmloader.load", lambda *args, **kwargs: mock_llm_validation)
+def test_main_validate_cache_opt_in(cache_dir, tmp_path):
+    result = runner.invoke(app, ["validate", str(TEST_DATA_DIR/"arb.xml"), str(tmp_path/"output.xml"), "--proportion", "0.05"])
+    assert result.exit_code == 0
+    assert not (cache_dir/"responses").exists()
+
+    result = runner.invoke(app, ["validate", str(TEST_DATA_DIR/"arb.xml"), str(tmp_path/"output.xml"), "--proportion", "0.05", "--cache"])
+    assert result.exit_code == 0
+    assert (cache_dir/"responses").exists()
+
+
+def test_main_example_cache_default(cache_dir, tmp_path):
+    result = runner.invoke(app, ["--no-example-cache", "prompt-preamble", str(TEST_DATA_DIR/"arb.xml")])
+    assert result.exit_code == 0
+    assert not (cache_dir/"examples").exists()
+
+    result = runner.invoke(app, ["prompt-preamble", str(TEST_DATA_DIR/"arb.xml")])
+    assert result.exit_code == 0
+    assert (cache_dir/"examples").exists()
+
+
 def test_main_html(tmp_path):
     output = tmp_path / "output.html"
     result = runner.invoke(app, ["html", str(TEST_DATA_DIR/"minimal.xml"), str(output)])
@@ -205,7 +285,7 @@ def test_main_gui(mock_flask_app, tmp_path):
     assert result.exit_code == 0
 
     # Check if the Flask app's `run` method was called with the correct arguments
-    mock_run.assert_called_once_with(debug=True, use_reloader=False)
+    mock_run.assert_called_once_with(host="127.0.0.1", port=5000, debug=True, use_reloader=False)
 
 
 @patch("rdgai.apparatus.Doc.flask_app")
@@ -221,7 +301,21 @@ def test_main_gui_inplace(mock_flask_app):
     assert result.exit_code == 0
 
     # Check if the Flask app's `run` method was called with the correct arguments
-    mock_run.assert_called_once_with(debug=True, use_reloader=False)
+    mock_run.assert_called_once_with(host="127.0.0.1", port=5000, debug=True, use_reloader=False)
+
+
+@patch("rdgai.main.serve")
+@patch("rdgai.apparatus.Doc.flask_app")
+def test_main_gui_production(mock_flask_app, mock_serve):
+    result = runner.invoke(
+        app,
+        ["gui", str(TEST_DATA_DIR/"minimal.xml"), "--inplace", "--production", "--threads", "4", "--host", "0.0.0.0", "--port", "8080"]
+    )
+    assert result.exit_code == 0
+
+    mock_flask_app.return_value.run.assert_not_called()
+    mock_serve.assert_called_once_with(mock_flask_app.return_value, host="0.0.0.0", port=8080, threads=4)
+    mock_flask_app.return_value.persistence.close.assert_called_once()
 
 
 def strip_ansi_codes(text):
@@ -1,4 +1,6 @@
-from rdgai.mapper import Mapper
+import pytest
+from rdgai.apparatus import Doc
+from rdgai.mapper import Mapper, make_key, split_key
 
 class StrObject():
     def __init__(self, string):
@@ -26,30 +28,15 @@ def test_mapper_duplicate_key():
     mapper = Mapper()
     obj1 = StrObject("object")
     obj2 = StrObject("object")
-    obj3 = StrObject("object")
 
     key1 = mapper.key(obj1)
-    key2 = mapper.key(obj2)
-    key3 = mapper.key(obj3)
-
     assert key1 == "object"
-    assert key2 == "object_2"
-    assert key3 == "object_3"
+    with pytest.raises(ValueError):
+        mapper.key(obj2)
 
     assert mapper.obj(key1) == obj1
-    assert mapper.obj(key2) == obj2
-    assert mapper.obj(key3) == obj3
-
-
-def test_mapper_existing_key():
-    mapper = Mapper()
-    obj1 = StrObject("object")
-    obj2 = StrObject("object")
-
-    mapper.key(obj1)
-    key2 = mapper.key(obj2)
+    assert mapper.key(obj1) == key1
 
-    assert key2 == "object_2"
 
 def test_mapper_no_object_for_key():
     mapper = Mapper()
@@ -72,3 +59,49 @@ def test_mapper_unique_objects():
     assert mapper.obj(key1) == obj1
     assert mapper.obj(key2) == obj2
     assert mapper.obj(key3) == obj3
+
+
+def test_make_key_round_trip():
+    key = make_key("pair", "Jn 8:12/1", "a", "b%")
+    assert key == "pair/Jn%208%3A12%2F1/a/b%25"
+    assert split_key(key) == ["pair", "Jn 8:12/1", "a", "b%"]
+
+
+def test_mapper_doc_keys(arb):
+    mapper = Mapper(arb)
+    app = arb.apps[1]
+    pair = app.pairs[0]
+    relation_type = arb.relation_types['Orthography']
+
+    assert mapper.key(app) == "app/Jn8_12-2"
+    assert mapper.key(pair) == f"pair/Jn8_12-2/{pair.active.n}/{pair.passive.n}"
+    assert mapper.key(relation_type) == "type/Orthography"
+
+
+def test_mapper_keys_stable_across_instances(arb):
+    pair = arb.apps[1].pairs[0]
+    key = Mapper(arb).key(pair)
+
+    # A new mapper (e.g. after the server restarts) resolves the key without having given it out
+    mapper = Mapper(arb)
+    assert mapper.obj(key) is pair
+    assert mapper.key(pair) == key
+    assert mapper.obj("app/Jn8_12-2") is arb.apps[1]
+    assert mapper.obj("type/Orthography") is arb.relation_types['Orthography']
+
+
+def test_mapper_unresolved_keys(arb):
+    mapper = Mapper(arb)
+    assert mapper.obj("app/missing") is None
+    assert mapper.obj("pair/Jn8_12-2/missing/1") is None
+    assert mapper.obj("type/missing") is None
+    assert mapper.obj("unknown/Jn8_12-2") is None
+    assert mapper.obj("") is None
+
+
+def test_mapper_doc_key_collision(arb):
+    other = Doc(arb.path)
+    mapper = Mapper(arb)
+    with pytest.raises(ValueError):
+        mapper.key(other.apps[1].pairs[0])
+    assert mapper.key(arb.apps[1].pairs[0]) == Mapper(other).key(other.apps[1].pairs[0])
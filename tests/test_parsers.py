@@ -1,4 +1,4 @@
-from rdgai.parsers import CategoryParser
+from rdgai.parsers import CategoryParser, BatchCategoryParser
 
 
 def test_parser():
@@ -8,4 +8,21 @@ def test_parser():
     category, justification = parser.invoke(output)
     assert category == "Single_Minor_Word_Change"
     assert justification == 'Justification: The deletion of the word "في" (fī) from "فليس" is an example of a single minor word change, as it is a small alteration that does not significantly affect the overall meaning of the sentence. According to the definition, this type of change involves the omission or substitution of a single minor word or part of a word, which aligns with the characteristics of this change.'
-    
\ No newline at end of file
+
+
+def test_batch_parser():
+    parser = BatchCategoryParser(["Orthography", "Transposition"])
+    output = (
+        "1 → 2 = Orthography : The spelling changes.\n"
+        "- 1 -> 3 = **Transposition** : The words swap.\n"
+        "2 → 3 = Unknown : Not a category.\n"
+        "This line is not a classification.\n"
+        "3 → 1 = Orthography\n"
+        "-----\n"
+        "2 → 1 = Orthography : After the end marker."
+    )
+    assert parser.invoke(output) == [
+        ("1", "2", "Orthography", "The spelling changes."),
+        ("1", "3", "Transposition", "The words swap."),
+        ("3", "1", "Orthography", ""),
+    ]
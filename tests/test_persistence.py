@@ -0,0 +1,201 @@
+import time
+import pytest
+
+from rdgai.apparatus import Doc
+from rdgai.persistence import Edit, EditLog, WriteBehind, VersionConflict
+
+RELATION = '<relation active="1" passive="2" ana="#category1"/>'
+
+
+def test_edit_apply(minimal):
+    pair = minimal.apps[0].pairs[0]
+    edit = Edit.create("add-type", pair, relation_type=minimal.relation_types['category1'])
+    assert edit.app_id == str(pair.app)
+    assert edit.apply(minimal) is pair
+    assert minimal.relation_types['category1'] in pair.types
+
+    Edit.create("add-description", pair, description="Justification").apply(minimal)
+    assert pair.get_description() == "Justification"
+
+    with pytest.raises(ValueError, match="Unknown operation"):
+        Edit.create("unknown", pair).apply(minimal)
+
+
+def test_edit_log(tmp_path, minimal):
+    log = EditLog(EditLog.default_path(tmp_path/"output.xml"))
+    assert log.path.name == "output.xml.edits.jsonl"
+    assert log.entries() == []
+
+    edit = Edit.create("remove-description", minimal.apps[0].pairs[0])
+    log.record(edit)
+    with open(log.path, "a") as f:
+        f.write('{"operation": "add-ty')
+    assert log.entries() == [edit]
+
+    log.clear()
+    assert not log.path.exists()
+
+
+def test_write_behind_flush(tmp_path, minimal):
+    output = tmp_path/"output.xml"
+    persistence = WriteBehind(minimal, output, delay=60)
+    persistence.recover()
+
+    pair = minimal.apps[0].pairs[0]
+    persistence.apply(Edit.create("add-type", pair, relation_type=minimal.relation_types['category1']))
+    assert persistence.pending
+    assert RELATION not in output.read_text()
+    assert len(persistence.log.entries()) == 1
+
+    persistence.close()
+    assert not persistence.pending
+    assert RELATION in output.read_text()
+    assert not persistence.log.path.exists()
+
+
+def test_write_behind_versions(tmp_path, minimal):
+    persistence = WriteBehind(minimal, tmp_path/"output.xml", delay=60)
+    pair = minimal.apps[0].pairs[0]
+    app_id = str(pair.app)
+    assert persistence.version(app_id) == 0
+
+    persistence.apply(Edit.create("add-type", pair, relation_type=minimal.relation_types['category1']), expected_version=0)
+    assert persistence.version(app_id) == 1
+
+    with pytest.raises(VersionConflict, match="version 1 rather than 0"):
+        persistence.apply(Edit.create("remove-type", pair, relation_type=minimal.relation_types['category1']), expected_version=0)
+    assert minimal.relation_types['category1'] in pair.types
+    assert persistence.version(app_id) == 1
+
+    persistence.apply(Edit.create("remove-type", pair, relation_type=minimal.relation_types['category1']))
+    assert persistence.version(app_id) == 2
+    persistence.close()
+
+
+def test_write_behind_background(tmp_path, minimal):
+    output = tmp_path/"output.xml"
+    persistence = WriteBehind(minimal, output, delay=0.05)
+    pair = minimal.apps[0].pairs[0]
+    persistence.apply(Edit.create("add-type", pair, relation_type=minimal.relation_types['category1']))
+
+    for _ in range(100):
+        if output.exists() and RELATION in output.read_text():
+            break
+        time.sleep(0.05)
+    assert RELATION in output.read_text()
+    assert not persistence.pending
+    persistence.close()
+
+
+def test_write_behind_recover(tmp_path, minimal):
+    output = tmp_path/"output.xml"
+    log = EditLog(EditLog.default_path(output))
+    log.record(Edit.create("add-type", minimal.apps[0].pairs[0], relation_type=minimal.relation_types['category1']))
+    log.record(Edit(operation="add-type", app_id="missing", active="1", passive="2", relation_type="category1"))
+
+    doc = Doc(minimal.path)
+    persistence = WriteBehind(doc, output, delay=60)
+    assert persistence.recover() == 2
+    assert RELATION in output.read_text()
+    assert minimal.relation_types['category1'].name in doc.apps[0].pairs[0].relation_type_names()
+    assert not log.path.exists()
+    persistence.close()
+
+
+def classify_externally(output, active:str, passive:str, category:str) -> None:
+    """ Changes the output as another program (e.g. `rdgai classify`) would. """
+    doc = Doc(output)
+    doc.apps[0].get_pair(active, passive).add_type(doc.relation_types[category], responsible="#rdgai", description="From another program")
+    doc.write(output)
+
+
+def test_write_behind_keeps_external_changes(tmp_path, minimal):
+    output = tmp_path/"output.xml"
+    persistence = WriteBehind(minimal, output, delay=60)
+    persistence.recover()
+    app_id = str(minimal.apps[0])
+    reset = []
+    persistence.reset_listeners.append(reset.append)
+
+    pair = minimal.apps[0].get_pair("1", "2")
+    persistence.apply(Edit.create("add-type", pair, relation_type=minimal.relation_types['category1']))
+    classify_externally(output, "1", "3", "category2")
+    persistence.close()
+
+    result = Doc(output).apps[0]
+    assert result.get_pair("1", "2").relation_type_names() == {"category1"}
+    assert result.get_pair("1", "3").relation_type_names() == {"category2"}
+    assert result.get_pair("1", "3").get_description() == "From another program"
+    assert reset == [[app_id]]
+    assert persistence.version(app_id) == 2
+
+
+def test_write_behind_merge_external(tmp_path, minimal):
+    output = tmp_path/"output.xml"
+    persistence = WriteBehind(minimal, output, delay=60)
+    persistence.recover()
+    assert persistence.merge_external() == []
+
+    # The edits which have not been written are made again after the changes from the file
+    pair = minimal.apps[0].get_pair("1", "2")
+    persistence.apply(Edit.create("add-description", pair, description="Mine"))
+    classify_externally(output, "1", "2", "category2")
+    assert persistence.merge_external() == [str(minimal.apps[0])]
+    assert pair.relation_type_names() == {"category2"}
+    assert pair.rdgai_responsible()
+    assert pair.get_description() == "Mine"
+    assert persistence.merge_external() == []
+    persistence.close()
+
+
+def test_write_behind_reads_each_external_change_once(tmp_path, minimal, monkeypatch):
+    output = tmp_path/"output.xml"
+    persistence = WriteBehind(minimal, output, delay=0)
+    persistence.recover()
+    reads = []
+    monkeypatch.setattr("rdgai.persistence.Doc", lambda path: reads.append(path) or Doc(path))
+
+    # Its own writes are not read back
+    pair = minimal.apps[0].get_pair("1", "2")
+    persistence.apply(Edit.create("add-description", pair, description="Mine"))
+    assert persistence.merge_external() == []
+    assert reads == []
+
+    # A file which cannot be read is not read again until it changes
+    output.write_text("<TEI")
+    for _ in range(3):
+        assert persistence.merge_external() == []
+    assert len(reads) == 1
+    persistence.close()
+
+
+def test_flask_app_external_changes(minimal, tmp_path):
+    output = tmp_path/"output.xml"
+    flask_app = minimal.flask_app(output, flush_delay=60, watch_interval=0.01)
+    classify_externally(output, "1", "3", "category2")
+
+    for _ in range(100):
+        if flask_app.feed.last_id:
+            break
+        time.sleep(0.02)
+    assert flask_app.feed.since(0) == [(1, dict(apps=["app"]), "reset")]
+    data = flask_app.test_client().get("/api/apps/app").get_json()
+    assert data['version'] == 1
+    assert "type/category2" in {key for pair in data['pairs'] if pair['key'] == "pair/app/1/3" for key in pair['types']}
+    flask_app.persistence.close()
+
+
+def test_flask_app_write_behind(minimal, tmp_path):
+    output = tmp_path/"output.xml"
+    flask_app = minimal.flask_app(output, flush_delay=60)
+    client = flask_app.test_client()
+    data = {"relation_type": "type/category1", "pair": "pair/app/1/2", "operation": "add"}
+    client.get("/")
+
+    response = client.post("/api/relation-type", json=data)
+    assert response.status_code == 200
+    assert RELATION not in output.read_text()
+    assert len(flask_app.persistence.log.entries()) == 1
+
+    flask_app.persistence.close()
+    assert RELATION in output.read_text()
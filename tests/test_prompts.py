@@ -1,4 +1,4 @@
-from rdgai.prompts import build_template, select_spaced_elements, build_template
+from rdgai.prompts import build_template, select_spaced_elements, build_template, compile_prompt, build_preamble, build_app_template
 
 
 # def test_build_template(minimal):
@@ -65,3 +65,80 @@ def test_select_spaced_elements_single_element():
 
 def test_select_spaced_elements_edge_case():
     assert select_spaced_elements([], 3) == []
+
+
+def test_compile_prompt_cached(arb):
+    compiled = compile_prompt(arb, examples=5)
+    assert compile_prompt(arb, examples=5) is compiled
+    assert compile_prompt(arb, examples=3) is not compiled
+    assert compiled.preamble == build_preamble(arb, 5)
+
+
+def test_compile_prompt_matches_build_template(minimal):
+    pair = minimal.apps[0].pairs[0]
+    compiled = compile_prompt(minimal)
+    assert compiled.build_template(pair).invoke({}).to_string() == build_template(pair).invoke({}).to_string()
+
+
+def test_compile_prompt_invalidated_by_new_example(minimal):
+    compiled = compile_prompt(minimal)
+    assert "e.g. Reading 1 → Reading 2" not in compiled.preamble
+
+    pair = minimal.apps[0].pairs[0]
+    pair.add_type(minimal.relation_types['category1'], responsible="#editor")
+
+    recompiled = compile_prompt(minimal)
+    assert recompiled is not compiled
+    assert "e.g. Reading 1 → Reading 2" in recompiled.preamble
+
+    pair.add_description("A justification")
+    assert "e.g. Reading 1 → Reading 2 [A justification]" in compile_prompt(minimal).preamble
+
+    pair.remove_type(minimal.relation_types['category1'])
+    assert "e.g. Reading 1 → Reading 2" not in compile_prompt(minimal).preamble
+
+
+def test_compile_prompt_not_invalidated_by_rdgai(minimal):
+    compiled = compile_prompt(minimal)
+    pair = minimal.apps[0].pairs[0]
+    pair.add_type_with_inverse(minimal.relation_types['category1'], responsible="#rdgai", description="Rdgai justification")
+    assert compile_prompt(minimal) is compiled
+
+
+def test_compile_prompt_invalidated_by_new_relation_type(minimal):
+    compiled = compile_prompt(minimal)
+    minimal.add_relation_type("category4")
+    recompiled = compile_prompt(minimal)
+    assert recompiled is not compiled
+    assert "category1, category2, category3, category4" in recompiled.categories_list
+
+
+def test_build_template_cache_control(minimal):
+    pair = minimal.apps[0].pairs[0]
+    plain = build_template(pair)
+    cached = build_template(pair, cache_control={"type": "ephemeral"})
+
+    content = cached.messages[1].content
+    assert content[0] == {"type": "text", "text": build_preamble(minimal), "cache_control": {"type": "ephemeral"}}
+    assert content[1]["text"].startswith("\nThe variation unit you need to classify")
+    assert cached.invoke({}).to_string() == plain.invoke({}).to_string()
+    assert plain.messages[1].content.startswith(build_preamble(minimal))
+
+
+def test_build_app_template_minimal(minimal):
+    app = minimal.apps[0]
+    template = build_app_template(app)
+    assert len(template.messages) == 3
+    response = template.invoke({}).to_string()
+    assert "Human: I am analyzing textual variants in a document written in Arabic." in response
+    assert "reading_1_id → reading_2_id = category : justification" in response
+    assert "Here are the 3 readings at that variation unit:\n1: Reading 1\n2: Reading 2\n3: Reading 3\n" in response
+    assert "Classify the change for each of these 3 pairs of readings:\n1 → 2\n1 → 3\n2 → 3\n" in response
+    assert "Use one of these categories: category1, category2, category3" in response
+    assert "AI: Certainly, the classifications for the pairs of readings are:" in response
+
+
+def test_build_app_template_pairs(minimal):
+    app = minimal.apps[0]
+    response = build_app_template(app, pairs=app.non_redundant_pairs[1:]).invoke({}).to_string()
+    assert "Classify the change for each of these 2 pairs of readings:\n1 → 3\n2 → 3\n" in response
@@ -0,0 +1,182 @@
+import pytest
+import pandas as pd
+from lxml import etree as ET
+
+from rdgai.apparatus import Doc
+from rdgai.streaming import StreamingDoc
+from rdgai.classification import classify
+from rdgai.evaluation import evaluate_docs
+from rdgai.export import export_variants_to_excel
+
+from .conftest import TEST_DATA_DIR
+from .test_classification import mock_llm
+
+
+def canonical(path):
+    tree = ET.parse(str(path), ET.XMLParser(remove_blank_text=True))
+    return ET.tostring(tree, method="c14n")
+
+
+def test_streaming_doc_relation_types(arb):
+    doc = StreamingDoc(arb.path)
+    assert list(doc.relation_types) == list(arb.relation_types)
+    assert doc.language == arb.language
+    assert doc.relation_types["Orthography"].description == arb.relation_types["Orthography"].description
+
+
+def test_streaming_doc_iter_apps(arb):
+    doc = StreamingDoc(arb.path)
+    apps = [(str(app), app.text_in_context(), [str(pair) for pair in app.pairs]) for app in doc.iter_apps()]
+    assert apps == [(str(app), app.text_in_context(), [str(pair) for pair in app.pairs]) for app in arb.apps]
+
+
+def test_streaming_doc_names(app_names):
+    doc = StreamingDoc(app_names.path)
+    assert [str(app) for app in doc.iter_apps()] == ["app", "app2", "ab-3", "NoAB"]
+
+
+def test_streaming_doc_context_outside_ab(app_names):
+    doc = StreamingDoc(app_names.path)
+    streamed = {str(app): (app.text_before(), app.text_after()) for app in doc.iter_apps()}
+    assert streamed["NoAB"] == (app_names["NoAB"].text_before(), "")
+    assert streamed["NoAB"][0]
+    assert streamed["app"] == (app_names["app"].text_before(), app_names["app"].text_after())
+
+
+def test_streaming_doc_releases_pairs(arb):
+    doc = StreamingDoc(arb.path)
+    for app in doc.iter_apps():
+        pass
+    assert all(len(relation_type.pairs) == 0 for relation_type in doc.relation_types.values())
+
+
+def test_streaming_doc_write_unchanged(arb, tmp_path):
+    output = tmp_path / "output.xml"
+    doc = StreamingDoc(arb.path)
+    for app in doc.iter_apps(output):
+        pass
+
+    eager = tmp_path / "eager.xml"
+    arb.write(eager)
+    assert canonical(output) == canonical(eager)
+
+
+def test_streaming_doc_write(arb, tmp_path):
+    output = tmp_path / "output.xml"
+    doc = StreamingDoc(arb.path)
+    doc.write(output)
+
+    eager = tmp_path / "eager.xml"
+    arb.write(eager)
+    assert canonical(output) == canonical(eager)
+
+    for app in doc.iter_apps():
+        with pytest.raises(RuntimeError):
+            doc.write(output)
+        break
+    assert doc.iterating == 0
+
+
+def test_streaming_doc_write_stops_early(arb, tmp_path):
+    output = tmp_path / "output.xml"
+    doc = StreamingDoc(arb.path)
+    for app in doc.iter_apps(output):
+        pair = app.get_unclassified_pairs()[0]
+        pair.add_type(doc.relation_types["Orthography"], responsible="#editor")
+        break
+
+    result = Doc(output)
+    assert len(result) == len(arb)
+    assert result.apps[0].get_pair(pair.active.n, pair.passive.n).relation_type_names() == {"Orthography"}
+    assert len(result.get_classified_pairs()) == len(arb.get_classified_pairs()) + 1
+
+
+def test_streaming_doc_write_comments(tmp_path):
+    source = tmp_path / "source.xml"
+    source.write_text(
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<!-- before -->\n'
+        '<TEI xmlns="http://www.tei-c.org/ns/1.0"><text xml:lang="ar"><body>\n'
+        '<!-- comment --><p rend="a&amp;b">text &amp; <hi/> more</p>\n'
+        '<ab n="v1">A <app><rdg n="1">x</rdg><rdg n="2">y</rdg></app> B</ab> tail\n'
+        '</body></text></TEI>'
+    )
+    output = tmp_path / "output.xml"
+    doc = StreamingDoc(source)
+    assert [str(app) for app in doc.iter_apps(output)] == ["v1-1"]
+    assert output.read_text().startswith("<?xml version='1.0' encoding='UTF-8'?>\n<!-- before -->\n<TEI")
+    assert canonical(output) == canonical(source).replace(b"<app>", b'<app xml:id="v1-1">')
+
+
+def test_classify_streaming(tmp_path):
+    output = tmp_path / "output.xml"
+    classify(StreamingDoc(TEST_DATA_DIR/"minimal.xml"), output, llm=mock_llm)
+
+    result = output.read_text()
+    assert '<relation active="1" passive="2" ana="#category1" resp="#rdgai">' in result
+    assert '<desc>justification1</desc>' in result
+    assert '<relation active="2" passive="1" ana="#category1" resp="#rdgai">' in result
+
+    eager_output = tmp_path / "eager.xml"
+    classify(Doc(TEST_DATA_DIR/"minimal.xml"), eager_output, llm=mock_llm)
+    assert canonical(output) == canonical(eager_output)
+
+
+def test_classify_streaming_examples(arb, tmp_path, capsys):
+    output = tmp_path / "output.xml"
+    classify(StreamingDoc(arb.path), output, llm=mock_llm, prompt_only=True)
+    assert "e.g. " in capsys.readouterr().out
+    assert not output.exists()
+
+
+def test_classify_streaming_prompt_matches_eager(arb, tmp_path, capsys):
+    def prompts(output:str) -> str:
+        # The eager classification also shows a progress bar
+        return "\n".join(line for line in output.splitlines() if not line.startswith("Working..."))
+
+    classify(arb, tmp_path / "eager.xml", llm=mock_llm, prompt_only=True)
+    eager_prompts = prompts(capsys.readouterr().out)
+    assert "Multiple_Word_Changes:\n\te.g. " in eager_prompts
+
+    classify(StreamingDoc(arb.path), tmp_path / "streamed.xml", llm=mock_llm, prompt_only=True)
+    assert prompts(capsys.readouterr().out) == eager_prompts
+
+
+def test_streaming_doc_examples_independent_of_chunk(arb):
+    from rdgai.prompts import build_preamble
+
+    eager_preamble = build_preamble(arb)
+    doc = StreamingDoc(arb.path)
+    for app in doc.iter_apps():
+        # The examples are first selected while the pairs of this app are being read
+        assert build_preamble(doc) == eager_preamble
+        break
+
+
+def test_streaming_doc_example_apps_compact(arb):
+    doc = StreamingDoc(arb.path)
+    doc.load_classified_apps()
+    assert len(doc.example_apps) == len({pair.app for pair in arb.get_classified_pairs()})
+    for example_app in doc.example_apps:
+        app = arb[str(example_app)]
+        classified = {n for pair in app.pairs if pair.types for n in pair.key()}
+        assert [reading.n for reading in example_app.readings] == [reading.n for reading in app.readings if reading.n in classified]
+        assert {str(pair): pair.relation_type_names() for pair in example_app.pairs if pair.types} == \
+            {str(pair): pair.relation_type_names() for pair in app.pairs if pair.types}
+
+
+def test_export_streaming(minimal_output, tmp_path):
+    output = tmp_path / "output.xlsx"
+    export_variants_to_excel(StreamingDoc(minimal_output.path), output)
+
+    eager_output = tmp_path / "eager.xlsx"
+    export_variants_to_excel(minimal_output, eager_output)
+    for sheet_name in ["Variants", "Categories"]:
+        assert pd.read_excel(output, sheet_name=sheet_name).equals(pd.read_excel(eager_output, sheet_name=sheet_name))
+
+
+def test_evaluate_streaming(capsys):
+    evaluate_docs(StreamingDoc(TEST_DATA_DIR/"minimal_output.xml"), StreamingDoc(TEST_DATA_DIR/"ground_truth.xml"))
+    out = capsys.readouterr().out
+    assert "recall 33" in out
+    assert "accuracy 50" in out
@@ -1,6 +1,6 @@
 import pytest
 from lxml import etree as ET
-from rdgai.tei import get_language_code, extract_text, find_elements, get_reading_identifier
+from rdgai.tei import get_language_code, extract_text, find_elements, get_reading_identifier, write_tei, ContextWindows, TextCache, Query, is_namespaced, find_element, tei_tag
 
 
 
@@ -92,6 +92,42 @@ def test_extract_text_ref_uses_target_text():
 
     assert extract_text(ref) == "Resolved target text"
 
+def test_extract_text_cached():
+    root = ET.fromstring("<ab><w>one</w><w>two</w></ab>")
+    cache = TextCache()
+    assert extract_text(root, cache=cache) == "one two"
+    assert cache.get(root[0], " ", True) == "one"
+
+    root[0].text = "three"
+    assert extract_text(root, cache=cache) == "one two"
+    cache.invalidate(root[0])
+    assert cache.get(root, " ", True) is None
+    assert extract_text(root, cache=cache) == "three two"
+
+
+def test_extract_text_cached_ref_invalidated():
+    root = ET.fromstring('<div><p xml:id="target">Target</p><p><ref target="#target">Label</ref></p></div>')
+    cache = TextCache()
+    assert extract_text(root[1], cache=cache) == "Target"
+    root[0].text = "Changed"
+    cache.invalidate(root[0])
+    assert extract_text(root[1], cache=cache) == "Changed"
+
+
+def test_extract_text_circular_ref():
+    root = ET.fromstring('<p xml:id="p1">Start <ref target="#p1">Label</ref></p>')
+    assert extract_text(root) == "Start"
+
+
+def test_extract_text_deep_tree():
+    root = ET.Element("ab")
+    element = root
+    for _ in range(5000):
+        element = ET.SubElement(element, "hi")
+    element.text = "deep"
+    assert extract_text(root) == "deep"
+
+
 def test_extract_text_none_node():
     assert extract_text(None) == ""
 
@@ -104,6 +140,41 @@ def test_find_elements_none_doc():
     assert find_elements(None, ".//rdg") == []
 
 
+def test_find_elements_not_namespaced():
+    root = ET.fromstring("<app><rdg n='1'/><rdg n='2'/></app>")
+    assert [rdg.get("n") for rdg in find_elements(root, ".//rdg")] == ["1", "2"]
+
+
+def test_find_elements_namespaced():
+    root = ET.fromstring("<app xmlns='http://www.tei-c.org/ns/1.0'><rdg n='1'/><rdg n='2'/></app>")
+    assert [rdg.get("n") for rdg in find_elements(root, ".//rdg")] == ["1", "2"]
+
+
+def test_find_elements_plain_in_namespaced():
+    root = ET.fromstring("<app xmlns='http://www.tei-c.org/ns/1.0'><rdg n='1'/></app>")
+    ET.SubElement(root, "note")
+    assert find_element(root, ".//note") is not None
+    assert len(find_elements(root, ".//note")) == 1
+    assert len(find_elements(root, ".//rdg")) == 1
+
+
+def test_tei_tag():
+    assert tei_tag("relation", namespaced=True) == "{http://www.tei-c.org/ns/1.0}relation"
+    assert tei_tag("relation", namespaced=False) == "relation"
+
+
+def test_query():
+    query = Query(".//listRelation[@type='transcriptional']/relation")
+    plain = ET.fromstring("<app><listRelation type='transcriptional'><relation/></listRelation><listRelation type='other'><relation/></listRelation></app>")
+    namespaced = ET.fromstring("<app xmlns='http://www.tei-c.org/ns/1.0'><listRelation type='transcriptional'><relation/></listRelation></app>")
+    assert not is_namespaced(plain)
+    assert is_namespaced(namespaced)
+    assert len(query(plain)) == 1
+    assert len(query(namespaced)) == 1
+    assert query(namespaced, namespaced=False) == []
+    assert query(None) == []
+
+
 def test_get_reading_identifier_with_xml_id():
     reading = ET.Element("rdg", attrib={"{http://www.w3.org/XML/1998/namespace}id": "r1"})
     assert get_reading_identifier(reading) == "r1"
@@ -140,4 +211,64 @@ def test_get_reading_identifier_with_both_attributes():
 def test_extract_text_within_single_word():
     data = "<w><unclear>π</unclear>αυλος</w>"
     element = ET.fromstring(data)
-    assert extract_text(element) == "παυλος"
\ No newline at end of file
+    assert extract_text(element) == "παυλος"
+
+
+def test_write_tei_atomic(tmp_path):
+    doc = ET.ElementTree(ET.fromstring("<TEI><text>Hello</text></TEI>"))
+    output = tmp_path / "sub" / "output.xml"
+    output.parent.mkdir()
+    output.write_text("old")
+    output.chmod(0o640)
+
+    write_tei(doc, output)
+
+    assert output.read_text() == "<?xml version='1.0' encoding='UTF-8'?>\n<TEI>\n  <text>Hello</text>\n</TEI>\n"
+    assert output.stat().st_mode & 0o777 == 0o640
+    assert list(output.parent.iterdir()) == [output]
+
+
+def test_write_tei_atomic_failure_keeps_original(tmp_path, monkeypatch):
+    doc = ET.ElementTree(ET.fromstring("<TEI><text>Hello</text></TEI>"))
+    output = tmp_path / "output.xml"
+    output.write_text("original")
+
+    def fail(*args, **kwargs):
+        raise OSError("disk full")
+
+    monkeypatch.setattr("rdgai.tei.os.replace", fail)
+    with pytest.raises(OSError):
+        write_tei(doc, output)
+
+    assert output.read_text() == "original"
+    assert list(tmp_path.iterdir()) == [output]
+
+
+def test_write_tei_not_atomic(tmp_path):
+    doc = ET.ElementTree(ET.fromstring("<TEI><text>Hello</text></TEI>"))
+    output = tmp_path / "output.xml"
+    write_tei(doc, output, atomic=False)
+    assert "<text>Hello</text>" in output.read_text()
+
+
+def test_context_windows():
+    windows = ContextWindows(["one two", "", "three", "four  five six"])
+    assert windows.before(0) == ""
+    assert windows.before(2) == "one two"
+    assert windows.before(3) == "one two three"
+    assert windows.before(3, width=2) == "two three"
+    assert windows.after(0) == "three four  five six"
+    assert windows.after(1, width=2) == "three four"
+    assert windows.after(3) == ""
+    assert windows.before(None) == "one two three four  five six"
+    assert windows.after(None) == ""
+
+
+def test_context_windows_from_element():
+    ab = ET.fromstring("<ab><w>one</w><app><rdg>two</rdg></app><w>three</w></ab>")
+    windows = ContextWindows.from_element(ab)
+    position = windows.position(ab[1])
+    assert position == 1
+    assert windows.before(position) == "one"
+    assert windows.after(position) == "three"
+    assert windows.position(ET.Element("app")) is None
@@ -1,5 +1,6 @@
 from langchain_core.runnables import RunnableLambda
 from rdgai.validation import validate
+from rdgai.examples import ExampleCache
 
 mock_llm = RunnableLambda(lambda *x, **kwargs: "Multiple_Word_Changes\njustification1")
 
@@ -53,4 +54,9 @@ def test_validate(arb, tmp_path, capsys):
 
 
 
-    
\ No newline at end of file
+    
+
+def test_validate_example_cache(arb, tmp_path):
+    cache_dir = tmp_path / "cache"
+    validate(arb, tmp_path / "output.xml", proportion=0.05, llm=mock_llm, example_cache_dir=cache_dir)
+    assert len(ExampleCache(cache_dir).cache.entries()) > 0
@@ -3,4 +3,42 @@ from pathlib import Path
 TEST_DATA_DIR = Path(__file__).parent / 'test-data'
 
 
-    
\ No newline at end of file
+def make_synthetic_tei(apps:int=10, readings:int=50, categories:int=4, classified:bool=True, named:bool=True) -> str:
+    """
+    Makes a synthetic TEI document with a critical apparatus for tests and benchmarks.
+
+    Each variation unit has the given number of readings.
+    If `classified` is True then every ordered pair of readings in each unit has a relation element.
+    If `named` is False then the app elements have no xml:id or n attribute.
+    """
+    lines = [
+        "<?xml version='1.0' encoding='UTF-8'?>",
+        '<TEI xmlns="http://www.tei-c.org/ns/1.0">',
+        '<teiHeader><fileDesc><titleStmt><title>Synthetic</title></titleStmt></fileDesc></teiHeader>',
+        '<text xml:lang="en">',
+        '<interpGrp type="transcriptional">',
+    ]
+    for category in range(categories):
+        lines.append(f'<interp xml:id="category{category}">Description {category}</interp>')
+    lines.append('</interpGrp>')
+    lines.append('<body><ab n="B1K1V1">')
+
+    for app_index in range(apps):
+        lines.append(f'word{app_index} context{app_index}')
+        name = f' xml:id="app{app_index}"' if named else ""
+        lines.append(f'<app{name}>')
+        for reading in range(1, readings + 1):
+            lines.append(f'<rdg n="{reading}" wit="W{reading}">text {app_index} {reading}</rdg>')
+        if classified:
+            lines.append('<listRelation type="transcriptional">')
+            for active in range(1, readings + 1):
+                for passive in range(1, readings + 1):
+                    if active == passive:
+                        continue
+                    category = (active + passive) % categories
+                    lines.append(f'<relation active="{active}" passive="{passive}" ana="#category{category}"/>')
+            lines.append('</listRelation>')
+        lines.append('</app>')
+
+    lines.append('</ab></body></text></TEI>')
+    return "\n".join(lines)